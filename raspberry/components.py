@@ -1,113 +1,198 @@
-import RPi.GPIO as gpio
-from time import time, sleep
+import hal
+from time import sleep, monotonic
 from robot_utils import *
-from threading import Thread, Event
+from threading import Thread, Event, Condition, Lock
+from collections import deque
+from array import array
 from logger import Logger
-import busio
-import board
-from adafruit_pca9685 import PCA9685 as I2CServoBridge
 
 
 class SoundSensor:
+    """ Samples the sound sensor at a fixed rate into a ring buffer on its own thread.
 
-    def __init__(self, sample_time=10, detection_val=500) -> None:
+    Detection looks at the number of samples that heard sound within the last SAMPLE_TIME millis,
+    so thresholds only depend on the sample rate and not on how fast the caller loops.
+    """
+
+    def __init__(self, sample_time=10, detection_val=500, gpio_backend=None, sample_rate=1000, history_windows=4) -> None:
         self.logger = Logger("Car-SoundSensor")
+        self.gpio = gpio_backend if gpio_backend is not None else hal.load_rpi_gpio()
         # Sensor data
         self.pin = 16
         self.SAMPLE_TIME = sample_time
         self.DETECTION_VALUE = detection_val
+        self.SAMPLE_RATE = sample_rate
+        # Ring buffer of samples, 1 means sound was heard
+        self.window_size = max(1, sample_rate * sample_time // 1000)
+        self.samples = array('B', bytes(self.window_size * history_windows))
+        self.sample_index = 0
         # Runtime
-        self.currentMillis = 0
-        self.lastMillis = 0
-        self.elapsedMillis = 0
-        self.sampleBufferValue = 0
+        self.windowCount = 0
         self.peakAmplitude = 0
+        self.overruns = 0
         self.setup_done = False
+        self.sampler_lock = Lock()
+        self.sampler_thread = None
+        self.sampler_stopped = None  # Every sampler thread gets its own event
+        self.buzzer_detected = Event()
 
     def setup(self):
         if not self.setup_done:
-            gpio.setup(self.pin, gpio.IN)
+            self.gpio.setup(self.pin, self.gpio.IN)
             self.logger.success("Setup was successful.")
             self.setup_done = True
 
+    @property
+    def sampling(self) -> bool:
+        return self.sampler_stopped is not None and not self.sampler_stopped.is_set()
+
+    def start_sampling(self):
+        with self.sampler_lock:
+            if self.sampling:
+                return
+            if self.sampler_thread is not None:
+                # A stopped sampler may still be taking its last sample, it must not write the new buffer
+                self.sampler_thread.join()
+            # Start over with an empty buffer
+            for index in range(len(self.samples)):
+                self.samples[index] = 0
+            self.windowCount = 0
+            self.buzzer_detected.clear()
+            self.sampler_stopped = Event()
+            self.sampler_thread = Thread(name="SoundSampler-Thread", target=self.__sampler_job,
+                                         args=[self.sampler_stopped], daemon=True)
+            self.sampler_thread.start()
+
+    def stop_sampling(self):
+        with self.sampler_lock:
+            if self.sampler_stopped is not None:
+                self.sampler_stopped.set()
+
     def is_buzzer_detected(self) -> bool:
-        self.currentMillis = time() * 1000  # in millis
-        self.elapsedMillis = self.currentMillis - self.lastMillis
-
-        if gpio.input(self.pin) == gpio.LOW:  # Sound has been detected
-            self.sampleBufferValue += 1
-
-        if self.elapsedMillis > self.SAMPLE_TIME:
-            if self.sampleBufferValue > self.peakAmplitude:
-                # Update peak value
-                self.peakAmplitude = self.sampleBufferValue
-            if self.sampleBufferValue >= self.DETECTION_VALUE:
-                self.sampleBufferValue = 0
-                self.lastMillis = self.currentMillis
-                return True  # INFO: Buzzer has been detected
-            self.sampleBufferValue = 0
-            self.lastMillis = self.currentMillis
+        """ Tells whether buzzer was detected since last call """
+        if self.buzzer_detected.is_set():
+            self.buzzer_detected.clear()
+            return True
         return False
 
+    def wait_for_buzzer(self, timeout=None) -> bool:
+        """ Blocks till buzzer is detected or timeout passes without using the CPU """
+        if self.buzzer_detected.wait(timeout):
+            self.buzzer_detected.clear()
+            return True
+        return False
+
+    def __take_sample(self, heard: int):
+        samples = self.samples
+        index = self.sample_index
+        # Keep the count of the last window updated by dropping the sample leaving it
+        self.windowCount += heard - samples[index - self.window_size]
+        samples[index] = heard
+        self.sample_index = (index + 1) % len(samples)
+        if self.windowCount > self.peakAmplitude:
+            # Update peak value
+            self.peakAmplitude = self.windowCount
+        if self.windowCount >= self.DETECTION_VALUE:
+            self.buzzer_detected.set()  # INFO: Buzzer has been detected
+
+    def __sampler_job(self, stopped: Event):
+        period = 1 / self.SAMPLE_RATE
+        deadline = monotonic()
+        while not stopped.is_set():
+            self.__take_sample(1 if self.gpio.input(self.pin) == self.gpio.LOW else 0)  # LOW means sound
+            deadline += period
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            elif delay < -period:
+                # Missed samples, continue from now instead of sampling a burst
+                self.overruns += 1
+                deadline = monotonic()
+
 
 class LineFollowingSensor():
 
-    def __init__(self, pin) -> None:
+    def __init__(self, pin, gpio_backend=None) -> None:
         self.logger = Logger("Car-LineFollowingSensor")
+        self.gpio = gpio_backend if gpio_backend is not None else hal.load_rpi_gpio()
         self.pin = pin
         self.setup_done = False
 
     def setup(self):
         if not self.setup_done:
-            gpio.setup(self.pin, gpio.IN)
+            self.gpio.setup(self.pin, self.gpio.IN)
             self.setup_done = True
             self.logger.success("Setup was successful.")
 
     def is_on_black_line(self):
-        return gpio.input(self.pin) == 1
+        return self.gpio.input(self.pin) == 1
+
+    def on_transition(self, callback):
+        """ Calls callback right after every transition between black line and white ground """
+        self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=lambda pin: callback())
+
+    def remove_transition_callback(self):
+        self.gpio.remove_event_detect(self.pin)
 
 
 class Car:
 
-    def __init__(self) -> None:
+    # Bits of the drive pins in the cached output state
+    BIT_LEFT = 1 << 0
+    BIT_RIGHT = 1 << 1
+    BIT_BACKWARD = 1 << 2
+    BIT_FORWARD = 1 << 3
+
+    def __init__(self, gpio_backend=None, event_driven_lf=True) -> None:
         self.logger = Logger("Car")
+        self.gpio = gpio_backend if gpio_backend is not None else hal.load_rpi_gpio()
         # Driving pins
         self.pin_left = 1
         self.pin_right = 7
         self.pin_backward = 8
         self.pin_forward = 25
+        self.drive_pins = (
+            (self.BIT_LEFT, self.pin_left),
+            (self.BIT_RIGHT, self.pin_right),
+            (self.BIT_BACKWARD, self.pin_backward),
+            (self.BIT_FORWARD, self.pin_forward)
+        )
         # Runtime
         self.is_idle = True
         self.setup_done = False
+        self.output_state = 0  # Levels of drive pins as a bitmask, all LOW after setup
+        self.output_lock = Lock()
         # Sensors
-        self.soundSensor = SoundSensor(15, 100)
-        self.leftLF = LineFollowingSensor(21)
-        self.rightLF = LineFollowingSensor(20)
+        self.soundSensor = SoundSensor(sample_time=50, detection_val=25, gpio_backend=self.gpio, sample_rate=1000)
+        self.leftLF = LineFollowingSensor(21, gpio_backend=self.gpio)
+        self.rightLF = LineFollowingSensor(20, gpio_backend=self.gpio)
         # Inner vars
         self.auto_driver_switcher = Event()
+        self.auto_driver_wakeup = Event()
+        # Follow the line on LF sensors transitions instead of polling them
+        self.event_driven_lf = event_driven_lf
 
     def setup(self):
         if not self.setup_done:
             self.logger.info("Setting up car...")
             # Setup gpio
-            gpio.setmode(gpio.BCM)
+            self.gpio.setmode(self.gpio.BCM)
             # Setup sensors
             self.soundSensor.setup()
             self.leftLF.setup()
             self.rightLF.setup()
             # Setup driving pins
-            gpio.setup(self.pin_left, gpio.OUT)
-            gpio.setup(self.pin_right, gpio.OUT)
-            gpio.setup(self.pin_forward, gpio.OUT)
-            gpio.setup(self.pin_backward, gpio.OUT)
+            for _, pin in self.drive_pins:
+                self.gpio.setup(pin, self.gpio.OUT, initial=self.gpio.LOW)
             # Update runtime
             self.is_idle = True
+            self.output_state = 0
             self.setup_done = True
             self.auto_driver_switcher.clear()
             self.logger.success("Setup was successful.")
 
     def cleanup(self):
-        gpio.cleanup()
+        self.gpio.cleanup()
 
     @property
     def is_auto_driving(self):
@@ -127,40 +212,41 @@ class Car:
         else:
             self.logger.warning(f"Can't decide which direction to go. Input: {direction}")
 
+    def apply_output_state(self, state: int) -> bool:
+        """ Writes only the drive pins whose level differs from the cached output state
+
+        Returns:
+            bool: True if any pin was written, False if car was already in that state
+        """
+        with self.output_lock:
+            changed = state ^ self.output_state
+            if not changed:
+                return False
+            for bit, pin in self.drive_pins:
+                if changed & bit:
+                    self.gpio.output(pin, self.gpio.HIGH if state & bit else self.gpio.LOW)
+            self.output_state = state
+            return True
+
     def activate_brakes(self):
-        gpio.output(self.pin_left, gpio.LOW)
-        gpio.output(self.pin_right, gpio.LOW)
-        gpio.output(self.pin_backward, gpio.LOW)
-        gpio.output(self.pin_forward, gpio.LOW)
-        self.logger.info("Stopped.")
+        if self.apply_output_state(0):
+            self.logger.info("Stopped.")
 
     def drive_forward(self):
-        gpio.output(self.pin_left, gpio.LOW)
-        gpio.output(self.pin_right, gpio.LOW)
-        gpio.output(self.pin_backward, gpio.LOW)
-        gpio.output(self.pin_forward, gpio.HIGH)
-        self.logger.info("Drive Forward.")
+        if self.apply_output_state(self.BIT_FORWARD):
+            self.logger.info("Drive Forward.")
 
     def drive_backward(self):
-        gpio.output(self.pin_left, gpio.LOW)
-        gpio.output(self.pin_right, gpio.LOW)
-        gpio.output(self.pin_backward, gpio.HIGH)
-        gpio.output(self.pin_forward, gpio.LOW)
-        self.logger.info("Drive Backward.")
+        if self.apply_output_state(self.BIT_BACKWARD):
+            self.logger.info("Drive Backward.")
 
     def steer_right(self):
-        gpio.output(self.pin_left, gpio.LOW)
-        gpio.output(self.pin_right, gpio.HIGH)
-        gpio.output(self.pin_backward, gpio.LOW)
-        gpio.output(self.pin_forward, gpio.LOW)
-        self.logger.info("Rotated Right.")
+        if self.apply_output_state(self.BIT_RIGHT):
+            self.logger.info("Rotated Right.")
 
     def steer_left(self):
-        gpio.output(self.pin_left, gpio.HIGH)
-        gpio.output(self.pin_right, gpio.LOW)
-        gpio.output(self.pin_backward, gpio.LOW)
-        gpio.output(self.pin_forward, gpio.LOW)
-        self.logger.info("Rotated left.")
+        if self.apply_output_state(self.BIT_LEFT):
+            self.logger.info("Rotated left.")
 
     def start_automatic_driving(self):
         if self.is_auto_driving:
@@ -172,47 +258,245 @@ class Car:
     def stop_automatic_driving(self):
         if self.is_auto_driving:
             self.auto_driver_switcher.clear()
+            self.auto_driver_wakeup.set()
 
 
 class CarComputerDriver:
 
     def drive_car(self, car: Car):
         car.logger.info("Initializing CarComputerDriver...")
+        car.auto_driver_wakeup.clear()
         car.auto_driver_switcher.set()  # Turn switcher on
         Thread(name="CCD-Thread", target=self.__driver_job, args=[car]).start()
 
+    @staticmethod
+    def follow_line(car: Car, lfReadings):
+        if lfReadings == (0, 0):  # INFO: (Left: WHITE, Right: WHITE)
+            car.drive_forward()
+        elif lfReadings == (0, 1):  # INFO: (Left: WHITE, Right: BLACK)
+            car.steer_right()
+        elif lfReadings == (1, 0):  # INFO: (Left: BLACK, Right: WHITE)
+            car.steer_left()
+        elif lfReadings == (1, 1):  # INFO: (Left: BLACK, Right: BLACK)
+            car.activate_brakes()
+
+    def __on_lf_transition(self, car: Car):
+        if car.auto_driver_switcher.is_set():
+            self.follow_line(car, (car.leftLF.is_on_black_line(), car.rightLF.is_on_black_line()))
+
+    def __follow_line_on_transitions(self, car: Car):
+        """ Steers from the edge callbacks of LF sensors and idles till automatic driving is stopped """
+        car.leftLF.on_transition(lambda: self.__on_lf_transition(car))
+        car.rightLF.on_transition(lambda: self.__on_lf_transition(car))
+        try:
+            # Catch up with the line in case it was reached before callbacks were attached
+            self.__on_lf_transition(car)
+            while car.auto_driver_switcher.is_set():
+                car.auto_driver_wakeup.wait()
+        finally:
+            car.leftLF.remove_transition_callback()
+            car.rightLF.remove_transition_callback()
+
     def __driver_job(self, car: Car):
         car.logger.info("ComputerDriver is now driving the car.")
         lastPeakAmplitude = 0
         car.soundSensor.peakAmplitude = 0
         while car.auto_driver_switcher.is_set():
             if car.is_idle:  # INFO: To stop listening to buzzer while moving
+                car.soundSensor.start_sampling()
+                detected = car.soundSensor.wait_for_buzzer(timeout=0.25)
                 if car.soundSensor.peakAmplitude > lastPeakAmplitude:
                     lastPeakAmplitude = car.soundSensor.peakAmplitude
                     car.logger.info(
                         f"Detected Max-Amplitude of {lastPeakAmplitude} , Target is {car.soundSensor.DETECTION_VALUE}")
-                if car.soundSensor.is_buzzer_detected():
+                if detected:
                     car.is_idle = False
+                    car.soundSensor.stop_sampling()
                     car.logger.info(f"{'=' * 50}\nBUZZER DETECTED !!!\n{'=' * 50}")
+            elif car.event_driven_lf:
+                self.__follow_line_on_transitions(car)
             else:
                 lfReadings = (car.leftLF.is_on_black_line(), car.rightLF.is_on_black_line())
-                car.logger.info(f"LF Readings: {lfReadings}")
-                if lfReadings == (0, 0):  # INFO: (Left: WHITE, Right: WHITE)
-                    car.drive_forward()
-                elif lfReadings == (0, 1):  # INFO: (Left: WHITE, Right: BLACK)
-                    car.steer_right()
-                elif lfReadings == (1, 0):  # INFO: (Left: BLACK, Right: WHITE)
-                    car.steer_left()
-                elif lfReadings == (1, 1):  # INFO: (Left: BLACK, Right: BLACK)
-                    car.activate_brakes()
+                car.logger.debug("LF Readings: %s", lfReadings)
+                self.follow_line(car, lfReadings)
                 sleep(0.1)
+        car.soundSensor.stop_sampling()
         car.soundSensor.peakAmplitude = 0
         car.logger.info("ComputerDriver is no longer driving the car.")
 
 
+class DriveMailbox:
+    """ Latest-wins mailbox of manual driving commands.
+
+    Only the newest direction posted during a control tick gets applied to the car, older ones are
+    coalesced away so no backlog builds up while the operator holds a key. STOP is never coalesced,
+    it preempts whatever is pending and wakes the mailbox thread to apply it without waiting for the
+    tick, so posting never touches the car itself.
+    """
+
+    def __init__(self, car, tick=0.02) -> None:
+        self.car = car
+        self.TICK = tick
+        # Runtime, counters included, guarded by condition
+        self.condition = Condition()
+        self.pending = None
+        self.stops = []  # on_applied of every STOP waiting to be applied
+        self.generation = 0
+        # Counters
+        self.posted = 0
+        self.applied = 0
+        self.coalesced = 0
+        self.dropped = 0
+        Thread(name="DriveMailbox-Thread", target=self.__mailbox_job, daemon=True).start()
+
+    @property
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'posted': self.posted,
+                'applied': self.applied,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped
+            }
+
+    def post(self, direction, on_applied=None):
+        """
+        :param on_applied: Called with the time the direction was applied to the car in microseconds,
+            or 0 if it was coalesced or dropped before being applied
+        """
+        superseded = None
+        with self.condition:
+            self.posted += 1
+            if self.pending is not None:
+                superseded = self.pending[1]
+                self.pending = None
+                if direction != Directions.CMD_STOP:
+                    self.coalesced += 1
+                else:
+                    self.dropped += 1
+            if direction != Directions.CMD_STOP:
+                self.pending = (direction, on_applied)
+            else:
+                # Invalidate the direction being applied if any
+                self.generation += 1
+                self.stops.append(on_applied)
+            self.condition.notify()
+        # Callbacks are called outside the lock so they never delay posting
+        if superseded is not None:
+            superseded(0)
+
+    def clear(self):
+        """ Drops pending direction without applying anything (e.g. when automatic driver takes over) """
+        superseded = None
+        with self.condition:
+            if self.pending is not None:
+                superseded = self.pending[1]
+                self.pending = None
+                self.dropped += 1
+            self.generation += 1
+        if superseded is not None:
+            superseded(0)
+
+    def __next_command(self, next_tick: float):
+        """ Waits for a STOP, or for a direction once the control tick has passed """
+        with self.condition:
+            while True:
+                if self.stops:
+                    stops, self.stops = self.stops, []
+                    return Directions.CMD_STOP, stops, None
+                if self.pending is not None:
+                    delay = next_tick - monotonic()
+                    if delay <= 0:
+                        (direction, on_applied), self.pending = self.pending, None
+                        return direction, [on_applied], self.generation
+                    self.condition.wait(delay)
+                else:
+                    self.condition.wait()
+
+    def __mailbox_job(self):
+        next_tick = 0.0
+        while True:
+            direction, callbacks, generation = self.__next_command(next_tick)
+            if generation is not None:
+                with self.condition:
+                    # Preempted by STOP while waiting for the tick
+                    preempted = generation != self.generation
+                    if preempted:
+                        self.dropped += 1
+                if preempted:
+                    if callbacks[0] is not None:
+                        callbacks[0](0)
+                    continue
+                # Apply at most one direction per control tick
+                next_tick = monotonic() + self.TICK
+            # A STOP posted while the car is driven is picked up right after, so brakes always win
+            self.car.decide_direction(direction)
+            applied_at = now_us()
+            with self.condition:
+                self.applied += len(callbacks)
+            for on_applied in callbacks:
+                if on_applied is not None:
+                    on_applied(applied_at)
+
+
+class HeartbeatWatchdog:
+    """ Detects a WCU that went silent.
+
+    Armed once WCU negotiates heartbeats, every message received from WCU feeds it. When nothing
+    arrives for interval * misses seconds, on_silent is called once on the watchdog thread, right at
+    the deadline, and the watchdog disarms till it's armed again.
+    """
+
+    def __init__(self, on_silent) -> None:
+        """
+        :param on_silent: Called with the seconds WCU has been silent for
+        """
+        self.on_silent = on_silent
+        # Runtime
+        self.condition = Condition()
+        self.timeout = 0.0
+        self.deadline = None
+        # Counters
+        self.fired = 0
+        Thread(name="Heartbeat-Watchdog", target=self.__watchdog_job, daemon=True).start()
+
+    @property
+    def armed(self) -> bool:
+        return self.deadline is not None
+
+    def arm(self, interval: float = HEARTBEAT_INTERVAL, misses: int = HEARTBEAT_MISSES):
+        with self.condition:
+            self.timeout = interval * misses
+            self.deadline = monotonic() + self.timeout
+            self.condition.notify()
+
+    def feed(self):
+        if self.deadline is None:
+            return
+        with self.condition:
+            if self.deadline is not None:
+                # Only moves the deadline later, so the watchdog doesn't need to wake up
+                self.deadline = monotonic() + self.timeout
+
+    def disarm(self):
+        with self.condition:
+            self.deadline = None
+            self.condition.notify()
+
+    def __watchdog_job(self):
+        while True:
+            with self.condition:
+                while self.deadline is None or monotonic() < self.deadline:
+                    self.condition.wait(None if self.deadline is None else self.deadline - monotonic())
+                self.deadline = None
+                self.fired += 1
+                silent_for = self.timeout
+            self.on_silent(silent_for)
+
+
 class Arm:
 
-    def __init__(self):
+    def __init__(self, bridge=None):
         self.logger = Logger('Arm')
         # Servo pulse width
         self.servo_min = 1000
@@ -221,28 +505,95 @@ class Arm:
         self.min_angle = 0
         self.def_angle = 90
         self.max_angle = 180
-        i2c = busio.I2C(board.SCL, board.SDA)
-        self.bridge = I2CServoBridge(i2c)
-        self.bridge.frequency = 50
+        self.bridge = bridge if bridge is not None else hal.create_pca9685_bridge(frequency=50)
+        # Moves are executed by the scheduler so handle_mv never blocks the caller
+        self.scheduler = ArmMotionScheduler(self)
 
-    def handle_mv(self, arm_mv_spec):
+    def handle_mv(self, arm_mv_spec) -> bool:
         """
         :param arm_mv_spec: (jid, ag)
+        :return: True if the move was submitted to the scheduler
         """
         if len(arm_mv_spec) != 2:
-            return
+            return False
         if None in arm_mv_spec:
-            return
+            return False
         joint: str = arm_mv_spec[0]
-        target: int = int(arm_mv_spec[1])
         try:
+            target: int = int(arm_mv_spec[1])
             jid = int(joint.split("_")[1])
-            if jid:
-                self.bridge.channels[jid].duty_cycle = self.angle_to_pluse(180 if target == 1 else 0) # Forward or Reverse
-                sleep(0.1)
-                self.bridge.channels[jid].duty_cycle = self.angle_to_pluse(90)
-        except: 
-            return
-        
+        except:
+            return False
+        if jid:
+            self.scheduler.submit(jid, target)
+            return True
+        return False
+
+    def drive_joint(self, jid: int, angle: int):
+        self.bridge.channels[jid].duty_cycle = self.angle_to_pluse(angle)
+
     def angle_to_pluse(self, angle):
         return int((self.servo_max - self.servo_min) * angle / (self.max_angle - self.min_angle) + self.servo_min)
+
+
+class ArmMotionScheduler:
+    """ Executes arm moves on its own thread.
+
+    Every joint has its own queue of moves. A move drives the joint forward or reverse and
+    recenters it once its deadline passes, without sleeping in between, so moves of different
+    joints run in parallel. Repeated moves in the direction a joint is already moving are
+    coalesced by extending its deadline instead of recentering and driving it again.
+    """
+
+    def __init__(self, arm: Arm, move_duration=0.1) -> None:
+        self.arm = arm
+        self.MOVE_DURATION = move_duration
+        # Runtime
+        self.condition = Condition()
+        self.pending: dict[int, deque] = {}
+        self.moving: dict[int, list] = {}  # jid -> [target, deadline]
+        self.coalesced_moves = 0
+        self.executed_moves = 0
+        Thread(name="ArmMotion-Thread", target=self.__scheduler_job, daemon=True).start()
+
+    def submit(self, jid: int, target: int):
+        with self.condition:
+            self.pending.setdefault(jid, deque()).append(target)
+            self.condition.notify()
+
+    def __next_actions(self, now: float) -> list:
+        actions = []
+        for jid, queue in self.pending.items():
+            move = self.moving.get(jid, None)
+            # Merge moves in the direction the joint is already moving
+            while queue and move is not None and queue[0] == move[0]:
+                queue.popleft()
+                move[1] = max(move[1], now) + self.MOVE_DURATION
+                self.coalesced_moves += 1
+            if move is not None and move[1] > now:
+                continue
+            if queue:
+                # Previous move is done, start the next one without recentering in between
+                target = queue.popleft()
+                self.moving[jid] = [target, now + self.MOVE_DURATION]
+                self.executed_moves += 1
+                actions.append((jid, self.arm.max_angle if target == 1 else self.arm.min_angle))  # Forward or Reverse
+            elif move is not None:
+                del self.moving[jid]
+                actions.append((jid, self.arm.def_angle))
+        return actions
+
+    def __scheduler_job(self):
+        while True:
+            with self.condition:
+                actions = self.__next_actions(monotonic())
+                while not actions:
+                    deadlines = [move[1] for move in self.moving.values()]
+                    self.condition.wait(max(0.0, min(deadlines) - monotonic()) if deadlines else None)
+                    actions = self.__next_actions(monotonic())
+            # Talk to the servo bridge outside the lock so submitting never waits on I2C
+            for jid, angle in actions:
+                try:
+                    self.arm.drive_joint(jid, angle)
+                except Exception as e:
+                    self.arm.logger.error(f"Can't move joint {jid}. Reason: '{e}'")
@@ -0,0 +1,293 @@
+import struct
+from collections import deque
+from threading import Thread, Event
+from time import monotonic, sleep
+
+
+def load_rpi_gpio():
+    """ Imports RPi.GPIO only when real hardware is used so robot modules can be imported off-Pi """
+    import RPi.GPIO as gpio
+    return gpio
+
+
+def create_pca9685_bridge(frequency=50):
+    """ Creates the real PCA9685 servo bridge on the I2C bus of the Pi """
+    import busio
+    import board
+    from adafruit_pca9685 import PCA9685 as I2CServoBridge
+    i2c = busio.I2C(board.SCL, board.SDA)
+    bridge = I2CServoBridge(i2c)
+    bridge.frequency = frequency
+    return bridge
+
+
+def create_picamera():
+    """ Creates the real picamera """
+    from picamera import PiCamera
+    return PiCamera()
+
+
+class SimulatedGPIO:
+    """ In-memory stand-in of the RPi.GPIO module.
+
+    Keeps the level of every pin and counts output writes, so the robot can run and be
+    verified off-Pi. Input levels are driven with set_input or played from scripted traces.
+    """
+
+    # Same values as RPi.GPIO
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self) -> None:
+        self.mode = None
+        self.pin_modes: dict[int, int] = {}
+        self.levels: dict[int, int] = {}
+        self.edge_callbacks: dict[int, tuple] = {}  # pin -> (edge, callback)
+        self.writes = 0
+        self.trace_switcher = Event()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.pin_modes[pin] = direction
+        if direction == self.OUT and initial is not None:
+            self.output(pin, initial)
+
+    def output(self, pin, value):
+        if self.pin_modes.get(pin, None) != self.OUT:
+            raise RuntimeError(f"Pin {pin} wasn't set up as an output.")
+        self.levels[pin] = self.HIGH if value else self.LOW
+        self.writes += 1
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def set_input(self, pin, value):
+        level = self.HIGH if value else self.LOW
+        previous = self.levels.get(pin, self.LOW)
+        self.levels[pin] = level
+        # Fire edge callbacks like RPi.GPIO does on a transition
+        detection = self.edge_callbacks.get(pin, None)
+        if detection is not None and level != previous:
+            edge, callback = detection
+            if edge == self.BOTH or edge == (self.RISING if level == self.HIGH else self.FALLING):
+                callback(pin)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if self.pin_modes.get(pin, None) != self.IN:
+            raise RuntimeError(f"Pin {pin} wasn't set up as an input.")
+        self.edge_callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.edge_callbacks.pop(pin, None)
+
+    def play(self, pin, trace, loop=True):
+        """ Plays a scripted trace on an input pin in the background
+
+        Args:
+            pin (int): Input pin to drive
+            trace (list): Pairs of (level, seconds to hold it)
+            loop (bool, optional): Replays the trace forever when True
+        """
+        self.trace_switcher.set()
+        Thread(name=f"SimTrace-{pin}", target=self.__trace_job, args=[pin, list(trace), loop], daemon=True).start()
+
+    def __trace_job(self, pin, trace, loop):
+        deadline = monotonic()
+        while self.trace_switcher.is_set():
+            for level, duration in trace:
+                self.set_input(pin, level)
+                deadline += duration
+                sleep(max(0.0, deadline - monotonic()))
+                if not self.trace_switcher.is_set():
+                    return
+            if not loop:
+                return
+
+    def cleanup(self):
+        self.trace_switcher.clear()
+        self.edge_callbacks.clear()
+        self.pin_modes.clear()
+        self.levels.clear()
+
+
+class SimulatedServoChannel:
+
+    def __init__(self, index: int, history_size: int) -> None:
+        self.index = index
+        self._duty_cycle = 0
+        # Recorded duty cycles as (monotonic time, duty cycle)
+        self.history = deque(maxlen=history_size)
+
+    @property
+    def duty_cycle(self) -> int:
+        return self._duty_cycle
+
+    @duty_cycle.setter
+    def duty_cycle(self, value: int):
+        self._duty_cycle = value
+        self.history.append((monotonic(), value))
+
+
+class SimulatedServoBridge:
+    """ Stand-in of the PCA9685 bridge that records the duty cycles written to its channels """
+
+    def __init__(self, frequency=50, history_size=1024) -> None:
+        self.frequency = frequency
+        self.channels = [SimulatedServoChannel(index, history_size) for index in range(16)]
+
+
+def synthetic_jpeg(width: int, height: int, frame_number: int = 0, padding: int = 0) -> bytes:
+    """ Builds a valid baseline JPEG of a flat gray image
+
+    Uses single symbol Huffman tables so every 8x8 block is encoded in 2 bits, which keeps
+    building a frame cheap. Padding is appended as comment segments to reach realistic frame sizes.
+    """
+    blocks = ((width + 7) // 8) * ((height + 7) // 8)
+    # Every block is a zero DC difference followed by EOB, both coded as a single 0 bit
+    scan_bits = 2 * blocks
+    scan = bytearray(scan_bits // 8)
+    if scan_bits % 8:
+        scan.append(0xFF >> (scan_bits % 8))
+    segments = [
+        b'\xff\xd8',
+        b'\xff\xfe' + struct.pack(">H", 2 + 24) + f"rloader-sim {frame_number:012d}".encode('ascii'),
+    ]
+    while padding > 0:
+        chunk = min(padding, 0xFFFF - 2)
+        segments.append(b'\xff\xfe' + struct.pack(">H", 2 + chunk) + bytes(chunk))
+        padding -= chunk
+    segments += [
+        b'\xff\xdb' + struct.pack(">HB", 67, 0) + bytes([1] * 64),
+        b'\xff\xc0' + struct.pack(">HBHHBBBB", 11, 8, height, width, 1, 1, 0x11, 0),
+        b'\xff\xc4' + struct.pack(">HB", 20, 0x00) + bytes([1] + [0] * 15) + b'\x00',
+        b'\xff\xc4' + struct.pack(">HB", 20, 0x10) + bytes([1] + [0] * 15) + b'\x00',
+        b'\xff\xda' + struct.pack(">HBBBBBB", 8, 1, 1, 0x00, 0, 63, 0),
+        bytes(scan),
+        b'\xff\xd9',
+    ]
+    return b''.join(segments)
+
+
+class SimulatedCamera:
+    """ Stand-in of PiCamera that produces synthetic JPEG frames at the configured framerate """
+
+    # Size of the buffers the video port encoder hands to the recording output
+    BUFFER_SIZE = 16 * 1024
+
+    def __init__(self, frame_size=30 * 1024) -> None:
+        self.framerate = 30
+        self.vflip = False
+        self.resolution = (640, 480)
+        self.FRAME_SIZE = frame_size
+        self.frames_captured = 0
+        self.closed = False
+        # Recording runtime
+        self.recording_switcher = Event()
+        self.recording_thread = None
+        self.recording_error = None
+        # Quality of recorded frames, scales their size like a real encoder would
+        self.quality = None
+
+    def next_frame(self) -> bytes:
+        width, height = self.resolution
+        frame = synthetic_jpeg(width, height, self.frames_captured)
+        frame_size = self.FRAME_SIZE
+        if self.quality is not None:
+            frame_size = int(frame_size * self.quality / 85)
+        if len(frame) < frame_size:
+            frame = synthetic_jpeg(width, height, self.frames_captured, frame_size - len(frame))
+        self.frames_captured += 1
+        return frame
+
+    def __paced_frames(self, running):
+        deadline = monotonic()
+        while running():
+            deadline += 1 / float(self.framerate)
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                # Fell behind, don't try to catch up with a burst of frames
+                deadline = monotonic()
+            yield self.next_frame()
+
+    def capture_continuous(self, output, format="jpeg", use_video_port=False, **options):
+        """ Writes a frame to output then yields, paced to the framerate, till camera is closed """
+        for frame in self.__paced_frames(lambda: not self.closed):
+            output.write(frame)
+            yield output
+
+    def start_recording(self, output, format="mjpeg", **options):
+        """ Writes MJPEG frames to output in encoder sized buffers from a background thread, like the video port does """
+        if self.recording_switcher.is_set():
+            raise RuntimeError("Camera is already recording.")
+        self.recording_error = None
+        self.quality = options.get('quality', None)
+        self.recording_switcher.set()
+        self.recording_thread = Thread(name="SimCamera-Recording", target=self.__recording_job, args=[output],
+                                       daemon=True)
+        self.recording_thread.start()
+
+    def wait_recording(self, timeout=0):
+        """ Waits while recording and raises the error that stopped the encoder, if any """
+        sleep(timeout)
+        if self.recording_error is not None:
+            raise self.recording_error
+
+    def stop_recording(self):
+        self.recording_switcher.clear()
+        if self.recording_thread is not None:
+            self.recording_thread.join()
+            self.recording_thread = None
+        self.wait_recording()
+
+    def __recording_job(self, output):
+        try:
+            for frame in self.__paced_frames(lambda: self.recording_switcher.is_set() and not self.closed):
+                view = memoryview(frame)
+                for offset in range(0, len(frame), self.BUFFER_SIZE):
+                    output.write(view[offset:offset + self.BUFFER_SIZE])
+            output.flush()
+        except Exception as error:
+            self.recording_error = error
+
+    def close(self):
+        self.closed = True
+        self.recording_switcher.clear()
+
+
+class Backends:
+    """ Set of hardware backends the robot is built on, selected at startup """
+
+    def __init__(self, gpio, create_servo_bridge, create_camera, simulated=False) -> None:
+        self.gpio = gpio
+        self.create_servo_bridge = create_servo_bridge
+        self.create_camera = create_camera
+        self.simulated = simulated
+
+    @classmethod
+    def real(cls):
+        return cls(load_rpi_gpio(), create_pca9685_bridge, create_picamera)
+
+    @classmethod
+    def simulated_with(cls, traces: dict | None = None):
+        """
+        :param traces: {pin: [(level, seconds), ...]} played in a loop on input pins
+        """
+        gpio = SimulatedGPIO()
+        for pin, trace in (traces or {}).items():
+            gpio.play(pin, trace)
+        return cls(gpio, SimulatedServoBridge, SimulatedCamera, simulated=True)
+
+
+def select_backends(simulated: bool, traces: dict | None = None) -> Backends:
+    return Backends.simulated_with(traces) if simulated else Backends.real()
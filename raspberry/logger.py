@@ -1,3 +1,11 @@
+import os
+import sys
+import json
+import struct
+import atexit
+from queue import Queue
+from threading import Thread, Lock
+from time import time, monotonic
 
 
 class TextColor:
@@ -6,27 +14,232 @@ class TextColor:
     YELLOW = '\033[1;33;40m'
     BLUE = '\033[1;34;40m'
     WHITE = '\033[1;37;40m'
-    
+
+
 class BackgroundColor:
     pass
 
+
+class LogLevel:
+    DEBUG = 10
+    INFO = 20
+    SUCCESS = 25
+    WARNING = 30
+    ERROR = 40
+
+    NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', SUCCESS: 'SUCCESS', WARNING: 'WARNING', ERROR: 'ERROR'}
+    COLORS = {DEBUG: TextColor.WHITE, INFO: TextColor.YELLOW, SUCCESS: TextColor.GREEN,
+              WARNING: TextColor.BLUE, ERROR: TextColor.RED}
+
+    @classmethod
+    def from_name(cls, name: str, default: int = INFO) -> int:
+        for level, level_name in cls.NAMES.items():
+            if level_name == name.strip().upper():
+                return level
+        return default
+
+
+class LogRecord:
+
+    __slots__ = ('timestamp', 'level', 'tag', 'msg', 'args', 'suppressed', 'color')
+
+    def __init__(self, timestamp, level, tag, msg, args, suppressed=0, color=None) -> None:
+        self.timestamp = timestamp
+        self.level = level
+        self.tag = tag
+        self.msg = msg
+        self.args = args
+        self.suppressed = suppressed
+        self.color = color
+
+    @property
+    def message(self) -> str:
+        # Formatting is deferred to the writer thread
+        msg = str(self.msg) % self.args if self.args else str(self.msg)
+        if self.suppressed:
+            msg = f"{msg} (suppressed {self.suppressed} similar)"
+        return msg
+
+
+class ConsoleSink:
+
+    def __init__(self, stream=None) -> None:
+        self.stream = stream if stream is not None else sys.stdout
+
+    def write(self, record: LogRecord):
+        color = record.color if record.color is not None else LogLevel.COLORS.get(record.level, TextColor.WHITE)
+        self.stream.write(f"{color}[{record.tag}]: {record.message}{TextColor.WHITE}\n")
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+
+class JsonLinesSink:
+    """ Writes every record as a JSON object per line """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record: LogRecord):
+        self.file.write(json.dumps({
+            'ts': record.timestamp,
+            'level': LogLevel.NAMES.get(record.level, record.level),
+            'tag': record.tag,
+            'msg': record.message
+        }) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BinarySink:
+    """ Writes every record as (timestamp: f64, level: u8, tag length: u16, msg length: u32) then tag and msg """
+
+    RECORD_HEADER = struct.Struct("<dBHI")
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'ab')
+
+    def write(self, record: LogRecord):
+        tag = record.tag.encode('utf-8')
+        msg = record.message.encode('utf-8')
+        self.file.write(self.RECORD_HEADER.pack(record.timestamp, record.level, len(tag), len(msg)) + tag + msg)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LogWriter:
+    """ Writes queued records to every sink from a background thread so logging never waits on I/O """
+
+    def __init__(self) -> None:
+        self.queue = Queue()
+        self.sinks = [ConsoleSink()]
+        self.sinks_lock = Lock()
+        Thread(name="LogWriter-Thread", target=self.__writer_job, daemon=True).start()
+
+    def submit(self, record: LogRecord):
+        self.queue.put(record)
+
+    def add_sink(self, sink):
+        with self.sinks_lock:
+            self.sinks.append(sink)
+
+    def flush(self):
+        """ Blocks till every submitted record was written """
+        self.queue.join()
+
+    def __write(self, record: LogRecord):
+        for sink in self.sinks:
+            try:
+                sink.write(record)
+            except Exception:
+                pass
+
+    def __writer_job(self):
+        while True:
+            record = self.queue.get()
+            written = 1
+            with self.sinks_lock:
+                self.__write(record)
+                # Write whatever piled up meanwhile before flushing once
+                while not self.queue.empty():
+                    self.__write(self.queue.get())
+                    written += 1
+                for sink in self.sinks:
+                    try:
+                        sink.flush()
+                    except Exception:
+                        pass
+            for _ in range(written):
+                self.queue.task_done()
+
+
 class Logger:
-    
-    def __init__(self, tag) -> None:
+    """ Tagged logger.
+
+    Records below the level of the logger are dropped before anything gets formatted, and messages
+    can carry %-style args so formatting happens on the writer thread. Passing every=<seconds>
+    rate limits the calling line, and the number of suppressed records is reported with the next one.
+    """
+
+    level = LogLevel.from_name(os.environ.get('RLOADER_LOG_LEVEL', 'INFO'))
+    writer = LogWriter()
+    rate_limits: dict = {}
+
+    def __init__(self, tag, level=None) -> None:
         self.tag = tag
-        
-    def log(self, msg, text_color = TextColor.WHITE):
-        print(f"{text_color}[{self.tag}]: {msg}{TextColor.WHITE}")
-
-    
-    def success(self, msg):
-        print(f"{TextColor.GREEN}[{self.tag}]: {msg}{TextColor.WHITE}")
-    
-    def error(self, msg):
-        print(f"{TextColor.RED}[{self.tag}]: {msg}{TextColor.WHITE}")
-        
-    def info(self, msg):
-        print(f"{TextColor.YELLOW}[{self.tag}]: {msg}{TextColor.WHITE}")
-        
-    def warning(self, msg):
-        print(f"{TextColor.BLUE}[{self.tag}]: {msg}{TextColor.BLUE}")
\ No newline at end of file
+        if level is not None:
+            self.level = level
+
+    @classmethod
+    def set_level(cls, level: int):
+        cls.level = level
+
+    @classmethod
+    def add_sink(cls, sink):
+        cls.writer.add_sink(sink)
+
+    def is_enabled_for(self, level: int) -> bool:
+        return level >= self.level
+
+    def _emit(self, level, msg, args, every, color=None):
+        suppressed = 0
+        if every:
+            caller = sys._getframe(2)
+            site = (caller.f_code, caller.f_lineno)
+            now = monotonic()
+            limit = Logger.rate_limits.get(site, None)
+            if limit is not None and now - limit[0] < every:
+                limit[1] += 1
+                return
+            if limit is not None:
+                suppressed = limit[1]
+            Logger.rate_limits[site] = [now, 0]
+        self.writer.submit(LogRecord(time(), level, self.tag, msg, args, suppressed, color))
+
+    def log(self, msg, text_color=TextColor.WHITE, every: float = 0):
+        if LogLevel.INFO >= self.level:
+            self._emit(LogLevel.INFO, msg, (), every, text_color)
+
+    def debug(self, msg, *args, every: float = 0):
+        if LogLevel.DEBUG >= self.level:
+            self._emit(LogLevel.DEBUG, msg, args, every)
+
+    def success(self, msg, *args, every: float = 0):
+        if LogLevel.SUCCESS >= self.level:
+            self._emit(LogLevel.SUCCESS, msg, args, every)
+
+    def error(self, msg, *args, every: float = 0):
+        if LogLevel.ERROR >= self.level:
+            self._emit(LogLevel.ERROR, msg, args, every)
+
+    def info(self, msg, *args, every: float = 0):
+        if LogLevel.INFO >= self.level:
+            self._emit(LogLevel.INFO, msg, args, every)
+
+    def warning(self, msg, *args, every: float = 0):
+        if LogLevel.WARNING >= self.level:
+            self._emit(LogLevel.WARNING, msg, args, every)
+
+
+def open_sink(path: str):
+    """ Opens a JSON-lines sink for '.jsonl' paths and a binary sink otherwise """
+    return JsonLinesSink(path) if path.endswith('.jsonl') else BinarySink(path)
+
+
+# Optional file sink configured through environment
+if os.environ.get('RLOADER_LOG_FILE', None):
+    Logger.add_sink(open_sink(os.environ['RLOADER_LOG_FILE']))
+
+# Don't lose records still queued when the process exits
+atexit.register(Logger.writer.flush)
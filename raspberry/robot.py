@@ -1,24 +1,36 @@
-from sockets import ServerSocket, ConnectionClosedUnexpectedlyError, get_my_host
+from sockets import ServerSocket, ConnectionClosedUnexpectedlyError, SocketError, get_my_host
 import robot_utils as utils
-from components import Car, Arm
+from components import Car, Arm, DriveMailbox, HeartbeatWatchdog
 from logger import Logger
 from streamer import Streamer
+from telemetry import TelemetryPublisher
+from robot_server import AsyncRobotServer
+from hal import Backends, select_backends
 from threading import Thread, Event
 from time import sleep
-from socket import gethostbyname, timeout as SocketTimeoutError
+from socket import gethostbyname, SHUT_RDWR, timeout as SocketTimeoutError
 from json import dumps as data2json
+from sys import argv
 
 
 class Robot:
 
-    def __init__(self) -> None:
+    def __init__(self, backends: Backends | None = None, host: str | None = None) -> None:
         self.logger = Logger("Robot")
+        # Hardware backends
+        self.backends = backends if backends is not None else Backends.real()
         # Constants
-        self.host = get_my_host(True)
+        self.host = host if host is not None else get_my_host(True)
         # Robot components
-        self.car = Car()
-        self.arm = Arm()
-        self.streamer = Streamer(address=(self.host, utils.PORT_RTV_SOCKET), resolution=(400, 300))
+        self.car = Car(gpio_backend=self.backends.gpio)
+        self.arm = Arm(bridge=self.backends.create_servo_bridge())
+        self.drive_mailbox = DriveMailbox(self.car)
+        self.heartbeat = HeartbeatWatchdog(self.on_wcu_silent)
+        self.telemetry = TelemetryPublisher(self.car, self.drive_mailbox)
+        # Drops the current WCU connection, set by the server serving it
+        self.drop_wcu = None
+        self.streamer = Streamer(address=(self.host, utils.PORT_RTV_SOCKET), resolution=(400, 300),
+                                 camera=self.backends.create_camera())
         # Server sockets
         self.communicationServer = ServerSocket()
         self.communicationServer.settimeout(20)
@@ -48,66 +60,37 @@ class Robot:
                 connection = self.communicationServer.accept()[0]
                 connection.settimeout(5)
                 connection_switcher.set()
+                # Shutting down wakes the receive below up with an empty packet
+                self.drop_wcu = lambda: connection.shutdown(SHUT_RDWR)
                 self.logger.success("Successfully established a connection with WCU.")
                 # Serve as long as connection is established
                 while connection_switcher.is_set():
                     # Handle connection traffic
                     try:
-                        rcvd_bytes = connection.receive(utils.DEFAULT_BUFFER_SIZE)
+                        rcvd_bytes = connection.receive_message(utils.DEFAULT_BUFFER_SIZE)
                         if rcvd_bytes is None or len(rcvd_bytes) == 0:
                             self.logger.error("Received empty packet which means connection was lost.")
                             raise ConnectionResetError()
+                        self.heartbeat.feed()
                         # Handle received packets here
-                        dataModel = utils.cvt_json2model(rcvd_bytes.decode("utf-8"))
-                        self.logger.info(f"Received from WCU: {dataModel}")
-                        # Handle incoming signal
-                        if dataModel.signal:
-                            # Start stream signal
-                            if dataModel.signal == utils.Signals.SIGNAL_START_STREAM:
-                                # Send ACK signal back to WCU
-                                if not connection.send(utils.Signals.SIGNAL_ACK):
-                                    connection.close()
-                                    self.logger.error("Can't send 'ACK' signal to WCU. Seems like connection was lost.")
-                                    break
-                                self.streamer.start_stream()
-                            # Close stream signal
-                            elif dataModel.signal == utils.Signals.SIGNAL_CLOSE_STREAM:
-                                # Send ACK signal back to WCU
-                                if not connection.send(utils.Signals.SIGNAL_ACK):
-                                    connection.close()
-                                    self.logger.error("Can't send 'ACK' signal to WCU. Seems like connection was lost.")
-                                    break
-                                self.streamer.stop_stream()
-                            # Switch control mode signal
-                            elif dataModel.signal == utils.Signals.SIGNAL_SWITCH_CONTROL_MODE:
-                                # Send ACK signal back to WCU
-                                if not connection.send(utils.Signals.SIGNAL_ACK):
-                                    connection.close()
-                                    self.logger.error("Can't send ACK signal to WCU. Seems like connection was lost.")
-                                    break
-                                # Switch control mode
-                                if not self.car.is_auto_driving:
-                                    # Start automatic driver
-                                    self.car.start_automatic_driving()
-                                    # Log
-                                    self.logger.success("Started Automatic Driver.")
-                                else:
-                                    # Stop automatic driver
-                                    self.car.stop_automatic_driving()
-                                    # Log
-                                    self.logger.success("Stopped Automatic Driver.")
-                            elif dataModel.signal == utils.Signals.SIGNAL_DISCONNECT:
-                                self.power_off()
-                        # Handle manual driver commands
-                        if dataModel.cmd and not self.car.is_auto_driving:
-                            self.car.decide_direction(dataModel.cmd)
-                        # Handle Arm movement
-                        if dataModel.is_arm_cmd:
-                            self.arm.handle_mv(dataModel.arm_mv_spec)
-                    except (ConnectionResetError, ConnectionAbortedError, ConnectionRefusedError):
+                        trace, payload = utils.split_trace(rcvd_bytes, utils.now_us())
+                        rid, payload = utils.split_request(payload)
+                        dataModel = utils.cvt_payload2model(payload)
+                        if trace is not None:
+                            trace.decoded_at = utils.now_us()
+                        self.logger.debug("Received from WCU: %s", dataModel)
+                        link = connection if rid is None else utils.ReplyLink(connection, rid)
+                        if not self.handle_data_model(dataModel, link, trace=trace):
+                            self.on_wcu_disconnected()
+                            connection.close()
+                            self.logger.error("Can't send ACK signal to WCU. Seems like connection was lost.")
+                            break
+                    except (ConnectionResetError, ConnectionAbortedError, ConnectionRefusedError, BrokenPipeError):
                         connection_switcher.clear()
+                        self.on_wcu_disconnected()
                         connection.close()
                         self.logger.error("Connection was closed unexpectedly.")
+                        self.logger.info(f"Drive commands: {self.drive_mailbox.stats}")
                         break
                     except (TimeoutError, SocketTimeoutError):
                         continue
@@ -125,7 +108,155 @@ class Robot:
             except (ConnectionAbortedError, ConnectionRefusedError, ConnectionResetError) as e:
                 self.logger.error(f"Faced an error while establishing connection. Reason: '{e}'")
 
+    def handle_data_model(self, dataModel: utils.DataModel, connection, arm_executor=None,
+                          trace: utils.Trace | None = None) -> bool:
+        """ Handles a single model received from WCU
+
+        Args:
+            dataModel (DataModel): Received model
+            connection: Anything with a send_message method to send ACK signals through
+            arm_executor (Executor, optional): Runs arm movement on it instead of the calling thread
+            trace (Trace, optional): Stamps of a traced command, echoed back once the command is actuated
+
+        Returns:
+            bool: False if an ACK signal couldn't be sent back to WCU, True otherwise
+        """
+        # Handle incoming signal
+        if dataModel.signal:
+            # Start stream signal
+            if dataModel.signal == utils.Signals.SIGNAL_START_STREAM:
+                # Stream is requested before ACK, so WCU connecting right after it is never refused
+                self.streamer.start_stream()
+                # Send ACK signal back to WCU
+                if not connection.send_message(utils.Signals.SIGNAL_ACK):
+                    self.streamer.stop_stream()
+                    return False
+            # Close stream signal
+            elif dataModel.signal == utils.Signals.SIGNAL_CLOSE_STREAM:
+                # Send ACK signal back to WCU
+                if not connection.send_message(utils.Signals.SIGNAL_ACK):
+                    return False
+                self.streamer.stop_stream()
+            # Switch control mode signal
+            elif dataModel.signal == utils.Signals.SIGNAL_SWITCH_CONTROL_MODE:
+                # Send ACK signal back to WCU
+                if not connection.send_message(utils.Signals.SIGNAL_ACK):
+                    return False
+                # Switch control mode
+                if not self.car.is_auto_driving:
+                    # Start automatic driver
+                    self.drive_mailbox.clear()
+                    self.car.start_automatic_driving()
+                    # Log
+                    self.logger.success("Started Automatic Driver.")
+                else:
+                    # Stop automatic driver
+                    self.car.stop_automatic_driving()
+                    # Log
+                    self.logger.success("Stopped Automatic Driver.")
+            elif dataModel.signal == utils.Signals.SIGNAL_DISCONNECT:
+                self.power_off()
+            # Negotiate encoding signal
+            elif dataModel.signal == utils.Signals.SIGNAL_NEGOTIATE_ENCODING:
+                # Both encodings are always decoded, so just tell WCU whether the requested one is known
+                if dataModel.data.get('enc', None) in (utils.Encodings.JSON, utils.Encodings.BINARY):
+                    if not connection.send_message(utils.Signals.SIGNAL_ACK):
+                        return False
+            # Heartbeat signal
+            elif dataModel.signal == utils.Signals.SIGNAL_HEARTBEAT:
+                # Negotiating heartbeats arms the watchdog, plain heartbeats only feed it as any message does
+                if dataModel.data is not None and 'interval' in dataModel.data:
+                    interval = float(dataModel.data.get('interval', utils.HEARTBEAT_INTERVAL))
+                    misses = int(dataModel.data.get('misses', utils.HEARTBEAT_MISSES))
+                    self.heartbeat.arm(interval, misses)
+                    self.logger.info(f"WCU sends heartbeats every {interval} s, brakes after {misses} are missed.")
+                if not connection.send_message(utils.Signals.SIGNAL_HEARTBEAT):
+                    return False
+            # Telemetry signal
+            elif dataModel.signal == utils.Signals.SIGNAL_TELEMETRY:
+                if not connection.send_message(utils.Signals.SIGNAL_ACK):
+                    return False
+                options = dataModel.data if dataModel.data is not None else {}
+                # Telemetry is pushed without request ids
+                link = connection.connection if isinstance(connection, utils.ReplyLink) else connection
+                self.telemetry.start(link, float(options.get('rate', utils.TELEMETRY_RATE)),
+                                     int(options.get('batch', utils.TELEMETRY_BATCH)))
+            # Trace and request ids signals
+            elif dataModel.signal in (utils.Signals.SIGNAL_TRACE, utils.Signals.SIGNAL_REQUEST_IDS):
+                # Traced commands and requests are always understood, so just ACK
+                if not connection.send_message(utils.Signals.SIGNAL_ACK):
+                    return False
+            # Stream status signal
+            elif dataModel.signal == utils.Signals.SIGNAL_STREAM_STATUS:
+                # Reply with the operating point the stream is adapted to
+                stream = self.streamer.controller.status()
+                stream['clients'] = self.streamer.broadcaster.stats()
+                status = {"signal": utils.Signals.SIGNAL_STREAM_STATUS, "stream": stream}
+                if not connection.send_message(data2json(status)):
+                    return False
+        # Handle manual driver commands
+        if dataModel.cmd and not self.car.is_auto_driving:
+            on_applied = None
+            if trace is not None:
+                on_applied = lambda applied_at: self.__echo_trace(connection, trace, applied_at)
+            self.drive_mailbox.post(dataModel.cmd, on_applied)
+        # Handle Arm movement
+        elif dataModel.is_arm_cmd:
+            if arm_executor is not None:
+                arm_executor.submit(self.__handle_arm_mv, dataModel.arm_mv_spec, connection, trace)
+            else:
+                self.__handle_arm_mv(dataModel.arm_mv_spec, connection, trace)
+        # Nothing to actuate
+        elif trace is not None:
+            self.__echo_trace(connection, trace, 0)
+        return True
+
+    def __handle_arm_mv(self, arm_mv_spec, connection, trace: utils.Trace | None):
+        submitted = self.arm.handle_mv(arm_mv_spec)
+        if trace is not None:
+            # Arm moves are stamped once the scheduler has them, the servo is driven on its next pass
+            self.__echo_trace(connection, trace, utils.now_us() if submitted else 0)
+
+    def __echo_trace(self, connection, trace: utils.Trace, actuated_at: int):
+        try:
+            connection.send_message(trace.echo(actuated_at))
+        except (OSError, SocketError):
+            # Connection is gone, nobody is waiting for the echo
+            pass
+
+    def power_on_async(self):
+        """ Same as power_on but serves control and video ports concurrently on an asyncio event loop """
+        self.__enter__()
+        self.power_on_switcher.set()
+        # Setup the car
+        self.car.setup()
+        # Serve till robot is powered off
+        try:
+            AsyncRobotServer(self).run()
+        except KeyboardInterrupt:
+            self.logger.error("Process terminated by user.")
+            self.power_off()
+            exit(1)
+
+    def on_wcu_disconnected(self):
+        """ Stops everything that serves the WCU connection that just ended """
+        self.heartbeat.disarm()
+        self.telemetry.stop()
+
+    def on_wcu_silent(self, silent_for: float):
+        """ Brakes and drops the connection of a WCU that missed its heartbeats """
+        self.logger.error(f"WCU missed its heartbeats for {silent_for:.2f} s. Activating brakes.")
+        if not self.car.is_auto_driving:
+            self.drive_mailbox.post(utils.Directions.CMD_STOP)
+        drop_wcu = self.drop_wcu
+        if drop_wcu is not None:
+            try:
+                drop_wcu()
+            except OSError:
+                pass
+
     def power_off(self):
+        self.streamer.close()
         self.car.cleanup()
         self.power_on_switcher.clear()
 
@@ -144,5 +275,25 @@ class Robot:
         exit("Robot worked well till termination.")
 
 
+# Input traces played on simulated pins as [(level, seconds), ...]
+SIMULATED_TRACES = {
+    16: [(1, 3.0), (0, 0.5)],  # Sound sensor: quiet, then a buzzer (LOW means sound)
+    21: [(0, 0.8), (1, 0.15), (0, 1.0)],  # Left LF sensor
+    20: [(0, 1.2), (1, 0.15), (0, 0.6)],  # Right LF sensor
+}
+
+
 if __name__ == '__main__':
-    Robot().power_on()
+    # Run on simulated hardware with --sim so the whole robot stack works on any Linux box
+    simulated = '--sim' in argv
+    robot = Robot(backends=select_backends(simulated, SIMULATED_TRACES),
+                  host='0.0.0.0' if simulated else None)
+    # Capture stills from the still port with --stills instead of recording MJPEG from the video port
+    robot.streamer.mjpeg = '--stills' not in argv
+    # Let other stations like a supervisor watch the stream along with WCU with --broadcast
+    if '--broadcast' in argv:
+        robot.streamer.max_clients = robot.streamer.BROADCAST_CLIENTS
+    if '--async' in argv:
+        robot.power_on_async()
+    else:
+        robot.power_on()
@@ -0,0 +1,163 @@
+import socket
+import asyncio
+import robot_utils as utils
+from time import monotonic
+from logger import Logger
+from sockets import MessageFramer, get_send_backlog
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncConnectionLink:
+    """ Gives an asyncio stream writer the send_message interface of ClientSocket """
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+
+    def send_message(self, data) -> int:
+        if self.writer.is_closing():
+            return 0
+        frame = MessageFramer.frame(data)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.writer.write(frame)
+        else:
+            # Called from another thread (e.g. a trace echo once a command is actuated)
+            try:
+                self.loop.call_soon_threadsafe(self.__write, frame)
+            except RuntimeError:
+                # Event loop is already closed
+                return 0
+        return len(frame)
+
+    def __write(self, frame: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    def abort(self):
+        """ Drops the connection from any thread, the serving coroutine reads an empty packet """
+        try:
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+        except RuntimeError:
+            # Event loop is already closed
+            pass
+
+
+class AsyncRobotServer:
+    """ Serves the control port and the video port of a Robot concurrently on one event loop.
+
+    Commands are handled as soon as they arrive. Driving goes through the robot's DriveMailbox and
+    arm movement runs on a dedicated executor, so a slow arm movement never delays driving commands.
+    """
+
+    def __init__(self, robot) -> None:
+        self.logger = Logger("AsyncRobotServer")
+        self.robot = robot
+        self.control_address = (robot.host, utils.PORT_DATA_SOCKET)
+        self.video_address = robot.streamer.address
+        # Executors
+        self.arm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Arm")
+        # Waits for frames of stream clients, one worker per client
+        self.frames_executor = ThreadPoolExecutor(max_workers=robot.streamer.BROADCAST_CLIENTS,
+                                                  thread_name_prefix="Frames")
+        # Runtime
+        self.stop_event = None
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.arm_executor.shutdown(wait=False)
+            self.frames_executor.shutdown(wait=False)
+
+    async def serve(self):
+        self.stop_event = asyncio.Event()
+        # Video port is served here instead of by a StreamerHandler per stream
+        self.robot.streamer.served_externally = True
+        controlServer = await asyncio.start_server(self._serve_control, *self.control_address, reuse_address=True)
+        videoServer = await asyncio.start_server(self._serve_video, *self.video_address, reuse_address=True)
+        self.logger.info(f"Serving control on {self.control_address} and video on {self.video_address} ...")
+        async with controlServer, videoServer:
+            await self.stop_event.wait()
+        self.logger.info("Server has stopped.")
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def _serve_control(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.logger.success("Successfully established a connection with WCU.")
+        framer = MessageFramer()
+        link = AsyncConnectionLink(writer)
+        self.robot.drop_wcu = link.abort
+        try:
+            while True:
+                rcvd_bytes = await reader.read(utils.DEFAULT_BUFFER_SIZE)
+                if not rcvd_bytes:
+                    self.logger.error("Received empty packet which means connection was lost.")
+                    break
+                self.robot.heartbeat.feed()
+                received_at = utils.now_us()
+                for payload in framer.feed(rcvd_bytes):
+                    trace, payload = utils.split_trace(payload, received_at)
+                    rid, payload = utils.split_request(payload)
+                    dataModel = utils.cvt_payload2model(payload)
+                    if trace is not None:
+                        trace.decoded_at = utils.now_us()
+                    self.logger.debug("Received from WCU: %s", dataModel)
+                    reply_link = link if rid is None else utils.ReplyLink(link, rid)
+                    if not self.robot.handle_data_model(dataModel, reply_link, self.arm_executor, trace):
+                        self.logger.error("Can't send ACK signal to WCU. Seems like connection was lost.")
+                        return
+                    if not self.robot.power_on_switcher.is_set():
+                        self.stop()
+                        return
+                await writer.drain()
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            self.logger.error("Connection was closed unexpectedly.")
+        finally:
+            if self.robot.drop_wcu == link.abort:
+                self.robot.on_wcu_disconnected()
+                self.robot.drop_wcu = None
+            writer.close()
+            self.logger.info(f"Drive commands: {self.robot.drive_mailbox.stats}")
+
+    async def _serve_video(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        streamer = self.robot.streamer
+        # WCU only connects to the video port after its start stream signal was ACKed
+        if not streamer.streaming:
+            self.logger.warning("Refused a stream connection since no stream was requested.")
+            writer.close()
+            return
+        if len(streamer.broadcaster.subscribers) >= streamer.max_clients:
+            self.logger.warning("Refused a stream connection since stream is full.")
+            writer.close()
+            return
+        # Keep frames from piling up in kernel where they can't be dropped anymore
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, utils.STREAM_SEND_BUFFER_SIZE)
+        loop = asyncio.get_running_loop()
+        host, port = writer.get_extra_info('peername')[:2]
+        subscription = streamer.broadcaster.subscribe(f"{host}:{port}")
+        try:
+            while streamer.streaming:
+                frame = await loop.run_in_executor(self.frames_executor, subscription.frames.get, streamer.FRAME_TIMEOUT)
+                if frame is None:
+                    break
+                send_start = monotonic()
+                writer.write(utils.FRAME_HEADER.pack(len(frame), frame.timestamp))
+                writer.write(frame.data)
+                await writer.drain()
+                subscription.on_frame_sent(len(frame))
+                if subscription is streamer.broadcaster.primary:
+                    backlog = writer.transport.get_write_buffer_size() + get_send_backlog(writer.get_extra_info('socket'))
+                    streamer.controller.on_frame_sent(len(frame), monotonic() - send_start, backlog)
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            streamer.logger.error(f"Connection with client '{subscription.name}' was closed unexpectedly.")
+        finally:
+            if not streamer.broadcaster.unsubscribe(subscription):
+                # Stream is over once every client has left
+                streamer.stop_stream()
+            writer.close()
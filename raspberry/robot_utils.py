@@ -1,7 +1,15 @@
 import json as JSON
+import struct
+from time import monotonic_ns
 
 DEFAULT_BUFFER_SIZE = 1024  # 1 KB per buffer
 FRAME_BUFFER_SIZE = 128 * 1024  # 128 KB per buffer
+FRAME_HEADER = struct.Struct("<LQ")  # Frame size and capture time in microseconds since epoch
+STREAM_SEND_BUFFER_SIZE = 64 * 1024  # Kernel send buffer of stream sockets, roughly a couple of frames
+HEARTBEAT_INTERVAL = 0.25  # Seconds between heartbeats of WCU unless it negotiates its own
+HEARTBEAT_MISSES = 4  # Missed heartbeats before WCU is considered gone
+TELEMETRY_RATE = 20  # Telemetry samples per second unless WCU asks for another rate
+TELEMETRY_BATCH = 10  # Telemetry samples per pushed batch
 PORT_DATA_SOCKET = 2001
 PORT_RTV_SOCKET = 2005
 
@@ -13,6 +21,12 @@ class Signals:
     SIGNAL_SWITCH_CONTROL_MODE = 'SCM'
     SIGNAL_DISCONNECT = 'BYE'
     SIGNAL_ACK = 'ACK'
+    SIGNAL_NEGOTIATE_ENCODING = 'ENC'
+    SIGNAL_STREAM_STATUS = 'SST'
+    SIGNAL_TRACE = 'TRC'
+    SIGNAL_REQUEST_IDS = 'RID'
+    SIGNAL_HEARTBEAT = 'HB'
+    SIGNAL_TELEMETRY = 'TLM'
 
 
 class Directions:
@@ -29,29 +43,195 @@ class ControlModes:
     CONTROL_MODE_AUTOMATIC = 'acm'
 
 
+class Encodings:
+    """ Payload encodings that WCU and Robot can negotiate for the control channel """
+    JSON = 'json'
+    BINARY = 'bin'
+
+
+class Opcodes:
+    """ Opcodes of the binary encoding. Every command fits in a few bytes:
+    directions and signals are a single opcode byte, arm moves are (opcode, joint id, operation)
+    """
+    DIRECTIONS = {
+        Directions.CMD_DRIVE_FORWARD: 0x01,
+        Directions.CMD_DRIVE_BACKWARD: 0x02,
+        Directions.CMD_ROTATE_RIGHT: 0x03,
+        Directions.CMD_ROTATE_LEFT: 0x04,
+        Directions.CMD_STOP: 0x05,
+    }
+    SIGNALS = {
+        Signals.SIGNAL_START_STREAM: 0x10,
+        Signals.SIGNAL_CLOSE_STREAM: 0x11,
+        Signals.SIGNAL_SWITCH_CONTROL_MODE: 0x12,
+        Signals.SIGNAL_DISCONNECT: 0x13,
+        Signals.SIGNAL_ACK: 0x14,
+        Signals.SIGNAL_STREAM_STATUS: 0x15,
+        Signals.SIGNAL_TRACE: 0x16,
+        Signals.SIGNAL_REQUEST_IDS: 0x17,
+        Signals.SIGNAL_HEARTBEAT: 0x18,
+        Signals.SIGNAL_TELEMETRY: 0x19,
+    }
+    ARM_MOVE = 0x20
+    ARM_MOVE_STRUCT = struct.Struct("<BBb")
+    # Traced commands are (opcode, seq, WCU send time) followed by the command payload of either encoding
+    TRACE = 0x30
+    TRACE_STRUCT = struct.Struct("<BIQ")
+    # Echo of a traced command: (opcode, seq, WCU send time, received, decoded, actuated, echoed) in robot time
+    TRACE_ECHO = 0x31
+    TRACE_ECHO_STRUCT = struct.Struct("<BIQQQQQ")
+    # Requests are (opcode, request id) followed by the signal payload of either encoding,
+    # replies are (opcode, request id) followed by the reply
+    REQUEST = 0x32
+    REPLY = 0x33
+    REQUEST_STRUCT = struct.Struct("<BH")
+    # Telemetry batches are (opcode, record count) followed by the delta encoded records
+    TELEMETRY = 0x34
+    TELEMETRY_STRUCT = struct.Struct("<BH")
+
+
+class Telemetry:
+    """ Telemetry records pushed by robot.
+
+    Every record is a varint bitmask of the fields that changed since the previous record, followed by
+    the zigzag varint delta of every changed field in FIELDS order. First record of a batch is delta
+    encoded against zeros, so every batch decodes on its own.
+    """
+    FIELDS = (
+        'time_us',  # Robot monotonic time of the sample
+        'flags',  # FLAG_* bits and drive output state
+        'sound',  # Samples that heard sound in the last sound window
+        'sound_peak',  # Peak of sound since automatic driving started
+        'sound_target',  # Sound needed to detect the buzzer
+        'sound_overruns',  # Times the sound sampler fell behind
+        'lateness_us',  # How late this sample was taken, i.e. telemetry loop jitter
+        'applied',  # Drive commands applied by the DriveMailbox
+        'coalesced',  # Drive commands coalesced by the DriveMailbox
+    )
+    FLAG_LEFT_LF = 1 << 0  # Left LF sensor is on black line
+    FLAG_RIGHT_LF = 1 << 1  # Right LF sensor is on black line
+    FLAG_IDLE = 1 << 2  # Car is waiting for the buzzer
+    FLAG_AUTO = 1 << 3  # Automatic driver is driving
+    FLAG_SAMPLING = 1 << 4  # Sound sensor is sampling
+    OUTPUT_SHIFT = 5  # Drive output state bits start here
+
+
 class DataModel:
 
+    __slots__ = ('data', 'signal', 'cmd', 'is_arm_cmd', 'arm_mv_spec')
+
     def __init__(self, data) -> None:
+        # Fields are resolved once here instead of on every access
         self.data = data
+        self.signal = data.get('signal', None)
+        self.cmd = data.get('cmd', None)
+        self.is_arm_cmd = ('arm' in data) and ('jid' in data) and ('ag' in data)
+        self.arm_mv_spec = (data.get('jid', None), data.get('ag', None))
 
-    @property
-    def signal(self) -> str:
-        return self.data.get('signal', None)
+    @classmethod
+    def from_fields(cls, signal=None, cmd=None, arm_mv_spec=None):
+        model = cls.__new__(cls)
+        model.data = None
+        model.signal = signal
+        model.cmd = cmd
+        model.is_arm_cmd = arm_mv_spec is not None
+        model.arm_mv_spec = arm_mv_spec if arm_mv_spec is not None else (None, None)
+        return model
 
-    @property
-    def cmd(self) -> str:
-        return self.data.get('cmd', None)
+    @classmethod
+    def from_binary(cls, raw: bytes):
+        # Single byte commands are decoded with a table lookup
+        model = _BINARY_MODELS.get(raw, None)
+        if model is not None:
+            return model
+        if len(raw) == Opcodes.ARM_MOVE_STRUCT.size and raw[0] == Opcodes.ARM_MOVE:
+            _, jid, ag = Opcodes.ARM_MOVE_STRUCT.unpack(raw)
+            return cls.from_fields(arm_mv_spec=(f"joint_{jid}", ag))
+        return EMPTY_MODEL
 
-    @property
-    def is_arm_cmd(self) -> bool:
-        return ('arm' in self.data) and ('jid' in self.data) and ('ag' in self.data)
+    def __repr__(self):
+        if self.data is not None:
+            return f"DataModel({self.data})"
+        return f"DataModel(signal={self.signal}, cmd={self.cmd}, arm_mv_spec={self.arm_mv_spec})"
 
-    @property
-    def arm_mv_spec(self):
-        return self.data.get('jid', None), self.data.get('ag', None)
 
-    def __repr__(self):
-        return f"DataModel({self.data})"
+class Trace:
+    """ Robot side stamps of a traced command, all in microseconds of the robot's monotonic clock """
+
+    __slots__ = ('seq', 'sent_at', 'received_at', 'decoded_at')
+
+    def __init__(self, seq: int, sent_at: int, received_at: int) -> None:
+        self.seq = seq
+        # WCU's own clock, echoed back untouched
+        self.sent_at = sent_at
+        self.received_at = received_at
+        self.decoded_at = 0
+
+    def echo(self, actuated_at: int = 0) -> bytes:
+        """ Builds the echo sent back to WCU. actuated_at is 0 when the command was never applied """
+        return Opcodes.TRACE_ECHO_STRUCT.pack(Opcodes.TRACE_ECHO, self.seq, self.sent_at, self.received_at,
+                                              self.decoded_at, actuated_at, now_us())
+
+
+def now_us() -> int:
+    return monotonic_ns() // 1000
+
+
+def split_trace(raw_payload: bytes, received_at: int) -> tuple:
+    """ Strips the trace header of a traced command
+
+    Returns:
+        tuple: (Trace or None if the payload isn't traced, command payload)
+    """
+    if len(raw_payload) > Opcodes.TRACE_STRUCT.size and raw_payload[0] == Opcodes.TRACE:
+        _, seq, sent_at = Opcodes.TRACE_STRUCT.unpack_from(raw_payload)
+        return Trace(seq, sent_at, received_at), raw_payload[Opcodes.TRACE_STRUCT.size:]
+    return None, raw_payload
+
+
+def split_request(raw_payload: bytes) -> tuple:
+    """ Strips the request header of a request
+
+    Returns:
+        tuple: (Request id or None if the payload isn't a request, signal payload)
+    """
+    if len(raw_payload) > Opcodes.REQUEST_STRUCT.size and raw_payload[0] == Opcodes.REQUEST:
+        _, rid = Opcodes.REQUEST_STRUCT.unpack_from(raw_payload)
+        return rid, raw_payload[Opcodes.REQUEST_STRUCT.size:]
+    return None, raw_payload
+
+
+def write_varint(out: bytearray, value: int):
+    """ Appends a non negative int 7 bits per byte, lowest first """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag(value: int) -> int:
+    """ Maps signed ints to non negative ones so small deltas of either sign stay short """
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+class ReplyLink:
+    """ Connection to reply a request through, so every reply carries the id of its request """
+
+    def __init__(self, connection, rid: int) -> None:
+        self.connection = connection
+        self.header = Opcodes.REQUEST_STRUCT.pack(Opcodes.REPLY, rid)
+
+    def send_message(self, data) -> int:
+        if type(data) is str:
+            data = data.encode('utf-8')
+        return self.connection.send_message(self.header + data)
+
+
+EMPTY_MODEL = DataModel.from_fields()
+_BINARY_MODELS = {
+    **{bytes([opcode]): DataModel.from_fields(cmd=cmd) for cmd, opcode in Opcodes.DIRECTIONS.items()},
+    **{bytes([opcode]): DataModel.from_fields(signal=signal) for signal, opcode in Opcodes.SIGNALS.items()},
+}
 
 
 def cvt_json2model(raw_json):
@@ -61,3 +241,17 @@ def cvt_json2model(raw_json):
         return DataModel(JSON.loads(raw_json))
     except JSON.JSONDecodeError:
         return DataModel({})
+
+
+def cvt_payload2model(raw_payload: bytes):
+    """ Builds a DataModel from a received payload of either encoding.
+    JSON payloads always start with '{' which no binary opcode uses.
+    """
+    if not raw_payload:
+        return EMPTY_MODEL
+    if raw_payload[0] == 0x7B:  # '{'
+        try:
+            return cvt_json2model(raw_payload.decode("utf-8"))
+        except UnicodeDecodeError:
+            return EMPTY_MODEL
+    return DataModel.from_binary(raw_payload)
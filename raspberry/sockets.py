@@ -1,5 +1,10 @@
 import socket as sockets
+import struct
+import fcntl
+import termios
 import uuid
+from collections import deque
+from threading import Lock
 
 def get_my_addr():
     return sockets.gethostbyaddr(sockets.gethostname())
@@ -7,6 +12,18 @@ def get_my_addr():
 def get_my_host(static: bool = False):
     return sockets.gethostname() if not static else '192.168.188.141'
 
+def get_send_backlog(socket) -> int:
+    """ Tells how many bytes are still waiting in the kernel send buffer of a socket
+
+    Returns:
+        int: Unsent bytes, or 0 where the platform can't tell
+    """
+    try:
+        backlog = struct.unpack("i", fcntl.ioctl(socket.fileno(), termios.TIOCOUTQ, b'\x00' * 4))[0]
+        return max(0, backlog)
+    except (OSError, AttributeError):
+        return 0
+
 class SocketError(Exception):
     """ Socket Error """
 
@@ -17,6 +34,52 @@ class SocketError(Exception):
 class ConnectionClosedUnexpectedlyError(SocketError):
     pass
 
+class MessageFramer:
+    """ Incremental parser for length-prefixed messages sent over a stream socket """
+
+    HEADER = struct.Struct("<H")
+    MAX_MESSAGE_SIZE = 0xFFFF
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    @classmethod
+    def frame(cls, payload) -> bytes:
+        """ Prefixes the payload with its length so it can be split again on the other end
+
+        Raises:
+            SocketError: If payload can't fit in a single frame
+        """
+        if type(payload) is str:
+            payload = payload.encode('utf-8')
+        if len(payload) > cls.MAX_MESSAGE_SIZE:
+            raise SocketError(f"Message of size {len(payload)} exceeds the max frame size.")
+        return cls.HEADER.pack(len(payload)) + payload
+
+    def feed(self, data: bytes) -> list:
+        """ Appends received bytes and returns every message that became complete
+
+        Partial messages are kept buffered till the rest of their bytes arrive.
+        """
+        self._buffer += data
+        messages = []
+        offset = 0
+        header_size = self.HEADER.size
+        while len(self._buffer) - offset >= header_size:
+            size = self.HEADER.unpack_from(self._buffer, offset)[0]
+            end = offset + header_size + size
+            if end > len(self._buffer):
+                break
+            messages.append(bytes(self._buffer[offset + header_size:end]))
+            offset = end
+        if offset:
+            del self._buffer[:offset]
+        return messages
+
+    def reset(self):
+        self._buffer.clear()
+
+
 class NetAddress:
 
     def __init__(self, host: str, port: int) -> None:
@@ -32,11 +95,14 @@ class NetAddress:
 
 class ServerSocket:
 
-    def __init__(self) -> None:
+    def __init__(self, reuse_address: bool = False) -> None:
         # Runtime
         self.__source_address = None
         self.connected_clients: dict[str, ClientSocket] = {}
         self._server = sockets.socket()
+        if reuse_address:
+            # Rebinding right after a restart must not fail while old connections are in TIME_WAIT
+            self._server.setsockopt(sockets.SOL_SOCKET, sockets.SO_REUSEADDR, 1)
 
     def __getitem(self, client_id: str):
         return self.get_client(client_id)
@@ -95,6 +161,11 @@ class ClientSocket:
             self._socket = sockets.socket(sockets.AF_INET, sockets.SOCK_STREAM)
         # Generate UUID for this client
         self._uid = uuid.uuid1().hex
+        # Message framing runtime
+        self._framer = MessageFramer()
+        self._messages = deque()
+        # Messages may be sent from several threads (e.g. trace echoes), frames must not interleave
+        self._send_lock = Lock()
 
     def __getitem__(self, buffer_size: int = 1024):
         return self.receive(buffer_size)
@@ -127,10 +198,74 @@ class ClientSocket:
     def receive(self, buffer_size: int = 1024) -> bytes:
         return self._socket.recv(buffer_size)
 
+    def send_vectored(self, buffers: list) -> int:
+        """ Sends buffers back to back with a single sendmsg call, gathered by the kernel without copying
+
+        Partial sends are resumed from where the kernel stopped till every buffer is sent.
+
+        Returns:
+            int: Number of bytes written to the socket
+        """
+        if self.closed:
+            raise SocketError('Socket is closed.')
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        total = sum(view.nbytes for view in views)
+        remaining = total
+        while remaining:
+            sent = self._socket.sendmsg(views)
+            remaining -= sent
+            # Drop what was fully sent and slice the buffer the kernel stopped in
+            while views and sent >= views[0].nbytes:
+                sent -= views.pop(0).nbytes
+            if sent:
+                views[0] = views[0][sent:]
+        return total
+
+    def send_message(self, data) -> int:
+        """ Sends data as a single length-prefixed message
+
+        Returns:
+            int: Number of bytes written to the socket including the header
+        """
+        if self.closed:
+            raise SocketError('Socket is closed.')
+        frame = MessageFramer.frame(data)
+        with self._send_lock:
+            self._socket.sendall(frame)
+        return len(frame)
+
+    def receive_message(self, buffer_size: int = 1024) -> bytes:
+        """ Receives the next complete message sent through send_message
+
+        Messages that arrive coalesced in one read are queued and returned by the next calls
+        without touching the socket, while partial reads are kept till completed.
+
+        Returns:
+            bytes: Message payload, or empty bytes if the peer closed the connection
+        """
+        while not self._messages:
+            chunk = self._socket.recv(buffer_size)
+            if not chunk:
+                return b''
+            self._messages.extend(self._framer.feed(chunk))
+        return self._messages.popleft()
+
+    @property
+    def has_pending_messages(self) -> bool:
+        return len(self._messages) > 0
+
     def close(self):
         if not self.closed:
             self._socket.close()
 
+    def set_send_buffer_size(self, size: int):
+        """ Caps the kernel send buffer, so unsent data waits in the application where it can still be dropped """
+        self._socket.setsockopt(sockets.SOL_SOCKET, sockets.SO_SNDBUF, size)
+
+    @property
+    def send_backlog(self) -> int:
+        return get_send_backlog(self._socket)
+
     @property
     def closed(self) -> bool:
         return self._socket._closed  # type: ignore
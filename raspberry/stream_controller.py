@@ -0,0 +1,131 @@
+from threading import Lock
+from time import monotonic
+from logger import Logger
+
+
+class OperatingPoint:
+    """ Settings the camera streams with """
+
+    __slots__ = ('resolution', 'framerate', 'quality')
+
+    def __init__(self, resolution: tuple, framerate: int, quality: int) -> None:
+        self.resolution = resolution
+        self.framerate = framerate
+        self.quality = quality
+
+    def to_dict(self) -> dict:
+        return {'res': list(self.resolution), 'fps': self.framerate, 'q': self.quality}
+
+    def __repr__(self) -> str:
+        return 'OperatingPoint(resolution={}, framerate={}, quality={})'.format(self.resolution, self.framerate,
+                                                                                self.quality)
+
+
+class StreamController:
+    """ Adapts the operating point of the stream to how fast the link drains frames.
+
+    Operating points form a ladder from the best one down, lowering JPEG quality first, then frame rate,
+    then resolution. Every sent frame reports how long its send blocked and how many bytes were left in
+    the socket send buffer. When either stays high the controller steps down the ladder, and after a
+    calm period it probes one step back up. Changes are at least hold_time seconds apart, since every
+    change restarts the encoder.
+    """
+
+    # Smoothing factor of send time and backlog averages
+    SMOOTHING = 0.2
+
+    def __init__(self, resolutions: list, framerates: list, qualities: list,
+                 hold_time: float = 2.0, probe_time: float = 6.0, max_backlog_frames: float = 1.5) -> None:
+        """
+        :param resolutions: Allowed resolutions from the highest down
+        :param framerates: Allowed frame rates from the highest down
+        :param qualities: Allowed JPEG qualities from the highest down
+        :param hold_time: Min seconds between two changes of the operating point
+        :param probe_time: Seconds without congestion before stepping back up
+        :param max_backlog_frames: Frames worth of unsent bytes that counts as congestion
+        """
+        self.logger = Logger("StreamController")
+        self.lock = Lock()
+        self.ladder = [OperatingPoint(resolutions[0], framerates[0], quality) for quality in qualities]
+        self.ladder += [OperatingPoint(resolutions[0], framerate, qualities[-1]) for framerate in framerates[1:]]
+        self.ladder += [OperatingPoint(resolution, framerates[-1], qualities[-1]) for resolution in resolutions[1:]]
+        self.level = 0
+        self.hold_time = hold_time
+        self.probe_time = probe_time
+        self.max_backlog_frames = max_backlog_frames
+        # Bumped on every change so the streamer knows it has to apply the new operating point
+        self.generation = 0
+        # Measurements
+        self.send_time = 0.0
+        self.backlog = 0.0
+        self.frame_size = 0.0
+        self.last_change = monotonic()
+        self.last_congestion = self.last_change
+
+    @classmethod
+    def for_resolution(cls, resolution: tuple, framerate: int = 30, **options):
+        """ Builds a controller whose best operating point is the given resolution and frame rate """
+        width, height = resolution
+        resolutions = [resolution] + [(int(width * scale) // 16 * 16, int(height * scale) // 16 * 16)
+                                      for scale in (0.8, 0.6)]
+        framerates = [framerate] + [rate for rate in (20, 15, 10) if rate < framerate]
+        return cls(resolutions, framerates, [85, 70, 55, 40], **options)
+
+    @property
+    def operating_point(self) -> OperatingPoint:
+        return self.ladder[self.level]
+
+    def on_frame_sent(self, frame_size: int, send_time: float, backlog: int) -> bool:
+        """ Feeds the measurements of a sent frame
+
+        Args:
+            frame_size (int): Size of the sent frame
+            send_time (float): Seconds the send blocked
+            backlog (int): Unsent bytes left in the socket send buffer after sending
+
+        Returns:
+            bool: True if the operating point changed
+        """
+        with self.lock:
+            alpha = self.SMOOTHING
+            self.send_time += alpha * (send_time - self.send_time)
+            self.backlog += alpha * (backlog - self.backlog)
+            self.frame_size += alpha * (frame_size - self.frame_size)
+            now = monotonic()
+            frame_interval = 1 / float(self.operating_point.framerate)
+            congested = self.send_time > frame_interval / 2 or self.backlog > self.frame_size * self.max_backlog_frames
+            if congested:
+                self.last_congestion = now
+            if now - self.last_change < self.hold_time:
+                return False
+            if congested and self.level < len(self.ladder) - 1:
+                return self.__change_level(self.level + 1, now)
+            if not congested and self.level > 0 and now - self.last_congestion >= self.probe_time:
+                return self.__change_level(self.level - 1, now)
+            return False
+
+    def reset(self):
+        """ Starts the next stream from the best operating point with fresh measurements """
+        with self.lock:
+            if self.level:
+                self.__change_level(0, monotonic())
+            self.send_time = self.backlog = self.frame_size = 0.0
+
+    def status(self) -> dict:
+        with self.lock:
+            status = self.operating_point.to_dict()
+            status.update({
+                'level': self.level,
+                'levels': len(self.ladder),
+                'send_ms': round(self.send_time * 1000, 2),
+                'backlog': int(self.backlog),
+            })
+            return status
+
+    def __change_level(self, level: int, now: float) -> bool:
+        self.logger.info(f"{'Lowering' if level > self.level else 'Raising'} stream to {self.ladder[level]} | "
+                         f"Send: {self.send_time * 1000:.1f} ms | Backlog: {self.backlog / 1024:.1f} KBs")
+        self.level = level
+        self.generation += 1
+        self.last_change = now
+        return True
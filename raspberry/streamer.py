@@ -1,25 +1,266 @@
-import struct
-from io import BytesIO
+from collections import deque
+from time import monotonic, sleep, time
 from logger import Logger
-from picamera import PiCamera
+import hal
+import robot_utils as utils
 from sockets import ServerSocket
-from threading import Event, Thread
+from stream_controller import StreamController
+from threading import Event, Thread, Condition, Lock
 from socket import timeout as SocketTimeoutError
 
+
+class CapturedFrame:
+    """ JPEG frame along with the wall clock time it was captured at in microseconds """
+
+    __slots__ = ('data', 'timestamp')
+
+    def __init__(self, data, timestamp: int) -> None:
+        self.data = data
+        self.timestamp = timestamp
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FrameQueue:
+    """ Bounded queue between capturing and sending frames.
+
+    When it's full the oldest frame is dropped for the new one, so a slow link makes the robot
+    skip frames instead of sending stale ones, and latency stays bounded by the queue depth.
+    """
+
+    def __init__(self, depth: int = 1) -> None:
+        self.depth = depth
+        self.frames = deque()
+        self.condition = Condition()
+        self.closed = False
+        # Stats
+        self.queued = 0
+        self.dropped = 0
+
+    def put(self, frame: CapturedFrame):
+        with self.condition:
+            if len(self.frames) >= self.depth:
+                self.frames.popleft()
+                self.dropped += 1
+            self.frames.append(frame)
+            self.queued += 1
+            self.condition.notify()
+
+    def get(self, timeout: float | None = None) -> CapturedFrame | None:
+        """
+        Returns:
+            CapturedFrame | None: Oldest queued frame, or None on timeout or once queue is closed and empty
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.closed, timeout)
+            return self.frames.popleft() if self.frames else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class MJPEGSplitter:
+    """ Camera output that splits what the camera writes into JPEG frames
+
+    The encoder hands its output over in buffers where a new frame always starts a new buffer, so a
+    buffer starting with a SOI marker begins the next frame and one ending with an EOI marker completes
+    the current one. Stills captured continuously are written the same way. Complete frames are handed
+    over to the frames queue without being copied, stamped with the time their first buffer arrived.
+    """
+
+    SOI = b'\xff\xd8'
+    EOI = b'\xff\xd9'
+
+    def __init__(self, frames: FrameQueue) -> None:
+        self.frames = frames
+        self.buffer = bytearray()
+        self.timestamp = 0
+        # Stats
+        self.frames_split = 0
+        self.frames_incomplete = 0
+
+    def write(self, buf) -> int:
+        if buf[:2] == self.SOI:
+            if self.buffer:
+                # Previous frame never got its EOI
+                self.frames_incomplete += 1
+                self.buffer.clear()
+            self.timestamp = int(time() * 1_000_000)
+        self.buffer += buf
+        if buf[-2:] == self.EOI and self.buffer[:2] == self.SOI:
+            self.__push_frame()
+        return len(buf)
+
+    def flush(self):
+        if self.buffer:
+            self.frames_incomplete += 1
+            self.buffer.clear()
+
+    def __push_frame(self):
+        # Queue takes the buffer over and the next frame gets a new one
+        frame, self.buffer = self.buffer, bytearray()
+        self.frames.put(CapturedFrame(frame, self.timestamp))
+        self.frames_split += 1
+
+class StreamSubscription:
+    """ Frames fed to a single stream client and how fast the client takes them """
+
+    def __init__(self, name: str, depth: int) -> None:
+        self.name = name
+        self.frames = FrameQueue(depth)
+        self.subscribed_at = monotonic()
+        # Stats
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def on_frame_sent(self, frame_size: int):
+        self.frames_sent += 1
+        self.bytes_sent += frame_size
+
+    def stats(self) -> dict:
+        elapsed = max(monotonic() - self.subscribed_at, 1e-6)
+        return {
+            'client': self.name,
+            'fps': round(self.frames_sent / elapsed, 1),
+            'kbps': round(self.bytes_sent * 8 / 1000 / elapsed, 1),
+            'sent': self.frames_sent,
+            'dropped': self.frames.dropped,
+        }
+
+
+class FrameBroadcaster:
+    """ Captures every frame once and fans it out to every subscribed client.
+
+    Each subscriber has its own bounded drop-oldest queue, so a slow client only drops its own
+    frames and never holds back the others. Capturing runs while there is at least one subscriber,
+    or while the camera is kept warm so the next subscriber gets its first frame right away.
+    """
+
+    def __init__(self, streamer) -> None:
+        self.streamer = streamer
+        self.lock = Lock()
+        # Held by the capture thread till camera is released, so a new one can't start capturing meanwhile
+        self.capture_lock = Lock()
+        self.subscribers: list[StreamSubscription] = []
+        self.capture_thread = None
+        # Capturing goes on without subscribers till then
+        self.warm_until = 0.0
+
+    @property
+    def primary(self) -> StreamSubscription | None:
+        """ Earliest subscriber still connected, stream is adapted to its link """
+        subscribers = self.subscribers
+        return subscribers[0] if subscribers else None
+
+    def subscribe(self, name: str) -> StreamSubscription:
+        subscription = StreamSubscription(name, self.streamer.FRAME_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers = self.subscribers + [subscription]
+            self.__start_capture()
+        self.streamer.logger.info(f"Client '{name}' subscribed to stream. Clients: {len(self.subscribers)}")
+        return subscription
+
+    def unsubscribe(self, subscription: StreamSubscription) -> int:
+        """
+        Returns:
+            int: Number of subscribers left
+        """
+        with self.lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber is not subscription]
+            left = len(self.subscribers)
+        subscription.frames.close()
+        self.streamer.logger.info(f"Client '{subscription.name}' unsubscribed from stream | {subscription.stats()}")
+        return left
+
+    def stats(self) -> list:
+        return [subscriber.stats() for subscriber in self.subscribers]
+
+    def warm_up(self, seconds: float, start: bool = True):
+        """ Keeps capturing for the given seconds even with no subscribers
+
+        Args:
+            seconds (float): Seconds from now to keep the camera warm for
+            start (bool, optional): Starts capturing if it isn't running already, otherwise only extends it
+        """
+        with self.lock:
+            self.warm_until = max(self.warm_until, monotonic() + seconds)
+            if start:
+                self.__start_capture()
+
+    def cool_down(self):
+        """ Lets capturing stop as soon as there are no subscribers """
+        with self.lock:
+            self.warm_until = 0.0
+
+    def __start_capture(self):
+        if self.capture_thread is None:
+            self.capture_thread = Thread(name="FrameBroadcaster", target=self.__capture_job, daemon=True)
+            self.capture_thread.start()
+
+    def __capture_job(self):
+        with self.capture_lock:
+            frames = self.streamer.capture_frames()
+            try:
+                for frame in frames:
+                    with self.lock:
+                        subscribers = self.subscribers
+                        if not subscribers and monotonic() > self.warm_until:
+                            # Next subscriber starts capturing again
+                            self.capture_thread = None
+                            return
+                    for subscriber in subscribers:
+                        subscriber.frames.put(frame)
+                # Camera stopped handing over frames, let every client know
+                with self.lock:
+                    self.capture_thread = None
+                    subscribers = self.subscribers
+                for subscriber in subscribers:
+                    subscriber.frames.close()
+            finally:
+                frames.close()
+
+
 class Streamer:
 
-    def __init__(self, address, resolution=(900, 600)) -> None:
+    # Frames waiting to be sent to each client, older ones are dropped for newer ones
+    FRAME_QUEUE_SIZE = 1
+    # Clients that can watch the stream at once in broadcast mode
+    BROADCAST_CLIENTS = 4
+    # Max seconds to wait for the first client to connect
+    CONNECT_TIMEOUT = 20
+    # Seconds camera keeps capturing after a stream is stopped, so the next one starts right away
+    WARM_TIME = 30
+    # Max seconds to wait for the camera to hand over a frame
+    FRAME_TIMEOUT = 2
+
+    def __init__(self, address, resolution=(900, 600), camera=None, mjpeg=True, controller=None) -> None:
         self.logger = Logger("Streamer")
         self.stream_switcher = Event()
+        # Record MJPEG from the video port encoder when set, capture stills from the still port otherwise
+        self.mjpeg = mjpeg
         # Init picamera runtime
-        self.camera = PiCamera()
+        self.camera = camera if camera is not None else hal.create_picamera()
         self.camera.framerate = 30
         self.camera.vflip = True
         self.camera.resolution = resolution
-        # Init socket runtime
+        # Adapts resolution, frame rate and quality of recorded MJPEG to the link
+        self.controller = controller if controller is not None else StreamController.for_resolution(resolution, 30)
+        # Init socket runtime, server socket is created and bound by the first stream and kept listening
         self.address = address
-        self.streamSocket = ServerSocket()
-        self.streamSocket.settimeout(20)
+        self.streamSocket = None
+        self.server_started = False
+        self.closed = False
+        # Current stream session
+        self.stream_started_at = 0.0
+        self.session_clients = 0
+        # Every frame is captured once and fanned out to up to max_clients, set it to BROADCAST_CLIENTS for broadcast mode
+        self.broadcaster = FrameBroadcaster(self)
+        self.max_clients = 1
+        # When set, video port is served by someone else (e.g. AsyncRobotServer) and not by a StreamerHandler
+        self.served_externally = False
         self.logger.success("Streamer is initialized successfully")
 
     @property
@@ -40,76 +281,234 @@ class Streamer:
         if self.streaming:
             self.logger.warning("Already streaming !!!")
             return
-        # Create StreamerHandler instance and start it
-        StreamerHandler().handle_streamer(self)
+        self.logger.info("Starting stream...")
+        self.controller.reset()
+        self.stream_started_at = monotonic()
+        self.session_clients = 0
+        # Start capturing before WCU connects so its first frame is already on the way
+        self.broadcaster.warm_up(self.CONNECT_TIMEOUT)
+        self.stream_switcher.set()
+        if not self.served_externally and not self.server_started:
+            # Create the StreamerHandler once, it serves every stream from now on. Video port is
+            # listening once it returns, so WCU can connect as soon as it's told the stream started
+            self.server_started = StreamerHandler().handle_streamer(self)
+            if not self.server_started:
+                self.stop_stream()
 
     def stop_stream(self):
         """ Stops current active streaming """
         if self.streaming:
             self.stream_switcher.clear()
+            # Keep camera warm for a while in case WCU starts streaming again
+            self.broadcaster.warm_up(self.WARM_TIME, start=False)
+            self.logger.info("Stopped stream.")
+
+    def close(self):
+        """ Stops streaming and the StreamerHandler, and lets the camera stop capturing """
+        self.closed = True
+        self.stop_stream()
+        self.broadcaster.cool_down()
+
+    def capture_frames(self):
+        """ Captures JPEG frames from picamera in the background and yields the newest one each time
+
+        Capturing never waits for the caller. Frames the caller didn't get to in time are dropped.
+
+        Yields:
+            CapturedFrame: Captured frame and its capture timestamp
+        """
+        frames = FrameQueue(self.FRAME_QUEUE_SIZE)
+        splitter = MJPEGSplitter(frames)
+        capturing = Event()
+        generation = self.__start_capture(splitter, capturing)
+        try:
+            while True:
+                if self.mjpeg and generation != self.controller.generation:
+                    # Encoder has to be restarted to pick up the new operating point
+                    self.camera.stop_recording()
+                    generation = self.__start_capture(splitter, capturing)
+                frame = frames.get(timeout=self.FRAME_TIMEOUT)
+                if frame is None:
+                    if self.mjpeg:
+                        # Raises whatever stopped the encoder
+                        self.camera.wait_recording(0)
+                    self.logger.error("Camera stopped handing over frames.")
+                    return
+                yield frame
+        finally:
+            capturing.clear()
+            if self.mjpeg:
+                self.camera.stop_recording()
+            frames.close()
+            self.logger.info(f"Captured {frames.queued} frames | Dropped: {frames.dropped} | "
+                             f"Incomplete: {splitter.frames_incomplete}")
+
+    def __start_capture(self, splitter: MJPEGSplitter, capturing: Event) -> int:
+        generation = self.controller.generation
+        capturing.set()
+        if not self.mjpeg:
+            Thread(name="Streamer-Stills", target=self.__capture_stills, args=[splitter, capturing],
+                   daemon=True).start()
+            return generation
+        point = self.controller.operating_point
+        self.camera.resolution = point.resolution
+        self.camera.framerate = point.framerate
+        self.camera.start_recording(splitter, format="mjpeg", quality=point.quality)
+        return generation
+
+    def __capture_stills(self, splitter: MJPEGSplitter, capturing: Event):
+        for _ in self.camera.capture_continuous(output=splitter, format="jpeg"):
+            if not capturing.is_set():
+                break
 
 
 class StreamerHandler:
+    """ Long-lived stream server. It binds the video port once and keeps accepting clients, and only
+    serves them while a stream is on, so starting and stopping a stream are just state transitions.
+    """
+
+    # Seconds between checks of the stream switcher while waiting for clients
+    ACCEPT_INTERVAL = 0.5
+
+    def handle_streamer(self, streamer: Streamer) -> bool:
+        """ Binds the video port for good and serves it on its own thread
+
+        Returns:
+            bool: False if video port couldn't be bound, True otherwise
+        """
+        # Socket of a handler that has stopped is closed, so every handler binds a fresh one
+        server = ServerSocket(reuse_address=True)
+        try:
+            server.bind(streamer.address)
+            server.listen(streamer.BROADCAST_CLIENTS)
+            server.settimeout(self.ACCEPT_INTERVAL)
+        except OSError as e:
+            server.close()
+            streamer.logger.error(f"Stream server can't listen on {streamer.address}. Reason: '{e}'")
+            return False
+        streamer.streamSocket = server
+        streamer.logger.info(f"Stream server is listening on {streamer.address}")
+        Thread(name="StreamerHandler", target=self._handler_job, args=[streamer, server], daemon=True).start()
+        return True
+
+    def _handler_job(self, streamer: Streamer, server: ServerSocket):
+        try:
+            while not streamer.closed:
+                try:
+                    client, address = server.accept()
+                except (TimeoutError, SocketTimeoutError):
+                    self.__check_session(streamer)
+                    continue
+                except OSError as e:
+                    # A client that failed while being accepted must not take the server down with it
+                    streamer.logger.error(f"Can't accept stream client. Reason: '{e}'")
+                    sleep(self.ACCEPT_INTERVAL)
+                    continue
+                try:
+                    self.__serve_client(streamer, server, client, address)
+                except OSError as e:
+                    streamer.logger.error(f"Can't serve stream client {address}. Reason: '{e}'")
+                    self.__close_client(server, client)
+        except KeyboardInterrupt:
+            streamer.logger.warning("Streamer was forced to stop. Stopping...")
+        finally:
+            server.close()
+            if streamer.streamSocket is server:
+                streamer.streamSocket = None
+            # Next stream starts a new handler
+            streamer.stream_switcher.clear()
+            streamer.server_started = False
+            streamer.logger.info("Streamer has finished.")
+
+    def __serve_client(self, streamer: Streamer, server: ServerSocket, client, address):
+        if not streamer.streaming:
+            streamer.logger.warning(f"Refused stream client {address} since no stream was requested.")
+            self.__close_client(server, client)
+            return
+        if len(streamer.broadcaster.subscribers) >= streamer.max_clients:
+            streamer.logger.warning(f"Refused stream client {address} since stream is full.")
+            self.__close_client(server, client)
+            return
+        streamer.session_clients += 1
+        subscription = streamer.broadcaster.subscribe(f"{address.host}:{address.port}")
+        Thread(name=f"StreamerClient-{address.port}", target=self._client_job,
+               args=[streamer, server, client, subscription], daemon=True).start()
 
-    def handle_streamer(self, streamer: Streamer):
-        Thread(name="StreamerHandler", target=self._handler_job, args=[streamer]).start()
+    def __check_session(self, streamer: Streamer):
+        if not streamer.streaming:
+            return
+        if streamer.session_clients and not streamer.broadcaster.subscribers:
+            streamer.logger.info("Every client has left the stream.")
+            streamer.stop_stream()
+        elif not streamer.session_clients and monotonic() - streamer.stream_started_at > streamer.CONNECT_TIMEOUT:
+            streamer.logger.info("Timeout while waiting for WCU to connect .")
+            streamer.stop_stream()
+
+    @staticmethod
+    def __close_client(server: ServerSocket, client):
+        client.close()
+        server.connected_clients.pop(client.get_uid(), None)
 
-    def _handler_job(self, streamer: Streamer):
-        # Prepare stream runtime
+    def _client_job(self, streamer: Streamer, server: ServerSocket, client, subscription: StreamSubscription):
         try:
-            streamer.logger.info("Starting stream...")
-            # Turn on stream switcher
-            streamer.stream_switcher.set()
-            # Wait for WCU to connect
-            self.streamSocket = ServerSocket()
-            self.streamSocket.bind(streamer.address)
-            self.streamSocket.listen(0)
-            streamer.logger.info("Waiting for WCU to connect...")
-            client = self.streamSocket.accept()[0]
             client.settimeout(5)
-            connection = client._socket.makefile('wb')
-            frame_stream = BytesIO()
-            for fn in streamer.camera.capture_continuous(output=frame_stream, format="jpeg"):
-                # Write frame size to connection
-                frame_size = frame_stream.tell()
-                connection.write(struct.pack("<L", frame_size))
-                connection.flush()
-                # Write frame data to connection
-                frame_stream.seek(0)
-                connection.write(frame_stream.read())
-                # Reset the frame stream to receive the next frame
-                frame_stream.seek(0)
-                frame_stream.truncate()
-                streamer.logger.info(f"Sent frame of size {round(frame_size / 1024, 1)} KBs.")
-                # Check if stream switcher is switched off or not
-                if not streamer.stream_switcher.is_set():
-                    # Close stream
-                    streamer.streamSocket.close()
-                    streamer.logger.info("Stopping stream...")
+            # Keep frames from piling up in kernel where they can't be dropped anymore
+            client.set_send_buffer_size(utils.STREAM_SEND_BUFFER_SIZE)
+            frame_header = bytearray(utils.FRAME_HEADER.size)
+            while streamer.streaming:
+                frame = subscription.frames.get(timeout=streamer.FRAME_TIMEOUT)
+                if frame is None:
                     break
-            streamer.logger.info("Finished streaming.")
+                # Fill in frame size and capture time then send header and frame data in one go without copying
+                utils.FRAME_HEADER.pack_into(frame_header, 0, len(frame), frame.timestamp)
+                send_start = monotonic()
+                client.send_vectored([frame_header, frame.data])
+                subscription.on_frame_sent(len(frame))
+                if subscription.frames_sent == 1:
+                    streamer.logger.info(f"First frame sent to '{subscription.name}' "
+                                         f"{(monotonic() - streamer.stream_started_at) * 1000:.0f} ms after stream was started.")
+                # Stream is adapted to the link of the earliest client only, so others can't degrade it
+                if subscription is streamer.broadcaster.primary:
+                    streamer.controller.on_frame_sent(len(frame), monotonic() - send_start, client.send_backlog)
+                    streamer.logger.info("Sent frame of size %.1f KBs.", len(frame) / 1024, every=1.0)
         except (TimeoutError, SocketTimeoutError):
-            streamer.logger.info("Timeout while waiting for WCU to connect .")
-        except KeyboardInterrupt:
-            streamer.streamSocket.close()
-            streamer.stream_switcher.clear()
-            streamer.logger.warning("Streamer was forced to stop. Stopping...")
+            streamer.logger.error(f"Client '{subscription.name}' stopped taking frames.")
         except (
                 ConnectionResetError,
                 ConnectionAbortedError,
                 ConnectionRefusedError,
                 BrokenPipeError):
             # Connection was closed unexpectedly
-            streamer.streamSocket.close()
-            streamer.stream_switcher.clear()
-            streamer.logger.error("Connection was closed unexpectedly.")
+            streamer.logger.error(f"Connection with client '{subscription.name}' was closed unexpectedly.")
         finally:
-            if streamer.streaming:
-                streamer.streamSocket.close()
-                streamer.stream_switcher.clear()
-                streamer.logger.info("Streamer has finished.")
+            streamer.broadcaster.unsubscribe(subscription)
+            self.__close_client(server, client)
+
+
+def benchmark_splitter(frames: int = 2000, frame_size: int = 30 * 1024):
+    """ Measures how fast MJPEGSplitter reassembles frames handed over in simulated encoder buffers """
+    from time import perf_counter
+    camera = hal.SimulatedCamera(frame_size)
+    frame = camera.next_frame()
+    view = memoryview(frame)
+    buffers = [view[offset:offset + camera.BUFFER_SIZE] for offset in range(0, len(frame), camera.BUFFER_SIZE)]
+    splitter = MJPEGSplitter(FrameQueue(frames))
+    start = perf_counter()
+    for _ in range(frames):
+        for buffer in buffers:
+            splitter.write(buffer)
+    while splitter.frames.get(timeout=0) is not None:
+        pass
+    elapsed = perf_counter() - start
+    Logger("Streamer").info(f"Split {splitter.frames_split} frames of {len(frame) / 1024:.1f} KBs in {elapsed:.2f}s | "
+                            f"{frames / elapsed:.0f} fps | {frames * len(frame) / elapsed / 1024 ** 2:.1f} MB/s")
 
 
 if __name__ == "__main__":
-    streamer = Streamer(("rloader", 2002), (500, 480))
-    streamer.start_stream()
+    from sys import argv
+    if '--bench' in argv:
+        benchmark_splitter()
+    else:
+        streamer = Streamer(("rloader", 2002), (500, 480),
+                            camera=hal.SimulatedCamera() if '--sim' in argv else None)
+        streamer.start_stream()
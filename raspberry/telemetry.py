@@ -0,0 +1,119 @@
+from threading import Thread, Event, Lock
+from time import monotonic
+from logger import Logger
+from sockets import SocketError
+import robot_utils as utils
+
+
+class TelemetryBatchEncoder:
+    """ Delta encodes telemetry records into a batch, see robot_utils.Telemetry for the layout """
+
+    ZERO = (0,) * len(utils.Telemetry.FIELDS)
+
+    def __init__(self) -> None:
+        self.records = bytearray()
+        self.count = 0
+        self.previous = self.ZERO
+
+    def add(self, record: tuple):
+        mask = 0
+        deltas = bytearray()
+        for index, (value, previous) in enumerate(zip(record, self.previous)):
+            if value != previous:
+                mask |= 1 << index
+                utils.write_varint(deltas, utils.zigzag(value - previous))
+        utils.write_varint(self.records, mask)
+        self.records += deltas
+        self.previous = record
+        self.count += 1
+
+    def flush(self) -> bytes:
+        """ Returns the batch as a payload and starts the next one from zeros """
+        payload = utils.Opcodes.TELEMETRY_STRUCT.pack(utils.Opcodes.TELEMETRY, self.count) + self.records
+        self.records = bytearray()
+        self.count = 0
+        self.previous = self.ZERO
+        return payload
+
+
+class TelemetryPublisher:
+    """ Samples sensors, drive state and loop timing at a fixed rate and pushes them to WCU in batches.
+
+    Samples are taken on their own thread and sent every batch samples, so WCU gets a few small
+    messages per second no matter how high the rate is.
+    """
+
+    # Keeps batches far below the max message size
+    MAX_BATCH = 500
+
+    def __init__(self, car, drive_mailbox) -> None:
+        self.logger = Logger("Telemetry")
+        self.car = car
+        self.drive_mailbox = drive_mailbox
+        self.lock = Lock()
+        self.stopped = None
+        # Stats
+        self.batches_sent = 0
+        self.bytes_sent = 0
+
+    @property
+    def publishing(self) -> bool:
+        return self.stopped is not None and not self.stopped.is_set()
+
+    def start(self, link, rate: float = utils.TELEMETRY_RATE, batch: int = utils.TELEMETRY_BATCH):
+        """ Starts pushing telemetry through link, replacing whatever was being published """
+        batch = max(1, min(self.MAX_BATCH, batch))
+        with self.lock:
+            self.__stop()
+            if rate <= 0:
+                return
+            self.stopped = Event()
+            Thread(name="Telemetry-Thread", target=self.__publisher_job, args=[link, rate, batch, self.stopped],
+                   daemon=True).start()
+        self.logger.info(f"Publishing telemetry at {rate} Hz in batches of {batch}.")
+
+    def stop(self):
+        with self.lock:
+            self.__stop()
+
+    def __stop(self):
+        if self.stopped is not None:
+            self.stopped.set()
+            self.stopped = None
+
+    def sample(self, lateness: float) -> tuple:
+        car = self.car
+        sound = car.soundSensor
+        flags = ((utils.Telemetry.FLAG_LEFT_LF if car.leftLF.is_on_black_line() else 0) |
+                 (utils.Telemetry.FLAG_RIGHT_LF if car.rightLF.is_on_black_line() else 0) |
+                 (utils.Telemetry.FLAG_IDLE if car.is_idle else 0) |
+                 (utils.Telemetry.FLAG_AUTO if car.is_auto_driving else 0) |
+                 (utils.Telemetry.FLAG_SAMPLING if sound.sampling else 0) |
+                 car.output_state << utils.Telemetry.OUTPUT_SHIFT)
+        return (utils.now_us(), flags, sound.windowCount, sound.peakAmplitude, sound.DETECTION_VALUE,
+                sound.overruns, int(lateness * 1000000), self.drive_mailbox.applied, self.drive_mailbox.coalesced)
+
+    def __publisher_job(self, link, rate: float, batch: int, stopped: Event):
+        period = 1 / rate
+        encoder = TelemetryBatchEncoder()
+        deadline = monotonic()
+        while not stopped.is_set():
+            encoder.add(self.sample(max(0.0, monotonic() - deadline)))
+            if encoder.count >= batch:
+                payload = encoder.flush()
+                try:
+                    if not link.send_message(payload):
+                        break
+                except (OSError, SocketError):
+                    break
+                self.batches_sent += 1
+                self.bytes_sent += len(payload)
+            deadline += period
+            delay = deadline - monotonic()
+            if delay < -period:
+                # Fell behind, continue from now instead of sampling a burst
+                deadline = monotonic()
+            elif delay > 0 and stopped.wait(delay):
+                break
+        self.logger.info(f"Stopped publishing telemetry | Batches: {self.batches_sent} | "
+                         f"{self.bytes_sent / 1024:.1f} KBs")
@@ -0,0 +1,155 @@
+from time import sleep, monotonic
+from threading import enumerate as running_threads
+from sys import argv as args
+from logger import Logger
+from hal import SimulatedGPIO
+from components import Car, CarComputerDriver
+
+
+class TestOutputCache:
+    """ Verifies that the cached output state of Car skips writes of unchanged drive pins """
+
+    def __new__(cls):
+        test = super().__new__(TestOutputCache)
+        test.__init__()
+        return test
+
+    def __init__(self, iterations: int = 10000) -> None:
+        self.logger = Logger("TestOutputCache")
+        self.iterations = iterations
+        self.gpio = SimulatedGPIO()
+        # Poll LF sensors so the driver keeps deciding the same direction
+        self.car = Car(gpio_backend=self.gpio, event_driven_lf=False)
+
+    def drive_for(self, seconds: float, left: int, right: int) -> int:
+        """ Lets automatic driver follow the given readings for a while
+
+        Returns:
+            int: Number of pins written meanwhile
+        """
+        writes = self.gpio.writes
+        self.gpio.set_input(self.car.leftLF.pin, left)
+        self.gpio.set_input(self.car.rightLF.pin, right)
+        sleep(seconds)
+        return self.gpio.writes - writes
+
+    @staticmethod
+    def wait_for_driver():
+        for thread in running_threads():
+            if thread.name == "CCD-Thread":
+                thread.join()
+
+    def perform_test(self):
+        self.car.setup()
+        assert self.gpio.writes == 4, f"Setup should write every drive pin once, wrote {self.gpio.writes}"
+        # Skip waiting for buzzer
+        self.car.is_idle = False
+        writes = self.gpio.writes
+        self.car.start_automatic_driving()
+        try:
+            # Both LF sensors start on white ground, forward drives one pin HIGH and the next polls
+            # find the car already there
+            sleep(1.0)
+            writes = self.gpio.writes - writes
+            assert writes == 1, f"Driving forward should write one pin, wrote {writes}"
+            assert self.car.output_state == Car.BIT_FORWARD
+            # Steering right drives forward LOW and right HIGH only
+            writes = self.drive_for(1.0, 0, 1)
+            assert writes == 2, f"Steering right should write two pins, wrote {writes}"
+            assert self.car.output_state == Car.BIT_RIGHT
+        finally:
+            self.car.stop_automatic_driving()
+            self.wait_for_driver()
+        # Same readings over and over, as the polling loop sees them on a straight line
+        writes = self.gpio.writes
+        start = monotonic()
+        for _ in range(self.iterations):
+            CarComputerDriver.follow_line(self.car, (1, 0))
+        elapsed = monotonic() - start
+        writes = self.gpio.writes - writes
+        assert writes == 2, f"{self.iterations} loops on the same readings should write two pins, wrote {writes}"
+        self.logger.success(f"Output cache passed | {self.iterations} loops in {elapsed * 1000:.1f} ms, "
+                            f"{writes} pins written.")
+
+
+class TestEdgeLineFollowing:
+    """ Verifies that automatic driver steers on LF sensors edges and stays idle without them """
+
+    def __new__(cls):
+        test = super().__new__(TestEdgeLineFollowing)
+        test.__init__()
+        return test
+
+    def __init__(self) -> None:
+        self.logger = Logger("TestEdgeLineFollowing")
+        self.gpio = SimulatedGPIO()
+        self.car = Car(gpio_backend=self.gpio, event_driven_lf=True)
+        # Count LF sensors reads to tell polling apart from reacting to edges
+        self.lf_reads = 0
+        read_level = self.gpio.input
+
+        def counted_input(pin):
+            if pin in (self.car.leftLF.pin, self.car.rightLF.pin):
+                self.lf_reads += 1
+            return read_level(pin)
+        self.gpio.input = counted_input
+
+    def wait_for_edge_detection(self, timeout: float = 2.0):
+        """ Waits till edge callbacks are attached and driver has caught up with the line """
+        deadline = monotonic() + timeout
+        pins = {self.car.leftLF.pin, self.car.rightLF.pin}
+        while not pins.issubset(self.gpio.edge_callbacks) or not self.car.output_state:
+            assert monotonic() < deadline, "Automatic driver didn't start following the line on edges"
+            sleep(0.01)
+
+    def expect(self, pin: int, level: int, state: int, name: str):
+        self.gpio.set_input(pin, level)
+        assert self.car.output_state == state, \
+            f"Expected to {name} after pin {pin} went {level}, output state is {self.car.output_state:04b}"
+
+    def perform_test(self):
+        left, right = self.car.leftLF.pin, self.car.rightLF.pin
+        self.car.setup()
+        # Skip waiting for buzzer
+        self.car.is_idle = False
+        self.car.start_automatic_driving()
+        try:
+            self.wait_for_edge_detection()
+            # Catching up with the line drives forward on white ground
+            assert self.car.output_state == Car.BIT_FORWARD, "Expected to drive forward on white ground"
+            # Edges are handled on the thread that fires them, so the car has reacted once set_input returns
+            self.expect(right, 1, Car.BIT_RIGHT, "steer right")
+            self.expect(right, 0, Car.BIT_FORWARD, "drive forward")
+            self.expect(left, 1, Car.BIT_LEFT, "steer left")
+            self.expect(right, 1, 0, "brake")
+            self.expect(left, 0, Car.BIT_RIGHT, "steer right")
+            # No transitions, no reads and no writes
+            writes, reads = self.gpio.writes, self.lf_reads
+            self.gpio.set_input(right, 1)  # Same level, not an edge
+            sleep(1.0)
+            assert self.gpio.writes == writes, f"Wrote {self.gpio.writes - writes} pins without any transition"
+            assert self.lf_reads == reads, f"Read LF sensors {self.lf_reads - reads} times without any transition"
+        finally:
+            self.car.stop_automatic_driving()
+            TestOutputCache.wait_for_driver()
+        assert not self.gpio.edge_callbacks, "Edge callbacks were left attached after automatic driving stopped"
+        self.logger.success("Edge line following passed.")
+
+
+if __name__ == '__main__':
+    test_type = args[1].strip().lower() if len(args) > 1 else None
+    tests = {
+        '-o': TestOutputCache,
+        '-e': TestEdgeLineFollowing,
+    }
+    if not test_type or not (test_type in tests):
+        print("""
+Select a test to perform it.
+Available tests:
+\t -o: Test the cached GPIO output state of Car
+\t -e: Test line following on LF sensors edges
+""")
+    else:
+        test = tests[test_type]
+        test = test.__new__(test)
+        test.perform_test()
@@ -1,19 +1,29 @@
 import os
 import sys
-from PIL import Image
 from logger import Logger
 from datetime import datetime
-from json import dumps as data2json
 from PyQt5 import QtGui, QtWidgets, QtCore
 from stream_worker import StreamViewer, StreamViewerCallback
 from car_driver import CarManualDriver, CarDriverCallback
 from connection import ConnectionService, ConnectionCallback
 from arm_controller import ArmControllerWindow, Operation as Opts
-from app_utils import Status, GuiColors, GuiTexts as Texts, Directions
+from telemetry_window import TelemetryWindow
+from app_utils import Status, GuiColors, GuiTexts as Texts, Directions, TRACE_MEASURE_EVERY
 
 
 class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, StreamViewerCallback):
 
+    # Emitted from the stream thread, delivered on the GUI thread
+    frameReady = QtCore.pyqtSignal()
+    # (callback, result) of a replied request, delivered on GUI thread
+    replyReady = QtCore.pyqtSignal(object, object)
+    # Recorder that has written every frame, emitted from its writer thread
+    recordingStopped = QtCore.pyqtSignal(object)
+    # (handler, args) of a connection event raised on a worker thread, delivered on GUI thread
+    connectionEvent = QtCore.pyqtSignal(object, object)
+    # (handler, args) of a stream event raised on the stream thread, delivered on GUI thread
+    streamEvent = QtCore.pyqtSignal(object, object)
+
     def __init__(self) -> None:
         super(MainWindow, self).__init__()
         # GUI necessaries
@@ -43,6 +53,11 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
             self.MARGIN_SIZE,
             self.imgRTV.height() + self.MARGIN_SIZE,
             self.imgRTV.width(), 50)
+        # Stream latency label, shares the row of log list label
+        self.lblLatency = QtWidgets.QLabel(self.rtvStatusContainer)
+        self.lblLatency.setFont(QtGui.QFont("monospace", 15))
+        self.lblLatency.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
+        self.lblLatency.setGeometry(self._lblLogList.geometry())
         # WCU log ListView
         self.listLog = QtWidgets.QListWidget(self.rtvStatusContainer)
         self.listLog.setSpacing(1)
@@ -105,6 +120,7 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.btnRecordStream.setMaximumHeight(100)
         self.btnRecordStream.setMinimumHeight(100)
         self.btnRecordStream.setFont(QtGui.QFont("monospace", 15))
+        self.btnRecordStream.clicked.connect(self.start_stop_recording)
         self.btnRecordStream.setGeometry(0, self.btnSwitchControlMode.geometry().top() - (
             self.BUTTON_HEIGHT + self.MARGIN_SIZE), targetWidth, self.BUTTON_HEIGHT)
         # Start/Stop Stream button
@@ -126,8 +142,14 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.btnConnectDisconnect.clicked.connect(self.connect_disconnect)
         self.btnConnectDisconnect.setGeometry(0, self.btnStartStopStream.geometry().top() - (
             self.BUTTON_HEIGHT + self.MARGIN_SIZE), targetWidth, self.BUTTON_HEIGHT)
+        # Control latency label, right above connect/disconnect button
+        self.lblCommandLatency = QtWidgets.QLabel(self.speedContainer)
+        self.lblCommandLatency.setFont(QtGui.QFont("monospace", 13))
+        self.lblCommandLatency.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+        self.lblCommandLatency.setGeometry(0, self.btnConnectDisconnect.geometry().top() - (50 + self.MARGIN_SIZE),
+                                           targetWidth, 50)
         # Robot control commands display
-        labelHeight = self.btnConnectDisconnect.geometry().top() - self._lblTitle.geometry().bottom() - self.MARGIN_SIZE * 2
+        labelHeight = self.lblCommandLatency.geometry().top() - self._lblTitle.geometry().bottom() - self.MARGIN_SIZE * 2
         self.lblStatus = QtWidgets.QLabel(self.speedContainer)
         self.lblStatus.setWordWrap(True)
         self.lblStatus.setMinimumHeight(100)
@@ -148,13 +170,46 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.logger = Logger("WCU-GUI")
         self.driver = CarManualDriver(self)
         self.streamViewer = StreamViewer(self)
+        self.frameReady.connect(self.show_latest_frame, QtCore.Qt.ConnectionType.QueuedConnection)
+        self.replyReady.connect(lambda callback, result: callback(result), QtCore.Qt.ConnectionType.QueuedConnection)
+        self.recordingStopped.connect(self.show_recording_stopped, QtCore.Qt.ConnectionType.QueuedConnection)
+        self.connectionEvent.connect(lambda handler, args: handler(*args), QtCore.Qt.ConnectionType.QueuedConnection)
+        self.streamEvent.connect(lambda handler, args: handler(*args), QtCore.Qt.ConnectionType.QueuedConnection)
+        self.resumeStream = False
         self.connection = ConnectionService(self)
         self.arm_controller = ArmControllerWindow(self.handle_arm_data)
+        self.telemetry_window = TelemetryWindow(self.connection.telemetry)
+        # Refresh control latency once a second
+        self.latencyTimer = QtCore.QTimer(self)
+        self.latencyTimer.timeout.connect(self.update_command_latency_lbl)
+        self.latencyTimer.start(1000)
 
     @property
     def status(self) -> int:
         return Status.CONNECTED if self.connection.connected else Status.NOT_CONNECTED
 
+    # ConnectionService calls these on its worker threads, they are handled on GUI thread in the order they came
+    def on_connecting(self):
+        self.connectionEvent.emit(self.show_connecting, ())
+
+    def on_connect(self):
+        self.connectionEvent.emit(self.show_connect, ())
+
+    def on_fail(self, reason: str | None):
+        self.connectionEvent.emit(self.show_fail, (reason,))
+
+    def on_disconnect(self):
+        self.connectionEvent.emit(self.show_disconnect, ())
+
+    def on_connection_lost(self, reason: str):
+        self.connectionEvent.emit(self.show_connection_lost, (reason,))
+
+    def on_reconnecting(self, attempt: int, delay: float):
+        self.connectionEvent.emit(self.show_reconnecting, (attempt, delay))
+
+    def on_reconnect(self, downtime: float, attempts: int):
+        self.connectionEvent.emit(self.show_reconnect, (downtime, attempts))
+
     def on_init(self):
         # Reset all gui controls
         self.btnQuit.setEnabled(False)
@@ -166,12 +221,6 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.update_status_lbl_text("Initializing...")
         self.log_to_list("ConnectionService", "Initializing...")
         self.imgRTV.setPixmap(QtGui.QPixmap(QtGui.QImage(os.path.relpath('wcu\\assets\\disconnected.png'))))
-        # Create necessary directories if needed
-        try:
-            os.mkdir(os.path.relpath('stream'))
-            self.logger.success("Stream folder created.")
-        except FileExistsError:
-            self.logger.success("Stream folder exists.")
 
     def on_ready(self):
         self.btnQuit.setEnabled(True)
@@ -184,7 +233,7 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.btnConnectDisconnect.setStyleSheet(f"color: {GuiColors.BLUE}")
         self.log_to_list("ConnectionService", "Ready to connect", GuiColors.GREEN)
 
-    def on_connecting(self):
+    def show_connecting(self):
         self.btnRecordStream.setEnabled(False)
         self.btnArmController.setEnabled(False)
         self.lblStatus.setText(Texts.CONNECTING)
@@ -197,7 +246,7 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.btnConnectDisconnect.setStyleSheet(f"color: {GuiColors.BLUE}")
         self.log_to_list("ConnectionService", "Connecting to robot...", GuiColors.BLUE)
 
-    def on_connect(self):
+    def show_connect(self):
         self.btnArmController.setEnabled(True)
         self.btnStartStopStream.setEnabled(True)
         self.btnConnectDisconnect.setEnabled(True)
@@ -210,7 +259,7 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.update_status_lbl_text("Waiting for commands...", GuiColors.BLUE)
         self.log_to_list("ConnectionService", "Established a connection with robot successfully.", GuiColors.GREEN)
 
-    def on_fail(self, reason: str | None):
+    def show_fail(self, reason: str | None):
         self.btnRecordStream.setEnabled(False)
         self.btnArmController.setEnabled(False)
         self.btnStartStopStream.setEnabled(False)
@@ -223,7 +272,7 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.log_to_list("ConnectionService", f"{reason}", GuiColors.RED)
         self.btnConnectDisconnect.setStyleSheet(f"color: {GuiColors.BLUE}")
 
-    def on_disconnect(self):
+    def show_disconnect(self):
         self.btnRecordStream.setEnabled(False)
         self.btnArmController.setEnabled(False)
         self.btnStartStopStream.setEnabled(False)
@@ -238,91 +287,162 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
             self.arm_controller.close()
         self.log_to_list("ConnectionService", "Lost connection with robot.", GuiColors.RED)
 
+    def show_connection_lost(self, reason: str):
+        # Resume the stream once connection is back
+        self.resumeStream = self.streamViewer.viewing_stream
+        self.streamViewer.stop_stream_view()
+        self.btnRecordStream.setEnabled(False)
+        self.btnArmController.setEnabled(False)
+        self.btnStartStopStream.setEnabled(False)
+        self.btnSwitchControlMode.setEnabled(False)
+        self.update_status_lbl_text(Texts.RECONNECTING, GuiColors.RED)
+        self.log_to_list("ConnectionService", f"Lost connection with robot ({reason}). Reconnecting...", GuiColors.RED)
+
+    def show_reconnecting(self, attempt: int, delay: float):
+        self.update_status_lbl_text(f"{Texts.RECONNECTING}\nAttempt {attempt} in {delay:.1f} s", GuiColors.RED)
+
+    def show_reconnect(self, downtime: float, attempts: int):
+        stats = self.connection.recovery_stats()
+        self.log_to_list("ConnectionService", f"Reconnected after {downtime:.1f} s in {attempts} attempts "
+                                              f"(mean {stats['mean']:.1f} s, max {stats['max']:.1f} s over "
+                                              f"{stats['recoveries']} recoveries).", GuiColors.GREEN)
+        if self.resumeStream:
+            self.resumeStream = False
+            self.when_replied(self.connection.request_start_stream(), self.on_start_stream_replied)
+
+    # StreamViewer calls these on the stream thread, they are handled on GUI thread in the order they came
     def on_stream_connecting(self):
+        self.streamEvent.emit(self.show_stream_connecting, ())
+
+    def on_stream_start(self):
+        self.streamEvent.emit(self.show_stream_start, ())
+
+    def on_stream_fail(self, reason: str):
+        self.streamEvent.emit(self.show_stream_fail, (reason,))
+
+    def on_stream_stop(self):
+        self.streamEvent.emit(self.show_stream_stop, ())
+
+    def show_stream_connecting(self):
         self.btnStartStopStream.setEnabled(False)
         self.btnStartStopStream.setText(Texts.REQUESTING_STREAM)
         self.log_to_list("StreamViewer", "Connecting to robot stream service...", GuiColors.BLUE)
         self.imgRTV.setPixmap(QtGui.QPixmap(os.path.relpath('wcu\\assets\\loading.png')))
 
-    def on_stream_start(self):
+    def show_stream_start(self):
         self.btnStartStopStream.setEnabled(True)
         self.btnStartStopStream.setText(Texts.STOP_STREAM)
         self.log_to_list("StreamViewer", "Started viewing stream.", GuiColors.GREEN)
         self.imgRTV.setPixmap(QtGui.QPixmap(os.path.relpath('wcu\\assets\\connected.png')))
 
-    def on_stream_first_frame(self, image: Image.Image):
-        self.btnRecordStream.setEnabled(False)
+    def on_stream_frame_ready(self, frames):
+        # Never paint from the stream thread, let GUI thread take the newest frame when it gets to it
+        self.frameReady.emit()
+
+    def show_latest_frame(self):
+        self.deliver_latest_frame(self.streamViewer.frames)
+
+    def show_frame(self, frame) -> QtGui.QImage | None:
+        # Decode JPEG frame straight from received data, Qt needs its own copy of the pooled buffer
+        image = QtGui.QImage()
+        if not image.loadFromData(frame.tobytes(), "JPG"):
+            return None
+        self.imgRTV.setPixmap(QtGui.QPixmap.fromImage(image))
+        # Glass-to-glass latency from capture on robot till frame is shown here
+        self.lblLatency.setText(f"Latency: {frame.latency_ms:.0f} ms")
+        return image
+
+    def on_stream_first_frame(self, frame):
+        self.btnRecordStream.setEnabled(True)
         self.btnStartStopStream.setEnabled(True)
         self.btnStartStopStream.setText(Texts.STOP_STREAM)
         self.btnRecordStream.setText(Texts.START_RECORDING_STREAM)
         try:
-            self.imgRTV.setPixmap(QtGui.QPixmap(QtGui.QImage(os.path.relpath('stream\\lastFrame.jpeg'))))
-            self.log_to_list("StreamViewer", f"Received frame: {image.size} | {image.format}", GuiColors.BLUE)
+            image = self.show_frame(frame)
+            if image is None:
+                self.logger.error("Can't decode first frame from stream.")
+                return
+            self.log_to_list("StreamViewer", f"Received frame: {(image.width(), image.height())} | {len(frame)} bytes", GuiColors.BLUE)
             self.log_to_list("StreamViewer", "Received first frame from stream.", GuiColors.GREEN)
         except Exception as e:
             self.logger.error(e)
 
-    def on_stream_receive_frame(self, image: Image.Image):
+    def on_stream_receive_frame(self, frame):
         try:
-            self.imgRTV.setPixmap(QtGui.QPixmap(QtGui.QImage(os.path.relpath('stream\\lastFrame.jpeg'))))
-            self.log_to_list("StreamViewer", f"Received frame: {image.size} | {image.format}", GuiColors.BLUE)
+            if self.show_frame(frame) is None:
+                self.logger.error("Can't decode frame from stream.", every=1.0)
         except Exception as e:
             self.logger.error(e)
             # self.logToList("StreamViewer", f"Error displaying frame: {e}", GuiColors.BLUE)
 
-    def on_stream_fail(self, reason: str):
+    def on_recording_stopped(self, recorder):
+        # Called on the writer thread of recorder
+        self.recordingStopped.emit(recorder)
+
+    def show_recording_stopped(self, recorder):
+        if recorder.failed:
+            self.log_to_list("Recorder", f"Recording '{recorder.name}' failed after {recorder.frames_recorded} frames.",
+                             GuiColors.RED)
+            return
+        self.log_to_list("Recorder", f"Recorded {recorder.frames_recorded} frames to '{recorder.directory}'.", GuiColors.GREEN)
+
+    def show_stream_fail(self, reason: str):
         self.btnStartStopStream.setEnabled(True)
         self.btnStartStopStream.setText(Texts.START_STREAM)
         self.log_to_list("StreamViewer", f"Failed to request stream. Reason('{reason}').", GuiColors.RED)
         self.imgRTV.setPixmap(QtGui.QPixmap(os.path.join(os.path.relpath('wcu\\assets\\disconnected.png'))))
 
-    def on_stream_stop(self):
+    def show_stream_stop(self):
         self.btnRecordStream.setEnabled(False)
         self.btnStartStopStream.setEnabled(False)
         self.btnStartStopStream.setText(Texts.START_STREAM)
         self.btnRecordStream.setText(Texts.START_RECORDING_STREAM)
         self.log_to_list("ConnectionService", "Lost connection with robot.")
+        self.lblLatency.clear()
         self.imgRTV.setPixmap(QtGui.QPixmap(os.path.join(os.path.relpath('wcu\\assets\\disconnected.png'))))
 
     def on_drive_forward(self):
-        if self.connection.send(data2json({"cmd": Directions.CMD_DRIVE_FORWARD})) > 0:
+        if self.connection.send_direction(Directions.CMD_DRIVE_FORWARD) > 0:
             self.log_to_list("CarDriver", "Moved forward.", )
             self.lblStatus.setText("Moved forward")
         else:
-            self.connection.disconnect()
-            self.log_to_list("ConnectionService", "Lost connection with robot")
+            self.on_command_failed()
 
     def on_drive_backward(self):
-        if self.connection.send(data2json({"cmd": Directions.CMD_DRIVE_BACKWARD})) > 0:
+        if self.connection.send_direction(Directions.CMD_DRIVE_BACKWARD) > 0:
             self.log_to_list("CarDriver", "Moved backward.", )
             self.lblStatus.setText("Moved backward")
         else:
-            self.connection.disconnect()
-            self.log_to_list("ConnectionService", "Lost connection with robot")
+            self.on_command_failed()
 
     def on_steer_right(self):
-        if self.connection.send(data2json({"cmd": Directions.CMD_ROTATE_RIGHT})) > 0:
+        if self.connection.send_direction(Directions.CMD_ROTATE_RIGHT) > 0:
             self.log_to_list("CarDriver", "Steered right.", )
             self.lblStatus.setText("Steered right.")
         else:
-            self.connection.disconnect()
-            self.log_to_list("ConnectionService", "Lost connection with robot")
+            self.on_command_failed()
 
     def on_steer_left(self):
-        if self.connection.send(data2json({"cmd": Directions.CMD_ROTATE_LEFT})) > 0:
+        if self.connection.send_direction(Directions.CMD_ROTATE_LEFT) > 0:
             self.log_to_list("CarDriver", "Steered left.", )
             self.lblStatus.setText("Steered left.")
         else:
-            self.connection.disconnect()
-            self.log_to_list("ConnectionService", "Lost connection with robot")
+            self.on_command_failed()
 
     def on_stop(self):
-        if self.connection.send(data2json({"cmd": Directions.CMD_STOP})) > 0:
+        if self.connection.send_direction(Directions.CMD_STOP) > 0:
             self.log_to_list("CarDriver", "Activated Brakes.", )
             self.lblStatus.setText("Stopped moving.")
         else:
-            self.connection.disconnect()
-            self.log_to_list("ConnectionService", "Lost connection with robot")
+            self.on_command_failed()
+
+    def on_command_failed(self):
+        if self.connection.reconnecting.is_set():
+            # Commands are rejected till the dropped connection is back
+            self.lblStatus.setText(Texts.RECONNECTING)
+            return
+        self.connection.disconnect()
+        self.log_to_list("ConnectionService", "Lost connection with robot")
 
     def showEvent(self, event: QtGui.QShowEvent) -> None:
         self.log_to_list("WCU", "GUI Initialized Successfully.")
@@ -333,6 +453,8 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.log_to_list("WCU", "Closing...")
         if self.arm_controller.isVisible():
             self.arm_controller.close()
+        if self.telemetry_window.isVisible():
+            self.telemetry_window.close()
         self.connection.disconnect()
         self.streamViewer.stop_stream_view()
         return super().closeEvent(a0)
@@ -347,6 +469,16 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
             case QtCore.Qt.Key.Key_Escape | QtCore.Qt.Key.Key_Q:
                 # Exit the application
                 self.close()
+            case QtCore.Qt.Key.Key_M:
+                # Start or stop measuring control latency
+                self.toggle_command_latency()
+            case QtCore.Qt.Key.Key_L:
+                # Dump control latency samples and telemetry
+                self.dump_command_latency()
+                self.dump_telemetry()
+            case QtCore.Qt.Key.Key_T:
+                # Plot robot telemetry
+                self.telemetry_window.show()
             case _:
                 # Decide where to go according to key pressed
                 self.driver.decide(key_pressed)
@@ -369,32 +501,108 @@ class MainWindow(QtWidgets.QMainWindow, ConnectionCallback, CarDriverCallback, S
         self.lblStatus.setText(msg)
         self.lblStatus.setStyleSheet(f"color: {color};")
 
+    def update_command_latency_lbl(self):
+        summary = self.connection.latency.summary()
+        if not self.connection.tracing or not summary['samples']:
+            self.lblCommandLatency.clear()
+            return
+        rtt = "/".join(f"{value:.0f}" for value in summary['rtt'])
+        act = "/".join("-" if value is None else f"{value:.0f}" for value in summary['act'])
+        self.lblCommandLatency.setText(f"RTT {rtt} | Act {act} ms (p50/95/99) | {summary['rate']:.1f} cmd/s")
+
+    def toggle_command_latency(self):
+        # Commands are only traced while latency is measured, every trace costs robot an echo
+        measuring = self.connection.trace_commands(0 if self.connection.tracing else TRACE_MEASURE_EVERY)
+        if measuring:
+            self.log_to_list("Latency", "Measuring control latency...", GuiColors.BLUE)
+        elif self.connection.trace_supported:
+            self.lblCommandLatency.clear()
+            self.log_to_list("Latency", "Stopped measuring control latency.", GuiColors.BLUE)
+        else:
+            self.log_to_list("Latency", "Robot can't echo traced commands.", GuiColors.RED)
+
+    def dump_command_latency(self):
+        try:
+            path = self.connection.latency.dump()
+            self.log_to_list("Latency", f"Dumped control latency to '{path}'.", GuiColors.GREEN)
+        except OSError as e:
+            self.log_to_list("Latency", f"Can't dump control latency. Reason: '{e}'", GuiColors.RED)
+
+    def dump_telemetry(self):
+        try:
+            path = self.connection.telemetry.dump()
+            stats = self.connection.telemetry.stats()
+            self.log_to_list("Telemetry", f"Dumped {len(self.connection.telemetry)} records to '{path}' "
+                                          f"({stats['bytes_per_record']:.1f} bytes per record).", GuiColors.GREEN)
+        except OSError as e:
+            self.log_to_list("Telemetry", f"Can't dump telemetry. Reason: '{e}'", GuiColors.RED)
+
     def connect_disconnect(self):
-        if self.connection.connected:
+        if self.connection.connected or self.connection.reconnecting.is_set():
             self.connection.disconnect()
             self.streamViewer.stop_stream_view()
         else:
             self.connection.connect()
 
+    def when_replied(self, future, callback):
+        """ Calls back on GUI thread with the result of a request once robot replies or it times out """
+        future.add_done_callback(lambda done: self.replyReady.emit(callback, done.result()))
+
     def switch_control_mode(self):
-        if self.connection.request_SCM():
+        self.btnSwitchControlMode.setEnabled(False)
+        self.when_replied(self.connection.request_SCM(), self.on_SCM_replied)
+
+    def on_SCM_replied(self, acked: bool):
+        self.btnSwitchControlMode.setEnabled(self.connection.connected)
+        if acked:
             self.log_to_list("Robot", "Switched control mode.")
         else:
             self.log_to_list("Robot", "Can't switch control mode.")
 
     def start_stop_stream(self):
+        self.btnStartStopStream.setEnabled(False)
         if self.streamViewer.viewing_stream:
-            # Close stream
-            if self.connection.request_close_stream():
-                self.streamViewer.stop_stream_view()
+            # Ask what the stream was adapted to along with closing it, status is logged whenever it arrives
+            self.when_replied(self.connection.request_stream_status(), self.on_stream_status)
+            self.when_replied(self.connection.request_close_stream(), self.on_close_stream_replied)
         else:
-            # Start stream
-            if self.connection.request_start_stream():
-                self.streamViewer.start_stream_view()
+            self.when_replied(self.connection.request_start_stream(), self.on_start_stream_replied)
+
+    def on_start_stream_replied(self, acked: bool):
+        if acked:
+            self.streamViewer.start_stream_view()
+        else:
+            self.btnStartStopStream.setEnabled(self.connection.connected)
+            self.log_to_list("Robot", "Robot didn't accept the stream request.", GuiColors.RED)
+
+    def on_close_stream_replied(self, acked: bool):
+        if acked:
+            self.streamViewer.stop_stream_view()
+        else:
+            self.btnStartStopStream.setEnabled(self.connection.connected)
+            self.log_to_list("Robot", "Robot didn't accept closing the stream.", GuiColors.RED)
+
+    def on_stream_status(self, status: dict | None):
+        if not status:
+            return
+        self.log_to_list("Stream", f"{status['res'][0]}x{status['res'][1]} @ {status['fps']} fps, "
+                                   f"quality {status['q']} (level {status['level'] + 1}/{status['levels']})")
+        for client in status.get('clients', []):
+            self.log_to_list("Stream", f"{client['client']}: {client['fps']} fps, {client['kbps']} kbps, "
+                                       f"dropped {client['dropped']} frames")
+
+    def start_stop_recording(self):
+        if self.streamViewer.recording:
+            # Queued frames are written in the background, on_recording_stopped tells when they're on disk
+            self.streamViewer.stop_recording()
+            self.btnRecordStream.setText(Texts.START_RECORDING_STREAM)
+        elif self.streamViewer.viewing_stream:
+            recorder = self.streamViewer.start_recording()
+            self.btnRecordStream.setText(Texts.STOP_RECORDING_STREAM)
+            self.log_to_list("Recorder", f"Recording stream as '{recorder.name}'...", GuiColors.BLUE)
 
     def handle_arm_data(self, joint, opt):
-        payload = data2json({'arm': 1, 'jid': joint[0], 'ag': opt})  # super important model to be used in rpi
-        if self.connection.send(payload) > 0:
+        if self.connection.send_arm_mv(joint[0], opt) > 0:
             self.log_to_list(self.arm_controller.tag, f"'{joint[0]}' is moving {'upward' if opt == Opts.UP else 'downward'}", GuiColors.GREEN)
             self.arm_controller.ujr(joint[0], opt)
 
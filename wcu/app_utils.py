@@ -1,8 +1,23 @@
+import struct
+from time import monotonic_ns
+from json import dumps as data2json
+
 PORT_RTV_SOCKET = 2005
 PORT_DATA_SOCKET = 2001
 ROBOT_HOSTNAME = 'rloader'
 DEFAULT_BUFFER_SIZE = 1024  # 1 KB per buffer
 FRAME_BUFFER_SIZE = 128 * 1024  # 128 KB per buffer
+FRAME_HEADER = struct.Struct("<LQ")  # Frame size and capture time in microseconds since epoch
+RECORDINGS_FOLDER = 'recordings'
+LATENCY_FOLDER = 'latency'
+TRACE_EVERY = 0  # Trace every n-th control command, 0 disables tracing till latency is measured
+TRACE_MEASURE_EVERY = 1  # Trace every n-th control command while latency is measured
+HEARTBEAT_INTERVAL = 0.25  # Seconds between heartbeats, 0 disables heartbeats
+HEARTBEAT_MISSES = 4  # Missed heartbeats before the other end is considered gone
+TELEMETRY_RATE = 20  # Telemetry samples per second asked from robot, 0 disables telemetry
+TELEMETRY_BATCH = 10  # Telemetry samples per batch pushed by robot
+TELEMETRY_HISTORY = 120  # Seconds of telemetry kept
+TELEMETRY_FOLDER = 'telemetry'
 
 
 class RobotError(Exception):
@@ -18,6 +33,12 @@ class Signals:
     SIGNAL_SWITCH_CONTROL_MODE = 'SCM'
     SIGNAL_DISCONNECT = 'BYE'
     SIGNAL_ACK = 'ACK'
+    SIGNAL_NEGOTIATE_ENCODING = 'ENC'
+    SIGNAL_STREAM_STATUS = 'SST'
+    SIGNAL_TRACE = 'TRC'
+    SIGNAL_REQUEST_IDS = 'RID'
+    SIGNAL_HEARTBEAT = 'HB'
+    SIGNAL_TELEMETRY = 'TLM'
 
 
 class Directions:
@@ -34,6 +55,148 @@ class ControlModes:
     CONTROL_MODE_AUTOMATIC = 'acm'
 
 
+class Encodings:
+    """ Payload encodings that WCU and Robot can negotiate for the control channel """
+    JSON = 'json'
+    BINARY = 'bin'
+
+
+PREFERRED_ENCODING = Encodings.BINARY
+
+
+class Opcodes:
+    """ Opcodes of the binary encoding. Every command fits in a few bytes:
+    directions and signals are a single opcode byte, arm moves are (opcode, joint id, operation)
+    """
+    DIRECTIONS = {
+        Directions.CMD_DRIVE_FORWARD: 0x01,
+        Directions.CMD_DRIVE_BACKWARD: 0x02,
+        Directions.CMD_ROTATE_RIGHT: 0x03,
+        Directions.CMD_ROTATE_LEFT: 0x04,
+        Directions.CMD_STOP: 0x05,
+    }
+    SIGNALS = {
+        Signals.SIGNAL_START_STREAM: 0x10,
+        Signals.SIGNAL_CLOSE_STREAM: 0x11,
+        Signals.SIGNAL_SWITCH_CONTROL_MODE: 0x12,
+        Signals.SIGNAL_DISCONNECT: 0x13,
+        Signals.SIGNAL_ACK: 0x14,
+        Signals.SIGNAL_STREAM_STATUS: 0x15,
+        Signals.SIGNAL_TRACE: 0x16,
+        Signals.SIGNAL_REQUEST_IDS: 0x17,
+        Signals.SIGNAL_HEARTBEAT: 0x18,
+        Signals.SIGNAL_TELEMETRY: 0x19,
+    }
+    ARM_MOVE = 0x20
+    ARM_MOVE_STRUCT = struct.Struct("<BBb")
+    # Traced commands are (opcode, seq, WCU send time) followed by the command payload of either encoding
+    TRACE = 0x30
+    TRACE_STRUCT = struct.Struct("<BIQ")
+    # Echo of a traced command: (opcode, seq, WCU send time, received, decoded, actuated, echoed) in robot time
+    TRACE_ECHO = 0x31
+    TRACE_ECHO_STRUCT = struct.Struct("<BIQQQQQ")
+    # Requests are (opcode, request id) followed by the signal payload of either encoding,
+    # replies are (opcode, request id) followed by the reply
+    REQUEST = 0x32
+    REPLY = 0x33
+    REQUEST_STRUCT = struct.Struct("<BH")
+    # Telemetry batches are (opcode, record count) followed by the delta encoded records
+    TELEMETRY = 0x34
+    TELEMETRY_STRUCT = struct.Struct("<BH")
+
+
+class Telemetry:
+    """ Telemetry records pushed by robot.
+
+    Every record is a varint bitmask of the fields that changed since the previous record, followed by
+    the zigzag varint delta of every changed field in FIELDS order. First record of a batch is delta
+    encoded against zeros, so every batch decodes on its own.
+    """
+    FIELDS = (
+        'time_us',  # Robot monotonic time of the sample
+        'flags',  # FLAG_* bits and drive output state
+        'sound',  # Samples that heard sound in the last sound window
+        'sound_peak',  # Peak of sound since automatic driving started
+        'sound_target',  # Sound needed to detect the buzzer
+        'sound_overruns',  # Times the sound sampler fell behind
+        'lateness_us',  # How late this sample was taken, i.e. telemetry loop jitter
+        'applied',  # Drive commands applied by the DriveMailbox
+        'coalesced',  # Drive commands coalesced by the DriveMailbox
+    )
+    FLAG_LEFT_LF = 1 << 0  # Left LF sensor is on black line
+    FLAG_RIGHT_LF = 1 << 1  # Right LF sensor is on black line
+    FLAG_IDLE = 1 << 2  # Car is waiting for the buzzer
+    FLAG_AUTO = 1 << 3  # Automatic driver is driving
+    FLAG_SAMPLING = 1 << 4  # Sound sensor is sampling
+    OUTPUT_SHIFT = 5  # Drive output state bits start here
+
+
+# Payloads are built once per encoding instead of on every keypress
+_DIRECTION_PAYLOADS = {
+    Encodings.JSON: {cmd: data2json({"cmd": cmd}) for cmd in Opcodes.DIRECTIONS},
+    Encodings.BINARY: {cmd: bytes([opcode]) for cmd, opcode in Opcodes.DIRECTIONS.items()},
+}
+_SIGNAL_PAYLOADS = {
+    Encodings.JSON: {signal: data2json({"signal": signal}) for signal in Opcodes.SIGNALS},
+    Encodings.BINARY: {signal: bytes([opcode]) for signal, opcode in Opcodes.SIGNALS.items()},
+}
+
+
+def encode_direction(direction: str, encoding: str = Encodings.JSON):
+    return _DIRECTION_PAYLOADS[encoding][direction]
+
+
+def encode_signal(signal: str, encoding: str = Encodings.JSON):
+    return _SIGNAL_PAYLOADS[encoding][signal]
+
+
+def encode_arm_mv(joint: str, operation: int, encoding: str = Encodings.JSON):
+    """
+    :param joint: Joint name as 'joint_<jid>'
+    :param operation: Operation.UP or Operation.DOWN
+    """
+    if encoding == Encodings.BINARY:
+        return Opcodes.ARM_MOVE_STRUCT.pack(Opcodes.ARM_MOVE, int(joint.split("_")[1]), operation)
+    return data2json({'arm': 1, 'jid': joint, 'ag': operation})  # super important model to be used in rpi
+
+
+def now_us() -> int:
+    return monotonic_ns() // 1000
+
+
+def encode_trace(payload, seq: int, sent_at: int) -> bytes:
+    """ Wraps a command payload of either encoding with a trace header """
+    if type(payload) is str:
+        payload = payload.encode('utf-8')
+    return Opcodes.TRACE_STRUCT.pack(Opcodes.TRACE, seq, sent_at) + payload
+
+
+def read_varint(data, offset: int) -> tuple:
+    """
+    Returns:
+        tuple: (Value, offset right after it)
+    """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def unzigzag(value: int) -> int:
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def encode_request(payload, rid: int) -> bytes:
+    """ Wraps a signal payload of either encoding with a request header """
+    if type(payload) is str:
+        payload = payload.encode('utf-8')
+    return Opcodes.REQUEST_STRUCT.pack(Opcodes.REQUEST, rid) + payload
+
+
 class Status:
 
     CONNECTED = 1
@@ -59,6 +222,7 @@ class GuiTexts:
     CONNECT = "Connect to Robot"
     DISCONNECT = "Disconnect from Robot"
     RECONNECT = "Reconnect to Robot"
+    RECONNECTING = 'Reconnecting...'
     REQUESTING_STREAM = 'Realtime Video Stream requested'
     CONTROL_MODE_AUTO = 'Changed to Automatic Control'
     CONTROL_MODE_MANUAL = 'Changed to Manual Control'
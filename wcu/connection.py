@@ -1,10 +1,15 @@
 from logger import Logger
 import app_utils as utils
-from threading import Event, Thread
-from json import dumps as data2Json
-from sockets import ClientSocket, SocketError
+from latency import LatencyTracker
+from telemetry import TelemetryBuffer
+from collections import deque
+from concurrent.futures import Future
+from random import uniform
+from time import monotonic, sleep
+from threading import Event, Thread, Lock, Timer
+from json import dumps as data2Json, loads as json2Data
+from sockets import ClientSocket, SocketError, shared_resolver
 from socket import (
-    gethostbyname,
     timeout as SocketTimeoutError,
     gaierror as GetAddressInfoError)
 
@@ -32,15 +37,164 @@ class ConnectionCallback:
     def on_error(self, reason: str | None):
         pass
 
+    def on_connection_lost(self, reason: str):
+        """ Called when an established connection drops, before reconnecting starts """
+        pass
+
+    def on_reconnecting(self, attempt: int, delay: float):
+        pass
+
+    def on_reconnect(self, downtime: float, attempts: int):
+        """ Called after on_connect once a dropped connection is back """
+        pass
+
+
+class PendingRequests:
+    """ Requests waiting for robot to reply.
+
+    Requests sent with an id are resolved by the reply carrying the same id, in whatever order replies
+    arrive. Robots that don't know request ids reply in order, so requests sent without an id are
+    resolved by the next reply that carries no id. Every request resolves on its own deadline if robot
+    never replies. A request without an id that expires still gets its reply later, so as many replies
+    without an id are dropped before the next request is resolved, unless robot may ignore it for good.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.by_rid: dict[int, tuple] = {}  # rid -> (future, parse, timer, answered)
+        self.in_order = deque()  # (future, parse, timer, answered)
+        self.next_rid = 0
+        self.late_replies = 0  # Replies of expired requests without an id that are still on their way
+
+    def add(self, parse, timeout: float, with_rid: bool, answered: bool = True) -> tuple:
+        """
+        :param answered: False if robot may never reply (e.g. a signal older robots don't know)
+
+        Returns:
+            tuple: (Request id or None, future resolved with the parsed reply, or parse(None) on timeout)
+        """
+        future = Future()
+        timer = Timer(timeout, self.expire, args=[future])
+        timer.daemon = True
+        entry = (future, parse, timer, answered)
+        with self.lock:
+            if with_rid:
+                rid = self.next_rid
+                while rid in self.by_rid:
+                    rid = (rid + 1) & 0xFFFF
+                self.next_rid = (rid + 1) & 0xFFFF
+                self.by_rid[rid] = entry
+            else:
+                rid = None
+                self.in_order.append(entry)
+        timer.start()
+        return rid, future
+
+    def resolve(self, rid: int | None, reply: bytes | None) -> bool:
+        """ Resolves the request the reply belongs to
+
+        Returns:
+            bool: False if no request is waiting for the reply
+        """
+        with self.lock:
+            if rid is not None:
+                entry = self.by_rid.pop(rid, None)
+            elif self.late_replies:
+                # Reply of an expired request, resolving the next one with it would shift every reply after it
+                self.late_replies -= 1
+                entry = None
+            else:
+                entry = self.in_order.popleft() if self.in_order else None
+        if entry is None:
+            return False
+        self.__resolve(entry, reply)
+        return True
+
+    def cancel_all(self):
+        """ Resolves every pending request as timed out (e.g. when connection is lost) """
+        with self.lock:
+            entries = list(self.by_rid.values()) + list(self.in_order)
+            self.by_rid.clear()
+            self.in_order.clear()
+            self.late_replies = 0
+        for entry in entries:
+            self.__resolve(entry, None)
+
+    def expire(self, future: Future):
+        """ Resolves a request as timed out if it's still waiting """
+        with self.lock:
+            rid = next((rid for rid, entry in self.by_rid.items() if entry[0] is future), None)
+            if rid is not None:
+                entry = self.by_rid.pop(rid)
+            else:
+                entry = next((entry for entry in self.in_order if entry[0] is future), None)
+                if entry is not None:
+                    self.in_order.remove(entry)
+                    if entry[3]:
+                        self.late_replies += 1
+        if entry is not None:
+            self.__resolve(entry, None)
+
+    @staticmethod
+    def __resolve(entry: tuple, reply: bytes | None):
+        future, parse, timer, _ = entry
+        timer.cancel()
+        try:
+            future.set_result(parse(reply.decode('utf-8', errors='replace') if reply is not None else None))
+        except Exception as e:
+            future.set_exception(e)
+
+
+def parse_ack(reply: str | None) -> bool:
+    return reply == utils.Signals.SIGNAL_ACK
+
+
+def parse_heartbeat(reply: str | None) -> bool:
+    return reply == utils.Signals.SIGNAL_HEARTBEAT
+
+
+def parse_stream_status(reply: str | None) -> dict | None:
+    try:
+        return json2Data(reply).get('stream', None) if reply else None
+    except ValueError:
+        return None
+
 
 class ConnectionService:
 
+    # Seconds to wait for a reply of robot
+    RESPONSE_TIMEOUT = 1
+
     def __init__(self, callback: ConnectionCallback) -> None:
         # Attach callback to this service
         self.callback = callback
         self.callback.on_init()
         # Runtime prepare
+        self.socket = None
         self.conn_switcher = Event()
+        self.state_lock = Lock()
+        self.encoding = utils.Encodings.JSON
+        # Reconnecting
+        self.auto_reconnect = True
+        self.reconnecting = Event()
+        self.abort_reconnect = Event()
+        self.recoveries = []  # (downtime, attempts) of every recovered connection
+        self.rejected = 0
+        # Heartbeats
+        self.heartbeat = False
+        self.heartbeat_interval = utils.HEARTBEAT_INTERVAL
+        self.heartbeat_misses = utils.HEARTBEAT_MISSES
+        self.last_heard = monotonic()
+        self.request_ids = False
+        self.pending = PendingRequests()
+        # Telemetry pushed by robot
+        self.telemetry = TelemetryBuffer()
+        # Control command tracing
+        self.trace_supported = False
+        self.trace_every = utils.TRACE_EVERY
+        self.commands = 0
+        self.seq = 0
+        self.latency = LatencyTracker()
         self.logger = Logger("ConnectionService")
         self.logger.info("Initializing service...")
         # Connection service is ready
@@ -51,22 +205,31 @@ class ConnectionService:
     def connected(self) -> bool:
         return self.conn_switcher.is_set()
 
+    @property
+    def tracing(self) -> bool:
+        return self.trace_supported and self.trace_every > 0
+
     def connect(self) -> None:
         # Check if already connected
-        if self.connected:
+        if self.connected or self.reconnecting.is_set():
             self.logger.warning("Service is already connected !!")
             return
-        # Connection socket
-        self.socket = ClientSocket()
-        self.socket.settimeout(1)
         # Start a connection handler
         ConnectionHandler().handle_connection(self)
 
     def disconnect(self) -> None:
-        if self.connected:
+        if self.reconnecting.is_set():
+            # Operator gave up on the dropped connection
+            self.abort_reconnect.set()
+            self.reconnecting.clear()
+            self.callback.on_disconnect()
+            self.logger.info("Stopped reconnecting.")
+        elif self.connected:
             try:
-                self.socket.close()
+                # Clear first so the reader doesn't take the close as a dropped connection
                 self.conn_switcher.clear()
+                self.socket.close()
+                self.pending.cancel_all()
                 self.callback.on_disconnect()
                 self.logger.info("Closed connection successfully.")
             except:
@@ -74,73 +237,325 @@ class ConnectionService:
         else:
             self.logger.warning("Service hasn't connected to be disconnected.")
 
-    def send(self, json_data: str) -> int:
+    def on_link_lost(self, reason: str):
+        """ Drops the established connection and starts reconnecting to robot if auto_reconnect is on """
+        with self.state_lock:
+            if not self.connected:
+                return
+            self.conn_switcher.clear()
+            if self.reconnecting.is_set():
+                # Dropped again while the supervisor was negotiating, it'll take it as a failed attempt
+                self.socket.close()
+                self.pending.cancel_all()
+                return
+            self.reconnecting.set()
+        self.socket.close()
+        self.pending.cancel_all()
+        self.logger.error(f"Lost connection with robot. Reason: '{reason}'")
+        self.callback.on_connection_lost(reason)
+        if self.auto_reconnect:
+            self.abort_reconnect.clear()
+            ReconnectSupervisor().supervise(self)
+        else:
+            self.reconnecting.clear()
+            self.callback.on_disconnect()
+
+    def recovery_stats(self) -> dict:
+        """
+        Returns:
+            dict: How many times a dropped connection was recovered and its last, mean and max downtime in seconds
+        """
+        downtimes = [downtime for downtime, _ in self.recoveries]
+        return {
+            'recoveries': len(downtimes),
+            'last': downtimes[-1] if downtimes else None,
+            'mean': sum(downtimes) / len(downtimes) if downtimes else None,
+            'max': max(downtimes) if downtimes else None,
+        }
+
+    def send(self, payload) -> int:
         if not self.connected:
-            self.logger.warning("Service hasn't connected yet.")
+            if self.reconnecting.is_set():
+                # Commands are rejected rather than buffered, a stale drive command must never run late
+                self.rejected += 1
+                self.logger.warning("Rejected command while reconnecting.", every=1.0)
+            else:
+                self.logger.warning("Service hasn't connected yet.")
             return 0
         try:
-            bytes_sent = self.socket.send(json_data)
+            bytes_sent = self.socket.send_message(payload)
             if not bytes_sent:
                 raise SocketError()
-            self.logger.info(f"Sent: '{json_data}' of length: {bytes_sent} byte.")
+            self.logger.debug("Sent: '%s' of length: %d byte.", payload, bytes_sent)
             return bytes_sent
         except (TimeoutError, SocketTimeoutError):
             self.logger.error("Timeout while trying to send data.")
             self.callback.on_error("Timeout while trying to send data.")
+            self.on_link_lost("Timeout while trying to send data.")
             return 0
-        except (ConnectionAbortedError, ConnectionResetError, SocketError):
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, SocketError):
             self.logger.error("Connection was closed unexpectedly.")
             self.callback.on_error("Connection was closed unexpectedly.")
+            self.on_link_lost("Connection was closed unexpectedly.")
             return 0
 
-    def receive(self, buffer_size=1024, deserialize_json: bool = False) -> str | None:
-        if not self.connected:
-            self.logger.warning("Service hasn't connected yet.")
-            return None
-        try:
-            rcvd_data = self.socket.receive(buffer_size).decode('utf-8')
-            self.logger.info(f"Received payload: {rcvd_data}")
-            return rcvd_data
-        except (TimeoutError, SocketTimeoutError):
-            return None
-
-    def request_start_stream(self) -> bool:
-        if self.send(data2Json({"signal": utils.Signals.SIGNAL_START_STREAM})) > 0:
-            # Wait for ACK signal
-            return True if self.receive() == utils.Signals.SIGNAL_ACK else False
-        # Can't request stream
-        return False
-
-    def request_close_stream(self) -> bool:
-        if self.send(data2Json({"signal": utils.Signals.SIGNAL_CLOSE_STREAM})) > 0:
-            # Wait for ACK signal
-            return True if self.receive() == utils.Signals.SIGNAL_ACK else False
-        # Can't request stream
-        return False
-
-    def request_SCM(self) -> bool:
-        if self.send(data2Json({"signal": utils.Signals.SIGNAL_SWITCH_CONTROL_MODE})) > 0:
-            # Wait for ACK signal
-            return True if self.receive() == utils.Signals.SIGNAL_ACK else False
-        # Can't request stream
-        return False
+    def request(self, payload, parse=parse_ack, timeout: float | None = None,
+                with_rid: bool | None = None, answered: bool = True) -> Future:
+        """ Sends a request without waiting for its reply
+
+        Args:
+            payload: Encoded signal
+            parse: Turns the reply, or None if there's no reply, into the result of the request
+            timeout (float, optional): Seconds to wait for the reply, RESPONSE_TIMEOUT by default
+            with_rid (bool, optional): Whether to send it with a request id, only if robot knows them by default
+            answered (bool, optional): False if robot may ignore it, so its reply isn't awaited once it times out
+
+        Returns:
+            Future: Resolved with the parsed reply once it arrives or the request times out
+        """
+        with_rid = self.request_ids if with_rid is None else with_rid
+        rid, future = self.pending.add(parse, timeout or self.RESPONSE_TIMEOUT, with_rid, answered)
+        if self.send(utils.encode_request(payload, rid) if with_rid else payload) <= 0:
+            self.pending.expire(future)
+        return future
+
+    def request_signal(self, signal: str, parse=parse_ack, timeout: float | None = None) -> Future:
+        return self.request(utils.encode_signal(signal, self.encoding), parse, timeout)
+
+    def send_command(self, payload) -> int:
+        """ Sends a control command, wrapping every trace_every-th one with a trace header while tracing """
+        self.latency.on_sent()
+        self.commands += 1
+        if self.tracing and self.commands % self.trace_every == 0:
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            payload = utils.encode_trace(payload, self.seq, utils.now_us())
+        return self.send(payload)
+
+    def send_direction(self, direction: str) -> int:
+        return self.send_command(utils.encode_direction(direction, self.encoding))
+
+    def send_signal(self, signal: str) -> int:
+        return self.send(utils.encode_signal(signal, self.encoding))
+
+    def send_arm_mv(self, joint: str, operation: int) -> int:
+        return self.send_command(utils.encode_arm_mv(joint, operation, self.encoding))
+
+    def negotiate_encoding(self, encoding: str = utils.PREFERRED_ENCODING) -> str:
+        """ Asks robot to accept the given payload encoding, falling back to JSON if it doesn't ACK
+
+        Negotiation itself is always sent as JSON since that's what every robot version understands.
+        """
+        self.encoding = utils.Encodings.JSON
+        if encoding != utils.Encodings.JSON:
+            request = data2Json({"signal": utils.Signals.SIGNAL_NEGOTIATE_ENCODING, "enc": encoding})
+            # Older robots ignore signals they don't know instead of replying
+            if self.request(request, with_rid=False, answered=False).result():
+                self.encoding = encoding
+        self.logger.info(f"Using '{self.encoding}' encoding for commands.")
+        return self.encoding
+
+    def negotiate_request_ids(self) -> bool:
+        """ Asks robot to reply requests with their ids, falling back to in order replies if it doesn't ACK """
+        request = utils.encode_signal(utils.Signals.SIGNAL_REQUEST_IDS, self.encoding)
+        self.request_ids = bool(self.request(request, with_rid=False, answered=False).result())
+        self.logger.info(f"Requests are {'pipelined' if self.request_ids else 'replied in order'}.")
+        return self.request_ids
+
+    def negotiate_heartbeat(self) -> bool:
+        """ Tells robot how often heartbeats come, leaving them off if it doesn't reply
+
+        Only robots that know request ids know heartbeats, and the negotiation reply carries its id,
+        so it's never mistaken for the reply of a plain heartbeat.
+        """
+        self.heartbeat = False
+        if self.heartbeat_interval > 0 and self.request_ids:
+            request = data2Json({"signal": utils.Signals.SIGNAL_HEARTBEAT, "interval": self.heartbeat_interval,
+                                 "misses": self.heartbeat_misses})
+            self.heartbeat = self.request(request, parse=parse_heartbeat).result()
+        if self.heartbeat:
+            self.last_heard = monotonic()
+            HeartbeatMonitor().monitor(self)
+        self.logger.info(f"Heartbeats are {'on' if self.heartbeat else 'off'}.")
+        return self.heartbeat
+
+    def request_telemetry(self, rate: float = utils.TELEMETRY_RATE, batch: int = utils.TELEMETRY_BATCH) -> Future:
+        """ Asks robot to push telemetry at rate samples per second in batches of batch samples, 0 rate stops it
+
+        Once robot ACKs, telemetry buffer is resized to keep TELEMETRY_HISTORY seconds at the new rate.
+        """
+        future = self.request(data2Json({"signal": utils.Signals.SIGNAL_TELEMETRY, "rate": rate, "batch": batch}))
+
+        def on_reply(reply: Future):
+            if rate > 0 and not reply.exception() and reply.result():
+                self.telemetry.resize(round(utils.TELEMETRY_HISTORY * rate))
+        future.add_done_callback(on_reply)
+        return future
+
+    def negotiate_telemetry(self) -> bool:
+        """ Starts telemetry on robots that know request ids, older ones never push it """
+        enabled = utils.TELEMETRY_RATE > 0 and self.request_ids and self.request_telemetry().result()
+        self.logger.info(f"Telemetry is {'on' if enabled else 'off'}.")
+        return enabled
+
+    def negotiate_tracing(self) -> bool:
+        """ Asks robot whether it echoes traced control commands back, commands are only traced once
+        trace_commands turns tracing on, or right away if TRACE_EVERY is above 0
+        """
+        self.trace_supported = bool(self.request_signal(utils.Signals.SIGNAL_TRACE).result())
+        self.logger.info(f"Tracing of control commands is {'on' if self.tracing else 'off'}"
+                         f"{'' if self.trace_supported else ', robot does not echo traces'}.")
+        return self.trace_supported
+
+    def trace_commands(self, every: int) -> bool:
+        """ Traces every n-th control command from now on, 0 stops tracing
+
+        Returns:
+            bool: True if commands are traced
+        """
+        self.trace_every = max(0, every)
+        return self.tracing
+
+    def request_start_stream(self) -> Future:
+        return self.request_signal(utils.Signals.SIGNAL_START_STREAM)
+
+    def request_close_stream(self) -> Future:
+        return self.request_signal(utils.Signals.SIGNAL_CLOSE_STREAM)
+
+    def request_SCM(self) -> Future:
+        return self.request_signal(utils.Signals.SIGNAL_SWITCH_CONTROL_MODE)
+
+    def request_stream_status(self) -> Future:
+        """ Asks robot for the operating point its stream is currently adapted to
+
+        Returns:
+            Future: Resolved with resolution, fps, quality, ladder level, send time, backlog and per client stats,
+                or None if robot didn't reply
+        """
+        return self.request_signal(utils.Signals.SIGNAL_STREAM_STATUS, parse_stream_status)
+
+
+HEARTBEAT_REPLY = utils.Signals.SIGNAL_HEARTBEAT.encode('utf-8')
+
+
+class ControlReader:
+    """ Reads everything robot sends on the control channel on its own thread.
+
+    Trace echoes go straight to the latency tracker, so they're counted as soon as they arrive,
+    while replies are queued for the request that waits on them.
+    """
+
+    def read(self, service: ConnectionService):
+        Thread(name="Con-Reader", target=self.reader_job, args=[service], daemon=True).start()
+
+    def reader_job(self, service: ConnectionService):
+        # Stick to the socket of this connection, a reconnect brings its own reader
+        socket = service.socket
+        while service.connected and service.socket is socket:
+            try:
+                payload = socket.receive_message(utils.DEFAULT_BUFFER_SIZE)
+            except (TimeoutError, SocketTimeoutError):
+                continue
+            except (OSError, SocketError) as e:
+                # Either socket was closed by disconnect or connection dropped
+                if service.socket is socket:
+                    service.on_link_lost(f"{e}")
+                break
+            if not payload:
+                service.logger.error("Received empty packet which means connection was lost.")
+                if service.socket is socket:
+                    service.on_link_lost("Received empty packet.")
+                break
+            # Anything robot sends proves it's alive
+            service.last_heard = monotonic()
+            if payload == HEARTBEAT_REPLY:
+                continue
+            if payload[0] == utils.Opcodes.TRACE_ECHO and len(payload) == utils.Opcodes.TRACE_ECHO_STRUCT.size:
+                service.latency.on_echo(payload)
+            elif payload[0] == utils.Opcodes.TELEMETRY and len(payload) >= utils.Opcodes.TELEMETRY_STRUCT.size:
+                service.telemetry.ingest(payload)
+            elif payload[0] == utils.Opcodes.REPLY and len(payload) >= utils.Opcodes.REQUEST_STRUCT.size:
+                _, rid = utils.Opcodes.REQUEST_STRUCT.unpack_from(payload)
+                if not service.pending.resolve(rid, payload[utils.Opcodes.REQUEST_STRUCT.size:]):
+                    service.logger.warning(f"Dropped late reply of request {rid}.")
+            elif not service.pending.resolve(None, payload):
+                service.logger.warning("Dropped a late reply or one nobody is waiting for: %s", payload)
+        # Nobody will reply anymore
+        if service.socket is socket:
+            service.pending.cancel_all()
+        service.logger.info("ControlReader finished his job.")
+
+
+class HeartbeatMonitor:
+    """ Sends heartbeats to robot and drops the connection once robot stays silent.
+
+    Robot replies every heartbeat and any message from robot counts as a sign of life, so a robot
+    that misses heartbeat_misses intervals is taken as gone right away, without waiting for a send
+    to fail or TCP to time out.
+    """
+
+    def monitor(self, service: ConnectionService):
+        Thread(name="Con-Heartbeat", target=self.monitor_job, args=[service], daemon=True).start()
+
+    def monitor_job(self, service: ConnectionService):
+        socket = service.socket
+        heartbeat = utils.encode_signal(utils.Signals.SIGNAL_HEARTBEAT, service.encoding)
+        timeout = service.heartbeat_interval * service.heartbeat_misses
+        while service.connected and service.socket is socket:
+            silent_for = monotonic() - service.last_heard
+            if silent_for >= timeout:
+                service.on_link_lost(f"Robot missed its heartbeats for {silent_for:.2f} s")
+                break
+            service.send(heartbeat)
+            sleep(min(service.heartbeat_interval, timeout - silent_for))
+
 
 class ConnectionHandler:
 
     def handle_connection(self, service: ConnectionService):
         Thread(name="Con-Handler", target=self.handler_job, args=[service]).start()
 
+    @staticmethod
+    def establish(service: ConnectionService):
+        """ Connects to robot on a new socket and negotiates the session
+
+        Raises:
+            OSError: If robot can't be resolved or connected to
+        """
+        # Resolve the address of robot will be connected on, a cached one is reused
+        robot_host = shared_resolver.resolve(utils.ROBOT_HOSTNAME)
+        address = (robot_host, utils.PORT_DATA_SOCKET)
+        service.logger.success(f"Found 'rloader' at '{robot_host}'")
+        # Connect to robot on resolved address
+        service.socket = ClientSocket()
+        service.socket.settimeout(1)
+        try:
+            service.socket.connect(address)
+        except ConnectionRefusedError:
+            # Robot is there but isn't serving yet, its address is fine
+            service.socket.close()
+            raise
+        except OSError:
+            service.socket.close()
+            # Robot may have got another address since it was cached
+            shared_resolver.invalidate(utils.ROBOT_HOSTNAME)
+            raise
+        service.conn_switcher.set()
+        ControlReader().read(service)
+        service.negotiate_encoding()
+        service.negotiate_request_ids()
+        service.negotiate_heartbeat()
+        service.negotiate_tracing()
+        service.negotiate_telemetry()
+
     def handler_job(self, service: ConnectionService):
         try:
             service.callback.on_connecting()
             service.logger.info("Connecting to robot...")
-            # Resolve the address of robot will be connected on
-            robot_host = gethostbyname(utils.ROBOT_HOSTNAME)
-            address = (robot_host, utils.PORT_DATA_SOCKET)
-            service.logger.success(f"Found 'rloader' at '{robot_host}'")
-            # Connect to robot on resolved address
-            service.socket.connect(address)
-            service.conn_switcher.set()
+            self.establish(service)
+            if not service.connected:
+                # Dropped while negotiating, it was already reported as lost
+                service.logger.warning("Connection was dropped while negotiating the session.")
+                return
             service.callback.on_connect()
             service.logger.success("Established a connection to robot successfully.")
         except GetAddressInfoError:
@@ -153,5 +568,69 @@ class ConnectionHandler:
         except ConnectionRefusedError:
             service.logger.error("Connection was refused by the target machine.")
             service.callback.on_fail("Connection was refused by the target machine.")
+        except (OSError, SocketError) as e:
+            # Unreachable robot, or connection dropped while negotiating the session
+            with service.state_lock:
+                service.conn_switcher.clear()
+                recovering = service.reconnecting.is_set()
+            if service.socket is not None:
+                service.socket.close()
+            service.logger.error(f"Can't connect to robot. Reason: '{e}'")
+            if not recovering:
+                # Otherwise ReconnectSupervisor has taken over the dropped connection
+                service.callback.on_fail(f"Can't connect to robot. Reason: '{e}'")
         finally:
             service.logger.info("ConnectionHandler finished his job.")
+
+
+class ReconnectSupervisor:
+    """ Brings a dropped connection back.
+
+    Attempts are spaced with exponential backoff and full jitter: the delay before attempt n is
+    picked at random between 0 and min(max_delay, base_delay * 2^n), so the first attempts come
+    quickly and a robot that's rebooting isn't hammered. Keeps trying till it connects or the
+    operator disconnects.
+    """
+
+    def __init__(self, base_delay: float = 0.25, max_delay: float = 8.0) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def supervise(self, service: ConnectionService):
+        Thread(name="Con-Supervisor", target=self.supervisor_job, args=[service], daemon=True).start()
+
+    def delay(self, attempt: int) -> float:
+        return uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def supervisor_job(self, service: ConnectionService):
+        lost_at = monotonic()
+        attempt = 0
+        while service.reconnecting.is_set():
+            delay = self.delay(attempt)
+            attempt += 1
+            service.callback.on_reconnecting(attempt, delay)
+            if service.abort_reconnect.wait(delay):
+                break
+            try:
+                ConnectionHandler.establish(service)
+            except (OSError, SocketError) as e:
+                service.conn_switcher.clear()
+                service.logger.warning(f"Reconnect attempt {attempt} failed. Reason: '{e}'")
+                continue
+            if not service.connected:
+                service.logger.warning(f"Reconnect attempt {attempt} failed. Reason: 'Dropped while negotiating'")
+                continue
+            if service.abort_reconnect.is_set():
+                # Operator disconnected while the attempt was on its way
+                service.conn_switcher.clear()
+                service.socket.close()
+                break
+            downtime = monotonic() - lost_at
+            service.recoveries.append((downtime, attempt))
+            service.reconnecting.clear()
+            service.logger.success(f"Reconnected to robot after {downtime:.2f} s in {attempt} attempts | "
+                                   f"Rejected commands: {service.rejected}")
+            service.callback.on_connect()
+            service.callback.on_reconnect(downtime, attempt)
+            return
+        service.logger.info("ReconnectSupervisor finished his job.")
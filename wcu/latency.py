@@ -0,0 +1,124 @@
+import os
+from collections import deque
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+import app_utils as utils
+
+
+class LatencyHistogram:
+    """ Rolling window of latency samples in milliseconds.
+
+    Keeps the samples of the last window seconds, capped at max_samples, and reports percentiles
+    over them, so numbers follow the link as it changes instead of averaging the whole session.
+    """
+
+    def __init__(self, window: float = 30.0, max_samples: int = 4096) -> None:
+        self.window = window
+        self.samples = deque(maxlen=max_samples)  # (monotonic time, ms)
+
+    def add(self, value: float):
+        self.samples.append((monotonic(), value))
+
+    def __expire(self):
+        oldest = monotonic() - self.window
+        while self.samples and self.samples[0][0] < oldest:
+            self.samples.popleft()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentiles(self, *percents) -> list:
+        """
+        Returns:
+            list: Sample at every given percent (nearest rank), or None for each if there are no samples
+        """
+        self.__expire()
+        if not self.samples:
+            return [None] * len(percents)
+        values = sorted(sample[1] for sample in self.samples)
+        return [values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))] for percent in percents]
+
+
+class LatencyTracker:
+    """ Collects the echoes of traced control commands.
+
+    Round trip is measured on WCU's clock alone. Every robot stamp is on the robot's clock, so only
+    differences between robot stamps are used: actuation latency is half of the round trip spent
+    outside the robot (the one-way network delay) plus the time from receiving to actuating the
+    command. Neither side needs synchronized clocks.
+    """
+
+    PERCENTS = (50, 95, 99)
+
+    def __init__(self, window: float = 30.0, max_records: int = 100000) -> None:
+        self.lock = Lock()
+        self.round_trip = LatencyHistogram(window)
+        self.actuation = LatencyHistogram(window)
+        # Latest echoes for dumping
+        self.records = deque(maxlen=max_records)
+        self.echoes = 0
+        self.not_actuated = 0
+        # Throughput
+        self.window = window
+        self.sends = deque()
+        self.started_at = monotonic()
+
+    def on_sent(self):
+        """ Counts a control command sent to robot, traced or not """
+        with self.lock:
+            now = monotonic()
+            self.sends.append(now)
+            while self.sends[0] < now - self.window:
+                self.sends.popleft()
+
+    def on_echo(self, raw_echo: bytes):
+        rcvd_at = utils.now_us()
+        _, seq, sent_at, received_at, decoded_at, actuated_at, echoed_at = utils.Opcodes.TRACE_ECHO_STRUCT.unpack(
+            raw_echo)
+        round_trip = (rcvd_at - sent_at) / 1000
+        one_way = max(0.0, round_trip - (echoed_at - received_at) / 1000) / 2
+        actuation = one_way + (actuated_at - received_at) / 1000 if actuated_at else None
+        with self.lock:
+            self.echoes += 1
+            self.round_trip.add(round_trip)
+            if actuation is not None:
+                self.actuation.add(actuation)
+            else:
+                # Coalesced or dropped by the robot, or nothing to actuate
+                self.not_actuated += 1
+            self.records.append((seq, round_trip, (decoded_at - received_at) / 1000, actuation))
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: p50, p95 and p99 in milliseconds of round trip ('rtt') and actuation ('act'),
+                and commands sent per second ('rate')
+        """
+        with self.lock:
+            now = monotonic()
+            while self.sends and self.sends[0] < now - self.window:
+                self.sends.popleft()
+            return {
+                'rate': len(self.sends) / max(1.0, min(self.window, now - self.started_at)),
+                'rtt': self.round_trip.percentiles(*self.PERCENTS),
+                'act': self.actuation.percentiles(*self.PERCENTS),
+                'samples': len(self.round_trip),
+                'not_actuated': self.not_actuated,
+            }
+
+    def dump(self, directory: str = utils.LATENCY_FOLDER) -> str:
+        """ Writes the latest echoes as CSV
+
+        Returns:
+            str: Path of the written file
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, datetime.now().strftime('latency_%Y%m%d_%H%M%S.csv'))
+        with self.lock:
+            records = list(self.records)
+        with open(path, 'w') as dump_file:
+            dump_file.write('seq,rtt_ms,decode_ms,actuation_ms\n')
+            for seq, round_trip, decode, actuation in records:
+                dump_file.write(f"{seq},{round_trip:.3f},{decode:.3f},{'' if actuation is None else f'{actuation:.3f}'}\n")
+        return path
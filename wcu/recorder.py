@@ -0,0 +1,236 @@
+import os
+import struct
+from bisect import bisect_left
+from datetime import datetime
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import monotonic
+from logger import Logger
+
+
+class RecordingIndex:
+    """ Sidecar index of a recording segment.
+
+    File starts with MAGIC, then holds one ENTRY per frame: offset of the frame in the segment,
+    its size and its capture time in microseconds since epoch. Any frame can be found by time
+    and read straight from the segment without scanning it.
+    """
+
+    MAGIC = b'RLIDX001'
+    ENTRY = struct.Struct("<QIQ")
+
+    def __init__(self, entries: list) -> None:
+        # [(offset, size, timestamp), ...]
+        self.entries = entries
+        self.timestamps = [entry[2] for entry in entries]
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, 'rb') as index_file:
+            data = index_file.read()
+        if not data.startswith(cls.MAGIC):
+            raise ValueError(f"'{path}' isn't a recording index.")
+        # A partial entry at the end means recording was interrupted while writing it
+        count = (len(data) - len(cls.MAGIC)) // cls.ENTRY.size
+        return cls([cls.ENTRY.unpack_from(data, len(cls.MAGIC) + i * cls.ENTRY.size) for i in range(count)])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, timestamp: int) -> int:
+        """ Returns index of the first frame captured at or after the given timestamp """
+        return min(bisect_left(self.timestamps, timestamp), len(self.entries) - 1)
+
+
+class RecordingReader:
+    """ Reads frames of a recorded segment by index or capture time """
+
+    def __init__(self, segment_path: str) -> None:
+        self.segment_path = segment_path
+        self.index = RecordingIndex.load(os.path.splitext(segment_path)[0] + StreamRecorder.INDEX_EXTENSION)
+        self.segment = open(segment_path, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def read_frame(self, number: int) -> tuple:
+        """
+        Returns:
+            tuple: (JPEG data, capture timestamp) of the frame
+        """
+        offset, size, timestamp = self.index.entries[number]
+        self.segment.seek(offset)
+        return self.segment.read(size), timestamp
+
+    def frame_at(self, timestamp: int) -> tuple:
+        return self.read_frame(self.index.find(timestamp))
+
+    def close(self):
+        self.segment.close()
+
+
+class StreamRecorder:
+    """ Records received JPEG frames as they are, without re-encoding, into segmented MJPEG files.
+
+    Every segment is a plain concatenation of JPEG frames that players read as MJPEG, with a
+    RecordingIndex sidecar next to it. Frames are queued and written by a background thread that
+    fsyncs in batches, so recording never slows down viewing the stream. When the writer falls
+    behind, new frames are dropped instead of blocking the stream thread. Stopping doesn't wait
+    for the writer either, it reports back once every queued frame is on disk.
+    """
+
+    SEGMENT_EXTENSION = '.mjpeg'
+    INDEX_EXTENSION = '.idx'
+
+    def __init__(self, directory: str, segment_duration: float = 60, segment_size: int = 256 * 1024 * 1024,
+                 sync_interval: float = 1.0, queue_size: int = 120) -> None:
+        """
+        :param directory: Where segments are written
+        :param segment_duration: Max seconds of stream per segment
+        :param segment_size: Max bytes per segment
+        :param sync_interval: Seconds between fsyncs of written frames
+        :param queue_size: Frames waiting to be written before new ones are dropped
+        """
+        self.logger = Logger("StreamRecorder")
+        self.directory = directory
+        self.segment_duration = segment_duration
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        # Bounded by record only, so stopping can always queue its sentinel without blocking
+        self.queue = Queue()
+        self.queue_size = queue_size
+        self.name = datetime.now().strftime('stream_%Y%m%d_%H%M%S')
+        self.writer_thread = None
+        self.failed = False
+        # Called once writer has finished
+        self.lock = Lock()
+        self.finished = False
+        self.on_stopped = None
+        # Segment runtime
+        self.segment = None
+        self.index = None
+        self.segment_paths = []
+        self.segment_started_at = 0.0
+        # Stats
+        self.frames_recorded = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self.syncs = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.writer_thread is not None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.writer_thread = Thread(name="StreamRecorder-Writer", target=self.__writer_job, daemon=True)
+        self.writer_thread.start()
+        self.logger.info(f"Recording stream to '{self.directory}' as '{self.name}'.")
+
+    def record(self, frame):
+        """ Queues a received frame to be written. Its data is copied, so the frame can be released right after """
+        if not self.recording or self.failed:
+            return
+        if self.queue.qsize() >= self.queue_size:
+            self.frames_dropped += 1
+            self.logger.warning("Recorder can't keep up, dropped a frame.", every=1.0)
+            return
+        self.queue.put_nowait((frame.tobytes(), frame.timestamp))
+
+    def stop(self, on_stopped=None):
+        """ Stops taking frames and lets the writer close the recording once every queued frame is written.
+        Returns right away.
+
+        :param on_stopped: Called with the recorder on the writer thread once recording is closed
+        """
+        if not self.recording:
+            return
+        self.writer_thread = None
+        with self.lock:
+            if not self.finished:
+                self.on_stopped = on_stopped
+                self.queue.put_nowait(None)
+                return
+        # Writer has already stopped on an error
+        if on_stopped is not None:
+            on_stopped(self)
+
+    def __open_segment(self):
+        path = os.path.join(self.directory, f"{self.name}_{len(self.segment_paths):03d}")
+        self.segment = open(path + self.SEGMENT_EXTENSION, 'wb')
+        self.index = open(path + self.INDEX_EXTENSION, 'wb')
+        self.index.write(RecordingIndex.MAGIC)
+        self.segment_paths.append(path + self.SEGMENT_EXTENSION)
+        self.segment_started_at = monotonic()
+
+    def __sync(self):
+        # Segment data first, so the index never points at frames that aren't on disk
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self.syncs += 1
+
+    def __close_segment(self):
+        self.__sync()
+        self.segment.close()
+        self.index.close()
+        self.segment = self.index = None
+
+    def __write(self, data: bytes, timestamp: int):
+        if self.segment is None:
+            self.__open_segment()
+        elif (self.segment.tell() + len(data) > self.segment_size or
+              monotonic() - self.segment_started_at >= self.segment_duration):
+            self.__close_segment()
+            self.__open_segment()
+        offset = self.segment.tell()
+        self.segment.write(data)
+        self.index.write(RecordingIndex.ENTRY.pack(offset, len(data), timestamp))
+        self.frames_recorded += 1
+        self.bytes_written += len(data)
+
+    def __writer_job(self):
+        last_sync = monotonic()
+        unsynced = False
+        try:
+            while True:
+                try:
+                    # Wake up on the sync deadline too, so frames written before a stall reach the disk
+                    item = self.queue.get(timeout=max(0.0, self.sync_interval - (monotonic() - last_sync)))
+                except Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    self.__write(*item)
+                    unsynced = True
+                if monotonic() - last_sync >= self.sync_interval:
+                    if unsynced and self.segment is not None:
+                        self.__sync()
+                        unsynced = False
+                    last_sync = monotonic()
+        except OSError as e:
+            self.failed = True
+            self.logger.error(f"Recording has stopped. Reason: '{e}'")
+        finally:
+            try:
+                if self.segment is not None:
+                    self.__close_segment()
+            except OSError as e:
+                self.failed = True
+                self.logger.error(f"Can't close recording. Reason: '{e}'")
+            self.logger.info(f"Recorded {self.frames_recorded} frames in {len(self.segment_paths)} segments | "
+                             f"{self.bytes_written / 1024 ** 2:.1f} MBs | Dropped: {self.frames_dropped} | "
+                             f"Syncs: {self.syncs}")
+            with self.lock:
+                self.finished = True
+                on_stopped = self.on_stopped
+            if on_stopped is not None:
+                on_stopped(self)
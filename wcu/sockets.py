@@ -1,5 +1,9 @@
 import socket as sockets
+import struct
 import uuid
+from collections import deque
+from threading import Lock
+from time import monotonic
 
 def get_my_addr():
     return sockets.gethostbyaddr(sockets.gethostname())[0]
@@ -7,6 +11,53 @@ def get_my_addr():
 def get_my_host():
     return sockets.gethostname()
 
+class HostResolver:
+    """ Caches resolved host addresses for ttl seconds.
+
+    Lookups on a slow mDNS/DNS take seconds, so a cached address is reused till it expires or a
+    connection to it fails. When a lookup fails, the last known address is used if there is one.
+    """
+
+    def __init__(self, ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self.lock = Lock()
+        self.cache: dict[str, tuple] = {}  # hostname -> (address, resolved at)
+        # Stats
+        self.hits = 0
+        self.lookups = 0
+
+    def resolve(self, hostname: str) -> str:
+        """
+        Raises:
+            gaierror: If hostname can't be resolved and was never resolved before
+        """
+        # One lookup at a time, whoever waits gets the fresh result from the cache
+        with self.lock:
+            entry = self.cache.get(hostname, None)
+            if entry is not None and monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            self.lookups += 1
+            try:
+                address = sockets.gethostbyname(hostname)
+            except sockets.gaierror:
+                if entry is None:
+                    raise
+                # Stale address is still the best guess
+                return entry[0]
+            self.cache[hostname] = (address, monotonic())
+            return address
+
+    def invalidate(self, hostname: str):
+        """ Expires the cached address, e.g. after a connection to it failed, so next resolve looks it up again """
+        with self.lock:
+            entry = self.cache.get(hostname, None)
+            if entry is not None:
+                self.cache[hostname] = (entry[0], float('-inf'))
+
+# Shared by control and stream connections
+shared_resolver = HostResolver()
+
 class SocketError(Exception):
     """ Socket Error """
 
@@ -17,6 +68,52 @@ class SocketError(Exception):
 class ConnectionClosedUnexpectedlyError(SocketError):
     pass
 
+class MessageFramer:
+    """ Incremental parser for length-prefixed messages sent over a stream socket """
+
+    HEADER = struct.Struct("<H")
+    MAX_MESSAGE_SIZE = 0xFFFF
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    @classmethod
+    def frame(cls, payload) -> bytes:
+        """ Prefixes the payload with its length so it can be split again on the other end
+
+        Raises:
+            SocketError: If payload can't fit in a single frame
+        """
+        if type(payload) is str:
+            payload = payload.encode('utf-8')
+        if len(payload) > cls.MAX_MESSAGE_SIZE:
+            raise SocketError(f"Message of size {len(payload)} exceeds the max frame size.")
+        return cls.HEADER.pack(len(payload)) + payload
+
+    def feed(self, data: bytes) -> list:
+        """ Appends received bytes and returns every message that became complete
+
+        Partial messages are kept buffered till the rest of their bytes arrive.
+        """
+        self._buffer += data
+        messages = []
+        offset = 0
+        header_size = self.HEADER.size
+        while len(self._buffer) - offset >= header_size:
+            size = self.HEADER.unpack_from(self._buffer, offset)[0]
+            end = offset + header_size + size
+            if end > len(self._buffer):
+                break
+            messages.append(bytes(self._buffer[offset + header_size:end]))
+            offset = end
+        if offset:
+            del self._buffer[:offset]
+        return messages
+
+    def reset(self):
+        self._buffer.clear()
+
+
 class NetAddress:
 
     def __init__(self, host: str, port: int) -> None:
@@ -93,6 +190,11 @@ class ClientSocket:
             self._socket = sockets.socket(sockets.AF_INET, sockets.SOCK_STREAM)
         # Generate UUID for this client
         self._uid = uuid.uuid1().hex
+        # Message framing runtime
+        self._framer = MessageFramer()
+        self._messages = deque()
+        # Messages are sent from GUI and heartbeat threads, frames must not interleave
+        self._send_lock = Lock()
 
     def __getitem__(self, buffer_size: int = 1024):
         return self.receive(buffer_size)
@@ -125,6 +227,54 @@ class ClientSocket:
     def receive(self, buffer_size: int = 1024) -> bytes:
         return self._socket.recv(buffer_size)
 
+    def receive_into(self, buffer, nbytes: int) -> int:
+        """ Fills the first nbytes of a writable buffer straight from the socket without allocating
+
+        Returns:
+            int: Number of bytes received, less than nbytes only if the peer closed the connection
+        """
+        view = memoryview(buffer)
+        received = 0
+        while received < nbytes:
+            count = self._socket.recv_into(view[received:nbytes], nbytes - received)
+            if not count:
+                break
+            received += count
+        return received
+
+    def send_message(self, data) -> int:
+        """ Sends data as a single length-prefixed message
+
+        Returns:
+            int: Number of bytes written to the socket including the header
+        """
+        if self.closed:
+            raise SocketError('Socket is closed.')
+        frame = MessageFramer.frame(data)
+        with self._send_lock:
+            self._socket.sendall(frame)
+        return len(frame)
+
+    def receive_message(self, buffer_size: int = 1024) -> bytes:
+        """ Receives the next complete message sent through send_message
+
+        Messages that arrive coalesced in one read are queued and returned by the next calls
+        without touching the socket, while partial reads are kept till completed.
+
+        Returns:
+            bytes: Message payload, or empty bytes if the peer closed the connection
+        """
+        while not self._messages:
+            chunk = self._socket.recv(buffer_size)
+            if not chunk:
+                return b''
+            self._messages.extend(self._framer.feed(chunk))
+        return self._messages.popleft()
+
+    @property
+    def has_pending_messages(self) -> bool:
+        return len(self._messages) > 0
+
     def close(self):
         if not self.closed:
             self._socket.close()
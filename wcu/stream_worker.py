@@ -1,14 +1,12 @@
-import os
 import struct
-import pickle
-from PIL import Image
-from io import BytesIO
 import app_utils as utils
+from time import time
 from logger import Logger
-from threading import Thread, Event
-from sockets import ClientSocket
+from threading import Thread, Event, Lock
+from sockets import ClientSocket, shared_resolver
+from recorder import StreamRecorder
 from socket import (
-    gethostbyname,
+    SHUT_RDWR,
     gaierror as GetAddressInfoError,
     timeout as SocketTimeoutError
 )
@@ -28,6 +26,29 @@ class StreamViewerCallback:
     def on_stream_receive_frame(self, frame):
         pass
 
+    def on_recording_stopped(self, recorder):
+        """ Called on the writer thread of recorder once every frame it took is written and it's closed """
+        pass
+
+    def on_stream_frame_ready(self, frames):
+        """ Called on the stream thread when the newest frame is waiting in an empty slot.
+        Override it to hand the frame over to another thread; by default it's delivered right away.
+        """
+        self.deliver_latest_frame(frames)
+
+    def deliver_latest_frame(self, frames):
+        frame = frames.take()
+        if frame is None:
+            return
+        try:
+            if frames.taken == 1:
+                self.on_stream_first_frame(frame)
+            else:
+                self.on_stream_receive_frame(frame)
+        finally:
+            # Frame buffer goes back to the pool, callbacks must not keep it
+            frame.release()
+
     def on_stream_stop(self):
         pass
 
@@ -35,10 +56,142 @@ class StreamViewerCallback:
         pass
 
 
+class Frame:
+    """ Received frame living in a pooled buffer. Has to be released once its data is no longer used """
+
+    __slots__ = ('buffer', 'size', 'pool', 'timestamp')
+
+    def __init__(self, buffer: bytearray, size: int, pool, timestamp: int = 0) -> None:
+        self.buffer = buffer
+        self.size = size
+        self.pool = pool
+        # Capture time on robot in microseconds since epoch
+        self.timestamp = timestamp
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.buffer)[:self.size]
+
+    @property
+    def latency_ms(self) -> float:
+        """ Time since the frame was captured, assuming robot and WCU clocks are synced (NTP) """
+        return (time() * 1_000_000 - self.timestamp) / 1000
+
+    def tobytes(self) -> bytes:
+        return bytes(self.view)
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.release(self.buffer)
+            self.pool = None
+
+
+class FrameBufferPool:
+    """ Reusable frame buffers so receiving a frame doesn't allocate """
+
+    def __init__(self, buffer_size: int = utils.FRAME_BUFFER_SIZE, count: int = 3) -> None:
+        self.buffer_size = buffer_size
+        self.lock = Lock()
+        self.free = [bytearray(buffer_size) for _ in range(count)]
+        self.allocations = count
+
+    def acquire(self, size: int) -> Frame:
+        with self.lock:
+            for index, buffer in enumerate(self.free):
+                if len(buffer) >= size:
+                    return Frame(self.free.pop(index), size, self)
+            # Every buffer is in use or too small for this frame
+            self.allocations += 1
+        return Frame(bytearray(max(size, self.buffer_size)), size, self)
+
+    def release(self, buffer: bytearray):
+        with self.lock:
+            self.free.append(buffer)
+
+
+class FrameReceiver:
+    """ Reads frames prefixed with their size and capture time from a stream socket into pooled buffers using recv_into """
+
+    HEADER = utils.FRAME_HEADER
+
+    def __init__(self, socket: ClientSocket, pool: FrameBufferPool) -> None:
+        self.socket = socket
+        self.pool = pool
+        self.header = bytearray(self.HEADER.size)
+
+    def receive_frame(self) -> Frame | None:
+        """
+        Returns:
+            Frame | None: Received frame, or None if stream has ended
+        """
+        if self.socket.receive_into(self.header, self.HEADER.size) < self.HEADER.size:
+            return None
+        frameSize, timestamp = self.HEADER.unpack_from(self.header)
+        if not frameSize:
+            return None
+        frame = self.pool.acquire(frameSize)
+        frame.timestamp = timestamp
+        if self.socket.receive_into(frame.buffer, frameSize) < frameSize:
+            frame.release()
+            return None
+        return frame
+
+
+class FrameSlot:
+    """ Single-slot buffer between the stream thread and whoever shows frames.
+
+    Putting a frame replaces the one still waiting, so the consumer always gets the newest
+    frame and stale ones are dropped when it can't keep up.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.frame = None
+        # Counters
+        self.received = 0
+        self.taken = 0
+        self.dropped = 0
+
+    def put(self, frame) -> bool:
+        """ Returns True if the slot was empty, which means the consumer has to be notified """
+        with self.lock:
+            stale, self.frame = self.frame, frame
+            self.received += 1
+            if stale is not None:
+                self.dropped += 1
+        if stale is None:
+            return True
+        stale.release()
+        return False
+
+    def take(self):
+        with self.lock:
+            frame, self.frame = self.frame, None
+            if frame is not None:
+                self.taken += 1
+            return frame
+
+    def reset(self):
+        with self.lock:
+            stale, self.frame = self.frame, None
+            self.received = 0
+            self.taken = 0
+            self.dropped = 0
+        if stale is not None:
+            stale.release()
+
+
 class StreamViewer:
 
     def __init__(self, callback: StreamViewerCallback) -> None:
         # StreamViewer runtime
+        self.pool = FrameBufferPool()
+        self.frames = FrameSlot()
+        self.recorder = None
+        self.socket = None
         self.switcher = Event()
         self.logger = Logger("StreamViewer")
         self.callback = callback
@@ -55,10 +208,34 @@ class StreamViewer:
         # Start a new StreamHandler instance
         StreamHandler().handle_stream(self)
 
+    @property
+    def recording(self) -> bool:
+        return self.recorder is not None
+
+    def start_recording(self, directory: str = utils.RECORDINGS_FOLDER) -> StreamRecorder:
+        """ Starts recording every received frame into directory till recording or stream is stopped """
+        if self.recorder is None:
+            recorder = StreamRecorder(directory)
+            recorder.start()
+            self.recorder = recorder
+        return self.recorder
+
+    def stop_recording(self):
+        """ Stops recording without waiting for queued frames to be written, see on_recording_stopped """
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.stop(self.callback.on_recording_stopped)
+
     def stop_stream_view(self):
         if self.viewing_stream:
             try:
                 self.switcher.clear()
+                # Wake the handler up if it's waiting on a frame that may never come
+                if self.socket is not None and not self.socket.closed:
+                    try:
+                        self.socket.shutdown(SHUT_RDWR)
+                    except OSError:
+                        pass
                 self.callback.on_stream_stop()
                 self.logger.info("Stopped viewing robot stream.")
             except:
@@ -78,60 +255,58 @@ class StreamHandler:
         streamSocket.settimeout(10)
         try:
             viewer.switcher.clear()
-            received_first_frame = False
+            viewer.frames.reset()
             # Resolve the address of robot will be connected on
             viewer.callback.on_stream_connecting()
             viewer.logger.info("Connecting to stream...")
             # Connection runtime
-            robot_host = gethostbyname(utils.ROBOT_HOSTNAME)
+            robot_host = shared_resolver.resolve(utils.ROBOT_HOSTNAME)
             address = (robot_host, utils.PORT_RTV_SOCKET)
             viewer.logger.success(f"Found 'rloader' at '{robot_host}'")
             # Connect to stream
+            viewer.socket = streamSocket
             streamSocket.connect(address)
             # Notify callback
             viewer.switcher.set()
             viewer.callback.on_stream_start()
-            # Create byte-like connection for reading stream
-            connection = streamSocket.makefile('rb')
+            receiver = FrameReceiver(streamSocket, viewer.pool)
             viewer.logger.success("Established a connection to stream successfully.")
             # Start StreamReceiver job
             while viewer.switcher.is_set():
-                # Receive frame size from connection
-                frameSize = struct.unpack('<L', connection.read(struct.calcsize('<L')))[0]
-                if not frameSize:
-                        # Received an empty packet
-                        streamSocket.close()
-                        viewer.switcher.clear()
-                        viewer.logger.info("Received empty packet from stream connection.")
-                # Receive frame data
-                frame_data = BytesIO()
-                frame_data.write(connection.read(frameSize))
-                frame_data.seek(0)
-                # Handle the frame
-                image = Image.open(frame_data)
-                try:
-                    os.mkdir(os.path.relpath('stream'))
-                    viewer.logger.success("Stream folder created.")
-                except FileExistsError:
-                    pass
-                image.save(os.path.relpath('stream\\lastFrame.jpeg'))
-                # Pass frame to GUI through callback
-                if not received_first_frame:
-                    received_first_frame = True
-                    viewer.callback.on_stream_first_frame(image)
-                else:
-                    viewer.callback.on_stream_receive_frame(image)
+                # Receive frame as it was encoded by robot, GUI decodes it straight from memory
+                frame = receiver.receive_frame()
+                if frame is None:
+                    # Received an empty packet
+                    streamSocket.close()
+                    viewer.switcher.clear()
+                    viewer.logger.info("Received empty packet from stream connection.")
+                    break
+                # Record frame as it was received before GUI gets it
+                recorder = viewer.recorder
+                if recorder is not None:
+                    recorder.record(frame)
+                # Replace any frame GUI didn't take yet and notify it only if it had nothing waiting
+                if viewer.frames.put(frame):
+                    viewer.callback.on_stream_frame_ready(viewer.frames)
         except struct.error:
             viewer.switcher.clear()
         except GetAddressInfoError:
             viewer.logger.error("Can't find 'rloader' host on network.")
             viewer.callback.on_stream_fail("Can't find 'rloader' host on network.")
         except (TimeoutError, SocketTimeoutError):
+            shared_resolver.invalidate(utils.ROBOT_HOSTNAME)
             viewer.logger.error("Timeout while trying to connect.")
             viewer.callback.on_stream_fail("Timeout while trying to connect.")
         except ConnectionRefusedError:
             viewer.logger.error("Stream was refused by the target machine.")
             viewer.callback.on_stream_fail("Stream was refused by the target machine.")
+        except OSError as e:
+            # Closed by stop_stream_view, or stream connection dropped
+            if viewer.socket is streamSocket and viewer.switcher.is_set():
+                viewer.switcher.clear()
+                viewer.logger.error(f"Stream connection was lost. Reason: '{e}'")
         finally:
             streamSocket.close()
+            viewer.stop_recording()
+            viewer.logger.info(f"Frames received: {viewer.frames.received}, dropped before display: {viewer.frames.dropped}")
             viewer.logger.info("StreamHandler finished his job.")
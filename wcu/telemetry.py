@@ -0,0 +1,108 @@
+import os
+import struct
+from collections import deque, namedtuple
+from datetime import datetime
+from threading import Lock
+import app_utils as utils
+
+TelemetryRecord = namedtuple('TelemetryRecord', utils.Telemetry.FIELDS)
+
+
+def decode_batch(payload) -> list:
+    """ Decodes a telemetry batch pushed by robot, see app_utils.Telemetry for the layout
+
+    Returns:
+        list: TelemetryRecord of every sample in the batch
+    """
+    _, count = utils.Opcodes.TELEMETRY_STRUCT.unpack_from(payload)
+    offset = utils.Opcodes.TELEMETRY_STRUCT.size
+    fields = len(utils.Telemetry.FIELDS)
+    values = [0] * fields
+    records = []
+    for _ in range(count):
+        mask, offset = utils.read_varint(payload, offset)
+        for index in range(fields):
+            if mask & (1 << index):
+                delta, offset = utils.read_varint(payload, offset)
+                values[index] += utils.unzigzag(delta)
+        records.append(TelemetryRecord(*values))
+    return records
+
+
+class TelemetryBuffer:
+    """ Ring buffer of the latest telemetry records pushed by robot """
+
+    def __init__(self, capacity: int = utils.TELEMETRY_HISTORY * utils.TELEMETRY_RATE) -> None:
+        self.lock = Lock()
+        self.records = deque(maxlen=max(1, capacity))
+        # Stats
+        self.batches = 0
+        self.records_received = 0
+        self.bytes_received = 0
+        self.malformed = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def capacity(self) -> int:
+        return self.records.maxlen
+
+    def resize(self, capacity: int):
+        """ Keeps up to capacity records from now on, dropping the oldest ones that don't fit anymore """
+        with self.lock:
+            self.records = deque(self.records, maxlen=max(1, capacity))
+
+    def ingest(self, payload: bytes) -> int:
+        """
+        Returns:
+            int: Number of records ingested from the batch
+        """
+        try:
+            records = decode_batch(payload)
+        except (IndexError, ValueError, struct.error):
+            self.malformed += 1
+            return 0
+        with self.lock:
+            self.records.extend(records)
+            self.batches += 1
+            self.records_received += len(records)
+            self.bytes_received += len(payload)
+        return len(records)
+
+    def latest(self) -> TelemetryRecord | None:
+        with self.lock:
+            return self.records[-1] if self.records else None
+
+    def snapshot(self, seconds: float | None = None) -> list:
+        """ Returns records of the last given seconds of robot time, or every record kept """
+        with self.lock:
+            records = list(self.records)
+        if seconds is None or not records:
+            return records
+        oldest = records[-1].time_us - int(seconds * 1000000)
+        return [record for record in records if record.time_us >= oldest]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'batches': self.batches,
+                'records': self.records_received,
+                'bytes_per_record': self.bytes_received / self.records_received if self.records_received else 0.0,
+                'malformed': self.malformed,
+            }
+
+    def dump(self, directory: str = utils.TELEMETRY_FOLDER) -> str:
+        """ Writes every kept record as CSV
+
+        Returns:
+            str: Path of the written file
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, datetime.now().strftime('telemetry_%Y%m%d_%H%M%S.csv'))
+        records = self.snapshot()
+        with open(path, 'w') as dump_file:
+            dump_file.write(','.join(utils.Telemetry.FIELDS) + '\n')
+            for record in records:
+                dump_file.write(','.join(str(value) for value in record) + '\n')
+        return path
@@ -0,0 +1,91 @@
+from PyQt5 import QtGui, QtWidgets, QtCore
+from app_utils import GuiColors, Telemetry
+from telemetry import TelemetryBuffer
+
+
+class TelemetryWindow(QtWidgets.QWidget):
+    """ Plots the latest telemetry of robot, refreshed a few times per second.
+
+    Lanes from top: sound heard in the last window against the buzzer target, LF sensors with
+    automatic driving state, and telemetry loop lateness as a sign of how busy robot is.
+    """
+
+    SECONDS = 20
+    REFRESH_MS = 200
+    LANES = ('Sound', 'LF sensors', 'Loop lateness (ms)')
+
+    def __init__(self, buffer: TelemetryBuffer):
+        super(TelemetryWindow, self).__init__()
+        self.buffer = buffer
+        self.setWindowTitle('Robot Telemetry')
+        self.setMinimumSize(900, 600)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.update)
+
+    def showEvent(self, event: QtGui.QShowEvent) -> None:
+        self.timer.start(self.REFRESH_MS)
+        return super().showEvent(event)
+
+    def hideEvent(self, event: QtGui.QHideEvent) -> None:
+        self.timer.stop()
+        return super().hideEvent(event)
+
+    def paintEvent(self, event: QtGui.QPaintEvent) -> None:
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        painter.setFont(QtGui.QFont('monospace', 11))
+        records = self.buffer.snapshot(self.SECONDS)
+        padding, lane_gap = 15, 30
+        lane_height = (self.height() - 2 * padding - lane_gap * len(self.LANES)) // len(self.LANES)
+        lanes = [QtCore.QRect(padding, padding + lane_gap + index * (lane_height + lane_gap),
+                              self.width() - 2 * padding, lane_height) for index in range(len(self.LANES))]
+        for title, lane in zip(self.LANES, lanes):
+            painter.setPen(QtGui.QColor(GuiColors.BLACK))
+            painter.drawRect(lane)
+            painter.drawText(lane.left(), lane.top() - 8, title)
+        if len(records) < 2:
+            painter.drawText(lanes[0], QtCore.Qt.AlignmentFlag.AlignCenter, 'Waiting for telemetry...')
+            return
+        end = records[-1].time_us
+        start = end - self.SECONDS * 1000000
+        sound_max = max(max(record.sound_target, record.sound) for record in records) or 1
+        lateness_max = max(max(record.lateness_us for record in records) / 1000, 1.0)
+        self.__plot(painter, lanes[0], records, start, end, lambda record: record.sound / sound_max, GuiColors.BLUE)
+        self.__plot(painter, lanes[0], records, start, end, lambda record: record.sound_target / sound_max,
+                    GuiColors.RED, QtCore.Qt.PenStyle.DashLine)
+        self.__plot(painter, lanes[1], records, start, end,
+                    lambda record: 0.9 if record.flags & Telemetry.FLAG_LEFT_LF else 0.55, GuiColors.BLUE)
+        self.__plot(painter, lanes[1], records, start, end,
+                    lambda record: 0.45 if record.flags & Telemetry.FLAG_RIGHT_LF else 0.1, GuiColors.GREEN)
+        self.__plot(painter, lanes[1], records, start, end,
+                    lambda record: 1.0 if record.flags & Telemetry.FLAG_AUTO else 0.0, GuiColors.RED,
+                    QtCore.Qt.PenStyle.DotLine)
+        self.__plot(painter, lanes[2], records, start, end, lambda record: record.lateness_us / 1000 / lateness_max,
+                    GuiColors.BLUE)
+        latest = records[-1]
+        painter.setPen(QtGui.QColor(GuiColors.BLACK))
+        painter.drawText(lanes[0].adjusted(5, 5, -5, -5), QtCore.Qt.AlignmentFlag.AlignRight,
+                         f"now {latest.sound} | peak {latest.sound_peak} | target {latest.sound_target} | "
+                         f"overruns {latest.sound_overruns}")
+        painter.drawText(lanes[1].adjusted(5, 5, -5, -5), QtCore.Qt.AlignmentFlag.AlignRight,
+                         f"L {'black' if latest.flags & Telemetry.FLAG_LEFT_LF else 'white'} | "
+                         f"R {'black' if latest.flags & Telemetry.FLAG_RIGHT_LF else 'white'} | "
+                         f"{'auto' if latest.flags & Telemetry.FLAG_AUTO else 'manual'}"
+                         f"{', idle' if latest.flags & Telemetry.FLAG_IDLE else ''} | "
+                         f"output {latest.flags >> Telemetry.OUTPUT_SHIFT:04b}")
+        painter.drawText(lanes[2].adjusted(5, 5, -5, -5), QtCore.Qt.AlignmentFlag.AlignRight,
+                         f"max {lateness_max:.1f} ms | drive applied {latest.applied}, coalesced {latest.coalesced}")
+
+    @staticmethod
+    def __plot(painter: QtGui.QPainter, lane: QtCore.QRect, records: list, start: int, end: int, value, color: str,
+               style=QtCore.Qt.PenStyle.SolidLine):
+        """ Draws value (0 to 1) of every record as a line across the lane """
+        span = max(1, end - start)
+        points = [QtCore.QPointF(lane.left() + lane.width() * (record.time_us - start) / span,
+                                 lane.bottom() - lane.height() * min(1.0, max(0.0, value(record))))
+                  for record in records]
+        pen = QtGui.QPen(QtGui.QColor(color))
+        pen.setWidth(2)
+        pen.setStyle(style)
+        painter.setPen(pen)
+        painter.drawPolyline(QtGui.QPolygonF(points))
@@ -1,10 +1,15 @@
-from time import sleep
+import tracemalloc
+from io import BytesIO
+from time import sleep, perf_counter
 from random import choice
+from threading import Thread
+import app_utils as utils
 from logger import Logger
 from sys import argv as args
 from connection import ConnectionService, ConnectionCallback
 from car_driver import CarManualDriver, CarDriverCallback
-from stream_worker import StreamViewer, StreamViewerCallback
+from stream_worker import StreamViewer, StreamViewerCallback, FrameReceiver, FrameBufferPool
+from sockets import ServerSocket, ClientSocket
 
 
 class TestService(ConnectionCallback):
@@ -115,22 +120,124 @@ class TestStream(StreamViewerCallback):
 
     def on_stream_first_frame(self, frame):
         return
-        self.logger.success(f"Stream received first frame. size= {frame.size()}")
+        self.logger.success(f"Stream received first frame. size= {len(frame)}")
 
-    def on_stream_receive_frame(self, image):
-        # image.show()
-        self.logger.success("Received first frame.")
+    def on_stream_receive_frame(self, frame):
+        self.logger.success("Received frame of size %d bytes, %.1f ms after capture.", len(frame), frame.latency_ms,
+                            every=1.0)
 
     def perform_test(self):
         self.viewier.start_stream_view()
 
 
+class TestFrameReceive:
+    """ Benchmarks frame reception against a local loopback sender.
+
+    Every way of receiving is run twice: once timed, and once under tracemalloc to count the bytes
+    allocated while receiving each frame.
+    """
+
+    def __new__(cls):
+        test = super().__new__(TestFrameReceive)
+        test.__init__()
+        return test
+
+    def __init__(self, frames: int = 3000, frame_size: int = 60 * 1024) -> None:
+        self.logger = Logger("TestFrameReceive")
+        self.frames = frames
+        self.frame_size = frame_size
+
+    def send_frames(self, server: ServerSocket):
+        client = server.accept()[0]
+        payload = utils.FRAME_HEADER.pack(self.frame_size, 0) + bytes(self.frame_size)
+        for _ in range(self.frames):
+            client._socket.sendall(payload)
+        client.close()
+
+    def run(self, receive_frames, on_frame):
+        server = ServerSocket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        Thread(target=self.send_frames, args=[server], daemon=True).start()
+        client = ClientSocket()
+        client.connect(server._server.getsockname())
+        try:
+            receive_frames(client, on_frame)
+        finally:
+            client.close()
+            server.close()
+
+    def measure(self, name: str, receive_frames):
+        received = 0
+        allocated = []
+        baseline = 0
+
+        def count_frame():
+            nonlocal received
+            received += 1
+
+        def trace_frame():
+            # Peak is reset after every frame so it only covers receiving the next one
+            nonlocal baseline
+            current, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - baseline)
+            tracemalloc.reset_peak()
+            baseline = current
+        # Throughput, without tracing slowing it down
+        start = perf_counter()
+        self.run(receive_frames, count_frame)
+        elapsed = perf_counter() - start
+        # Allocations
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self.run(receive_frames, trace_frame)
+        finally:
+            tracemalloc.stop()
+        # The first frames warm up buffers and socket internals
+        steady = sorted(allocated[len(allocated) // 10:]) or [0]
+        self.logger.info(f"{name}: {received} frames in {elapsed:.2f}s | "
+                         f"{received * self.frame_size / elapsed / 1024 ** 2:.1f} MB/s | "
+                         f"{received / elapsed:.0f} fps | "
+                         f"allocated per frame: median {steady[len(steady) // 2] / 1024:.1f} KB, "
+                         f"max {steady[-1] / 1024:.1f} KB | "
+                         f"total {sum(allocated) / 1024 ** 2:.1f} MB")
+
+    def receive_with_copies(self, client: ClientSocket, on_frame):
+        # Reception as it was done before buffers were pooled
+        connection = client.makefile('rb')
+        while True:
+            header = connection.read(utils.FRAME_HEADER.size)
+            if len(header) < utils.FRAME_HEADER.size:
+                return
+            frame_data = BytesIO()
+            frame_data.write(connection.read(utils.FRAME_HEADER.unpack(header)[0]))
+            frame_data.seek(0)
+            on_frame()
+
+    def receive_into_pool(self, client: ClientSocket, on_frame):
+        self.pool = FrameBufferPool()
+        receiver = FrameReceiver(client, self.pool)
+        while True:
+            frame = receiver.receive_frame()
+            if frame is None:
+                return
+            frame.release()
+            on_frame()
+
+    def perform_test(self):
+        self.measure("read + BytesIO", self.receive_with_copies)
+        self.measure("recv_into pool", self.receive_into_pool)
+        self.logger.info(f"Pool allocated {self.pool.allocations} buffers in total.")
+
 if __name__ == '__main__':
     test_type = args[1].strip().lower() if len(args) > 1 else None
     tests = {
         '-c': TestService,
         '-d': TestDriver,
-        '-s': TestStream
+        '-s': TestStream,
+        '-b': TestFrameReceive
     }
     if not test_type or not (test_type in tests):
         print("""
@@ -139,6 +246,7 @@ Available tests:
 \t -c: Test the ConnectionService
 \t -d: Test the CarManualDriver
 \t -s: Test the StreamViewer
+\t -b: Benchmark frame reception on loopback
 """)
     else:
         test = tests[test_type]